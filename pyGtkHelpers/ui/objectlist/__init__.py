@@ -10,11 +10,14 @@
     :license: LGPL 2 or later (see README/COPYING/LICENSE)
 """
 from si_prefix import si_format, si_parse
-from gi.repository import Gtk
+from gi.repository import GObject, Gtk
 import numpy as np
 
 from .column import PropertyMapper, Cell, Column
 from .view import ObjectList, ObjectTree
+from .sequence_model import SequenceModel
+from .stream import StreamTask
+from .threadsafe import ThreadSafeList
 from .combined_fields import *
 
 
@@ -51,13 +54,22 @@ def get_py_dtypes(data_frame):
         (pandas.DataFrame) : Data frame indexed by the column names from
             `data_frame`, with the columns `'i'` and `'dtype'` indicating the
             index and Python type of the corresponding `data_frame` column,
-            respectively.
+            respectively.  An object column is typed `str` if all its values
+            are strings.
     """
+    from pandas.api.types import infer_dtype
+
+    def object_dtype(column):
+        # the types of all values, checked in C by `infer_dtype`, as a single
+        # value of another type (or a missing value) cannot be stored in a
+        # `str` column
+        inferred = infer_dtype(data_frame[column], skipna=False)
+        return str if inferred in ('string', 'empty') else object
+
     df_py_dtypes = data_frame.dtypes.map(get_py_dtype).to_frame('dtype').copy()
     df_py_dtypes.loc[df_py_dtypes.dtype == object, 'dtype'] = \
         (df_py_dtypes.loc[df_py_dtypes.dtype == object].index
-         .map(lambda c: str if data_frame[c]
-              .map(lambda v: isinstance(v, str)).all() else object))
+         .map(object_dtype))
 
     df_py_dtypes.insert(0, 'i', range(df_py_dtypes.shape[0]))
     df_py_dtypes.index.name = 'column'
@@ -82,8 +94,20 @@ def get_list_store(data_frame):
     """
     df_py_dtypes = get_py_dtypes(data_frame)
     list_store = Gtk.ListStore(*df_py_dtypes.dtype)
-    for i, row_i in data_frame.iterrows():
-        list_store.append(row_i.tolist())
+    # Convert the frame to Python values once, rather than creating a
+    # `pandas.Series` per row.  Values of bool, int, float and str columns
+    # already have the type of their column, so PyGObject converts them in
+    # C; only the values of other columns are wrapped in a `GObject.Value`
+    # of their column's type.
+    columns = list(range(df_py_dtypes.shape[0]))
+    wrapped = [(j, list_store.get_column_type(j))
+               for j, dtype_j in enumerate(df_py_dtypes.dtype)
+               if dtype_j not in (bool, int, float, str)]
+    insert_with_valuesv = list_store.insert_with_valuesv
+    for row_i in data_frame.to_numpy(dtype=object).tolist():
+        for j, gtype_j in wrapped:
+            row_i[j] = GObject.Value(gtype_j, row_i[j])
+        insert_with_valuesv(-1, columns, row_i)
     return df_py_dtypes, list_store
 
 
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.background
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Computing sort orders and visibility off the main loop.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import sys
+import threading
+
+from gi.repository import GLib
+
+from .sort_engine import sort_permutation
+
+
+class BackgroundJob(object):
+    """Run a computation off the main loop, keeping only the latest result
+
+    Like `pyGtkHelpers.gthreads.AsyncTask`, each `start` supersedes the jobs
+    started before it: their results are discarded when they arrive, using a
+    counter.  The result of the latest job is passed to its callback on the
+    main loop.
+
+    Jobs run on a new daemon thread, or are submitted to `executor` (a
+    `concurrent.futures` executor) if one is set.  For a process pool, the
+    work function and its arguments must be picklable.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.counter = 0
+        self._running = None
+
+    @property
+    def pending(self):
+        """Whether the latest job has not delivered its result yet"""
+        return self._running == self.counter
+
+    def start(self, work, args, callback):
+        """Compute `work(*args)` and call `callback(result)` on the main loop
+
+        An exception raised by `work` is passed to `sys.excepthook` on the
+        main loop instead.
+        """
+        self.counter += 1
+        counter = self._running = self.counter
+        if self.executor is None:
+            thread = threading.Thread(target=self._run,
+                                      args=(counter, work, args, callback))
+            thread.daemon = True
+            thread.start()
+        else:
+            future = self.executor.submit(work, *args)
+            future.add_done_callback(
+                lambda future: self._deliver(counter, future, callback))
+
+    def cancel(self):
+        """Discard the result of any job still running"""
+        self.counter += 1
+
+    def _run(self, counter, work, args, callback):
+        try:
+            result = (work(*args), None)
+        except Exception:
+            result = (None, sys.exc_info())
+        GLib.idle_add(self._done, counter, result, callback)
+
+    def _deliver(self, counter, future, callback):
+        try:
+            result = (future.result(), None)
+        except Exception:
+            result = (None, sys.exc_info())
+        GLib.idle_add(self._done, counter, result, callback)
+
+    def _done(self, counter, result, callback):
+        if counter != self.counter:
+            # superseded by a newer job
+            return False
+        self._running = None
+        value, error = result
+        if error is not None:
+            sys.excepthook(*error)
+        else:
+            callback(value)
+        return False
+
+
+def key_permutation(items, key, reverse=False):
+    """Return the permutation sorting `items` by `key(item)`
+
+    See `sort_permutation`.  This is a module level function so it can be
+    run in a process pool.
+    """
+    return sort_permutation([key(item) for item in items], reverse)
+
+
+def visibility_mask(items, visible_func):
+    """Return a list of whether each item is visible"""
+    return [bool(visible_func(item)) for item in items]
@@ -9,7 +9,10 @@
     :license: LGPL 2 or later (see README/COPYING/LICENSE)
 """
 
-from gi.repository import Gtk, GdkPixbuf
+import functools
+from operator import attrgetter
+
+from gi.repository import Gtk, GdkPixbuf, GObject
 from pyGtkHelpers.utils import cmp
 
 
@@ -47,6 +50,13 @@ class CellMapper(object):
             mapper(cell, obj, renderer)
 
 
+_UNCOMPILED = object()
+
+
+def _identity(obj):
+    return obj
+
+
 class Cell(object):
     def __init__(self, attr, type=str, **kw):
         # ok this is evil, but let the individual cells use it without it
@@ -75,7 +85,8 @@ class Cell(object):
 
         self.cell_props = kw.get('cell_props', {})
 
-        # attribute/property mapping
+        # attribute/property mapping, compiled on first render
+        self._values_for = _UNCOMPILED
         self.mappers = kw.get('mappers', [])
         self.mapped = kw.get('mapped', {})
 
@@ -96,9 +107,69 @@ class Cell(object):
         for mapper in self.mappers:
             mapper(self, obj, cell)
 
-    def cell_data_func(self, column, cell, model, itr):
+    def cell_data_func(self, column, cell, model, itr, object_list=None):
         obj = model.get_value(itr, 0)
-        self.render(obj, cell)
+        if getattr(object_list, 'children_loader', None) is not None:
+            # ObjectTree placeholder rows of unloaded nodes are left blank
+            if obj is None:
+                cell.set_property('visible', False)
+                return
+            elif not cell.get_visible():
+                cell.set_property('visible', True)
+        values_for = self.values_for
+        if values_for is None:
+            # custom mappers, which can only be called one by one
+            self.render(obj, cell)
+            return
+        cache = getattr(object_list, '_render_cache', None)
+        if cache is None:
+            values = values_for(obj)
+        else:
+            item_cache = cache.get(id(obj))
+            if item_cache is None:
+                item_cache = cache[id(obj)] = {}
+            values = item_cache.get(self)
+            if values is None:
+                values = item_cache[self] = values_for(obj)
+        for prop, value in values:
+            cell.set_property(prop, value)
+
+    @property
+    def values_for(self):
+        """The mappers compiled into a single function
+
+        The function takes an object and returns the list of
+        `(property, value)` pairs to set on the renderer.  It is None if any
+        mapper is not a plain PropertyMapper or CellMapper.
+        """
+        if self._values_for is _UNCOMPILED:
+            self._values_for = self._compile_mappers()
+        return self._values_for
+
+    def _compile_mappers(self):
+        getters = []
+        for mapper in self.mappers:
+            if type(mapper) is CellMapper:
+                mappers = mapper.mappers
+            else:
+                mappers = [mapper]
+            for m in mappers:
+                if type(m) is not PropertyMapper:
+                    return None
+                attr = m.attr or self.attr
+                get = _identity if attr is None else attrgetter(attr)
+                getters.append((m.prop, get, m.format_func))
+        getters = tuple(getters)
+
+        def values_for(obj):
+            values = []
+            for prop, get, format_func in getters:
+                value = get(obj)
+                if format_func:
+                    value = format_func(value)
+                values.append((prop, value))
+            return values
+        return values_for
 
     def format_data(self, data):
         if self.format:
@@ -169,6 +240,10 @@ class Column(object):
     :param sort_func: The function to sort this column by
     :param searchable: Whether this field is searchable
     :param search_key: The key used to search this column
+    :param search_index: Whether to answer searches on this column from a
+                         per-list index of the values' text, which is built
+                         on first search and kept up to date as items are
+                         added, removed and updated
     :param expander: Whether the expander should be shown before this column
     :param resizable: Whether the user can resize the column
     :param cells: A list of Cell instances to display in this colum
@@ -177,6 +252,11 @@ class Column(object):
     :param tooltip_type: The type of tooltip for this column
     :param tooltip_value: The static value of the tooltip for this column
     :param tooltip_image_size: The size of an image tooltip
+    :param native: Whether to store a typed copy of the attribute in the
+                   model, so GTK can sort (and filter, see
+                   `ObjectList.set_visible_attr`) by this column without
+                   calling back into Python. Only for `int`, `float`, `str`
+                   and `bool` types.
 
     """
 
@@ -197,10 +277,16 @@ class Column(object):
         self.resizable = kwargs.pop('resizable', None)
         self.sort_key = kwargs.pop('sort_key', None)
         self.sort_func = kwargs.pop('sort_func', cmp)
+        self.native = kwargs.pop('native', False)
+        self.type = type
+        if self.native and type not in NATIVE_TYPES:
+            raise ValueError('Native columns must have a type in %r.' %
+                             list(NATIVE_TYPES))
         # tooltips are per column, not per cell
         self._init_tooltips(**kwargs)
         self.searchable = kwargs.pop('searchable', False)
         self.search_key = kwargs.pop('search_key', None)
+        self.search_index = kwargs.pop('search_index', False)
         if 'cells' in kwargs:
             self.cells = kwargs['cells']
         else:
@@ -226,20 +312,51 @@ class Column(object):
             # view_cell.set_data('pyGtkHelpers::column', self)
             # XXX: better control over packing
             col.pack_start(view_cell, expand=False)
-            col.set_cell_data_func(view_cell, cell.cell_data_func)
+            col.set_cell_data_func(view_cell, cell.cell_data_func,
+                                   object_list)
         col.set_reorderable(True)
         col.set_sort_indicator(False)
         col.set_sort_order(Gtk.SortType.DESCENDING)
         if object_list and object_list.sortable and self.sorted:
-            idx = object_list.columns.index(self)
-            sort_func = self._default_sort_func
-            object_list.model_sort.set_sort_func(idx, sort_func, object_list)
-            col.set_sort_column_id(idx)
+            if self.sorts_natively:
+                # GTK compares the typed model column itself
+                col.set_sort_column_id(
+                    object_list.native_column_index(self))
+            elif object_list._header_sorts_by_key:
+                # clicks rank the rows by precomputed keys, in a model column
+                # GTK sorts in C, instead of calling a Python comparator
+                col.set_clickable(True)
+                col.connect('clicked', object_list._on_header_clicked, self)
+            else:
+                idx = object_list.python_sort_column_id(self)
+                sort_func = self._default_sort_func
+                object_list.model_sort.set_sort_func(idx, sort_func,
+                                                     object_list)
+                col.set_sort_column_id(idx)
         if object_list and object_list.searchable and self.searchable:
             self.search_by(object_list)
         col.connect('clicked', self._on_viewcol_clicked)
         return col
 
+    @property
+    def native_type(self):
+        """The model column type for a native column"""
+        return NATIVE_TYPES[self.type]
+
+    @property
+    def sorts_natively(self):
+        """Whether sorting by this column is done by GTK on the native model
+        column, i.e. it is native and has no custom sort key or function.
+        """
+        return self.native and self.sort_key is None and self.sort_func is cmp
+
+    def native_value(self, obj):
+        """The value stored in the native model column for an object"""
+        value = getattr(obj, self.attr, None)
+        if value is None:
+            return self.type()
+        return self.type(value)
+
     def _init_tooltips(self, **kw):
         self.tooltip_attr = kw.get('tooltip_attr')
         self.tooltip_type = kw.get('tooltip_type', TOOLTIP_TEXT)
@@ -253,7 +370,11 @@ class Column(object):
 
         :param object_list: An ObjectList or ObjectTree
         """
-        object_list.set_search_equal_func(self._search_equal_func)
+        if self.search_index:
+            object_list.set_search_equal_func(
+                self._indexed_search_equal_func, object_list)
+        else:
+            object_list.set_search_equal_func(self._search_equal_func)
 
     def render_tooltip(self, tooltip, obj):
         """Render the tooltip for this column for an object
@@ -273,20 +394,52 @@ class Column(object):
 
     def _default_sort_func(self, model, itr1, itr2, object_list):
         assert model is object_list.model_filter  # the filtermodel gets sorted
-        attr1 = getattr(model[itr1][0], self.attr, None)
-        attr2 = getattr(model[itr2][0], self.attr, None)
+        item1, item2 = model[itr1][0], model[itr2][0]
+        if item1 is None or item2 is None:
+            # placeholder rows of unloaded ObjectTree nodes sort first
+            return cmp(item2 is None, item1 is None)
+        # keys are cached per row by the list's sort engine
+        key_for = object_list._sort_engine.key_for
+        return self.sort_func(key_for(self._sort_key_for, item1),
+                              key_for(self._sort_key_for, item2))
+
+    def _sort_key_for(self, obj):
+        value = getattr(obj, self.attr, None)
         if self.sort_key:
-            attr1 = self.sort_key(attr1)
-            attr1 = self.sort_key(attr2)
-        return self.sort_func(attr1, attr2)
+            value = self.sort_key(value)
+        return value
+
+    def _cmp_sort_key_for(self, obj):
+        return functools.cmp_to_key(self.sort_func)(self._sort_key_for(obj))
+
+    @property
+    def _sort_spec(self):
+        # the key function a header click ranks the rows by
+        if self.sort_func is cmp:
+            return self._sort_key_for
+        return self._cmp_sort_key_for
 
     def _search_equal_func(self, model, column, key, itr):
         obj = model[itr][0]
+        if obj is None:
+            return True
+        # return False for success!
+        return not (key.lower() in self._search_text(obj).lower())
+
+    def _indexed_search_equal_func(self, model, column, key, itr,
+                                   object_list):
+        obj = model.get_value(itr, 0)
+        if obj is None:
+            return True
+        index = object_list._get_search_index(self)
+        # return False for success!
+        return not index.matches(key, obj)
+
+    def _search_text(self, obj):
         val = getattr(obj, self.attr)
         if self.search_key is not None:
             val = self.search_key(val)
-        # return False for success!
-        return not (key.lower() in str(val).lower())
+        return str(val)
 
     def _on_viewcol_clicked(self, view_col):
         return
@@ -310,6 +463,7 @@ class EditableCellMixin(object):
         original_value = getattr(obj, self.cell.attr)
         if value != original_value:
             # Only trigger update if value has actually changed
+            self.object_list._before_edit(obj)
             setattr(obj, self.cell.attr, value)
             self.object_list.emit('item-changed', obj, self.cell.attr, value)
 
@@ -358,6 +512,7 @@ class CellRendererToggle(Gtk.CellRendererToggle):
     def _on_toggled(self, cellrenderer, path):
         obj = self.object_list._object_at_sort_path(path)
         value = not getattr(obj, self.cell.attr)
+        self.object_list._before_edit(obj)
         setattr(obj, self.cell.attr, value)
         self.object_list.emit('item-changed', obj, self.cell.attr, value)
 
@@ -392,10 +547,19 @@ class CellRendererCombo(Gtk.CellRendererCombo):
         original_value = getattr(obj, self.cell.attr)
         if value != original_value:
             # Only trigger update if value has actually changed
+            self.object_list._before_edit(obj)
             setattr(obj, self.cell.attr, value)
             self.object_list.emit('item-changed', obj, self.cell.attr, value)
 
 
+# Python types supported by native columns, and their model column types
+NATIVE_TYPES = {
+    int: GObject.TYPE_INT64,
+    float: GObject.TYPE_DOUBLE,
+    str: GObject.TYPE_STRING,
+    bool: GObject.TYPE_BOOLEAN,
+}
+
 TOOLTIP_TEXT = 'text'
 TOOLTIP_MARKUP = 'markup'
 TOOLTIP_PIXBUF = 'pixbuf'
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.columnar
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Column-wise storage of the field values of many rows.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import numpy as np
+
+# Python types of field values, and the dtypes storing them
+_DTYPES = {
+    bool: np.bool_,
+    int: np.int64,
+    float: np.float64,
+}
+
+
+def _fits(dtype, value):
+    # whether a value is stored in a typed column without loss
+    kind = dtype.kind
+    if isinstance(value, (bool, np.bool_)):
+        return kind == 'b'
+    if kind == 'i':
+        return isinstance(value, (int, np.integer))
+    if kind == 'f':
+        return isinstance(value, (int, float, np.integer, np.floating))
+    return False
+
+
+def _fits_all(dtype, values):
+    # whether all values are stored in a typed column without loss
+    if isinstance(values, np.ndarray) and values.dtype.kind != 'O':
+        if values.dtype.kind == 'b' or dtype.kind == 'b':
+            return values.dtype.kind == dtype.kind
+        return np.can_cast(values.dtype, dtype, casting='safe')
+    return all(_fits(dtype, value) for value in values)
+
+
+class ColumnStore(object):
+    """Store the values of each field of many rows in a NumPy array
+
+    Rows are identified by a slot, an index into every column.  Boolean,
+    integer and float fields are stored in typed arrays, other fields in
+    object arrays.  Each typed column has a boolean mask of the slots holding
+    `None`, the value of fields without a default, so such fields stay
+    typed.  A typed column becomes an object column the first time another
+    value it cannot hold exactly (e.g. a string) is written to it, so values
+    read back are always the values written.
+
+    Released slots are reset to the default values and reused, and columns
+    grow by doubling, so allocating a slot costs O(1).
+
+    :param types: A mapping of column names to the Python type of their
+                  values
+    :param defaults: A mapping of column names to the value of new rows, None
+                     for columns not listed
+    :param capacity: The number of rows to allocate initially
+    """
+
+    def __init__(self, types, defaults=None, capacity=64):
+        self.columns = {}
+        #: The masks of the slots holding None, for typed columns
+        self.missing = {}
+        self.defaults = dict(defaults or {})
+        self.capacity = capacity
+        #: The number of slots used so far, including released ones
+        self.size = 0
+        self._free = []
+        for name, type_ in types.items():
+            self.add_column(name, type_)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def add_column(self, name, type_=object, default=None):
+        """Add a column, holding the default value in every slot"""
+        if default is not None:
+            self.defaults[name] = default
+        self._set_column(name, *self._new_column(
+            name, np.dtype(_DTYPES.get(type_, object)), self.capacity))
+
+    def allocate(self):
+        """Return a slot holding the default values"""
+        if self._free:
+            return self._free.pop()
+        if self.size == self.capacity:
+            self._grow(max(2 * self.capacity, 64))
+        slot = self.size
+        self.size += 1
+        return slot
+
+    def allocate_many(self, count):
+        """Return an array of `count` consecutive new slots
+
+        Released slots are not reused, so the slots of rows loaded together
+        are contiguous.
+        """
+        if self.size + count > self.capacity:
+            self._grow(max(2 * self.capacity, self.size + count, 64))
+        slots = np.arange(self.size, self.size + count, dtype=np.intp)
+        self.size += count
+        return slots
+
+    def release(self, slot):
+        """Reset a slot to the default values and make it available"""
+        defaults = self.defaults
+        for name, column in self.columns.items():
+            default = defaults.get(name)
+            missing = self.missing.get(name)
+            if missing is not None:
+                missing[slot] = default is None
+                if default is None:
+                    continue
+            column[slot] = default
+        self._free.append(slot)
+
+    def copy_slot(self, source, target):
+        """Copy the values of every column from one slot to another"""
+        missing = self.missing
+        for name, column in self.columns.items():
+            column[target] = column[source]
+            if name in missing:
+                missing[name][target] = missing[name][source]
+
+    def get(self, name, slot):
+        """Return the value of a column in a slot, as a Python object"""
+        column = self.columns[name]
+        if column.dtype.kind == 'O':
+            return column[slot]
+        if self.missing[name][slot]:
+            return None
+        return column[slot].item()
+
+    def get_many(self, name, slots):
+        """Return the values of a column in many slots, as an array
+
+        The array of a typed column is typed too, unless one of the values is
+        None, which makes it an object array.
+        """
+        column = self.columns[name]
+        slots = np.asarray(slots, dtype=np.intp)
+        values = column[slots]
+        missing = self.missing.get(name)
+        if missing is not None:
+            is_none = missing[slots]
+            if is_none.any():
+                values = values.astype(object)
+                values[is_none] = None
+        return values
+
+    def set(self, name, slot, value):
+        """Set the value of a column in a slot"""
+        column = self.columns[name]
+        if column.dtype.kind != 'O':
+            if value is None:
+                self.missing[name][slot] = True
+                return
+            if _fits(column.dtype, value):
+                try:
+                    column[slot] = value
+                    self.missing[name][slot] = False
+                    return
+                except OverflowError:
+                    pass
+            column = self._promote(name)
+        column[slot] = value
+
+    def set_many(self, name, slots, values):
+        """Set the values of a column in many slots with one array write
+
+        :param slots: The slots to set
+        :param values: A sequence (or array) of one value per slot
+        """
+        column = self.columns[name]
+        slots = np.asarray(slots, dtype=np.intp)
+        if column.dtype.kind != 'O':
+            is_none = None
+            given = values
+            if not isinstance(values, np.ndarray) or values.dtype.kind == 'O':
+                is_none = np.fromiter((value is None for value in values),
+                                      dtype=np.bool_, count=len(slots))
+                if is_none.any():
+                    given = [value for value in values if value is not None]
+                else:
+                    is_none = None
+            if _fits_all(column.dtype, given):
+                try:
+                    if is_none is None:
+                        column[slots] = given
+                        self.missing[name][slots] = False
+                    else:
+                        column[slots[~is_none]] = given
+                        self.missing[name][slots] = is_none
+                    return
+                except OverflowError:
+                    pass
+            column = self._promote(name)
+        if not isinstance(values, np.ndarray):
+            # keep sequences from being unpacked into the object column
+            array = np.empty(len(slots), dtype=object)
+            try:
+                array[:] = values
+            except ValueError:
+                for i, value in enumerate(values):
+                    array[i] = value
+            values = array
+        column[slots] = values
+
+    def fill(self, name, slots, value):
+        """Set the same value of a column in many slots"""
+        column = self.columns[name]
+        slots = np.asarray(slots, dtype=np.intp)
+        if column.dtype.kind != 'O':
+            if value is None:
+                self.missing[name][slots] = True
+                return
+            if _fits(column.dtype, value):
+                try:
+                    column[slots] = value
+                    self.missing[name][slots] = False
+                    return
+                except OverflowError:
+                    pass
+            column = self._promote(name)
+        array = np.empty(len(slots), dtype=object)
+        array.fill(value)
+        column[slots] = array
+
+    def _promote(self, name):
+        # turn a typed column into an object column, keeping its values
+        column = self.columns[name].astype(object)
+        column[self.missing.pop(name)] = None
+        self.columns[name] = column
+        return column
+
+    def _set_column(self, name, column, missing):
+        self.columns[name] = column
+        if missing is not None:
+            self.missing[name] = missing
+        else:
+            self.missing.pop(name, None)
+
+    def _new_column(self, name, dtype, capacity):
+        # a column of default values, and its mask of None values if typed
+        default = self.defaults.get(name)
+        missing = None
+        if dtype.kind != 'O':
+            if default is None:
+                missing = np.ones(capacity, dtype=np.bool_)
+                default = 0
+            elif _fits(dtype, default):
+                missing = np.zeros(capacity, dtype=np.bool_)
+            else:
+                dtype = np.dtype(object)
+        column = np.empty(capacity, dtype=dtype)
+        column.fill(default)
+        return column, missing
+
+    def _grow(self, capacity):
+        for name, column in list(self.columns.items()):
+            new_column, missing = self._new_column(name, column.dtype,
+                                                   capacity)
+            new_column[:self.capacity] = column
+            if missing is not None:
+                missing[:self.capacity] = self.missing[name]
+            self._set_column(name, new_column, missing)
+        self.capacity = capacity
@@ -1,15 +1,18 @@
 from copy import deepcopy
+import contextlib
 import re
 import logging
 
 from gi.repository import Gtk
 from flatland import Form, Integer
+import numpy as np
 
 from pyGtkHelpers.utils import gsignal
 from pyGtkHelpers.ui.extra_widgets import get_type_from_schema
 from pyGtkHelpers.ui.form_view_dialog import FormViewDialog
 from pyGtkHelpers.ui.objectlist.uuid_minimal import uuid4
 from pyGtkHelpers.ui.objectlist.column import Column
+from pyGtkHelpers.ui.objectlist.columnar import ColumnStore
 from pyGtkHelpers.ui.objectlist.view import ObjectList
 
 
@@ -28,7 +31,7 @@ class RowFields(object):
     {'foo': 'Hello', 'bar': 'World'}
     """
     def __init__(self, **kwargs):
-        for key, value in kwargs.iteritems():
+        for key, value in kwargs.items():
             setattr(self, key, value)
 
     def __setstate__(self, state):
@@ -103,6 +106,18 @@ class CombinedFields(ObjectList):
      (u'_e4467fe0bd__another_int_field', u'Another int field'),
      (u'_196ff80637__my_string_field', u'My string field'),
      (u'_196ff80637__my_int_field', u'My int field')]
+
+    The first column shows the id of each row, its position in the list
+    plus one.  Ids are renumbered from the first changed position when rows
+    are added, inserted, removed or reordered, so appending a row costs
+    O(1).  Use `deferred_row_ids()` to renumber once after many changes, or
+    pass `lazy_ids=True` to compute ids from the row positions when they
+    are read, instead of storing them.
+
+    With `columnar=True`, the values of each form field are stored in a
+    typed NumPy array (see `ColumnStore`) rather than in per-row objects,
+    and `CombinedRow(combined_fields)` returns a `ColumnarRow`, a small view
+    of one row of the arrays with the same attribute API.
     """
     field_set_prefix = '_%s__'
 
@@ -113,11 +128,15 @@ class CombinedFields(ObjectList):
 
     @property
     def forms(self):
-        return dict([(k, v) for k, v in self._forms.iteritems()
+        return dict([(k, v) for k, v in self._forms.items()
                      if k != '__DefaultFields'])
 
-    def __init__(self, forms, enabled_attrs, show_ids=True, **kwargs):
+    def __init__(self, forms, enabled_attrs, show_ids=True, lazy_ids=False,
+                 columnar=False, **kwargs):
         self.first_selected = True
+        self.lazy_ids = lazy_ids
+        self._row_ids_depth = 0
+        self._row_ids_start = None
         self._forms = forms.copy()
         row_id_properties = dict(editable=False)
         if not show_ids:
@@ -130,6 +149,25 @@ class CombinedFields(ObjectList):
                                   for name in self._forms])
         self.uuid_reverse_mapping = dict([(v, k) for k, v in
                                           self.uuid_mapping.items()])
+        self._row_id_attr = '%sid' % (self.field_set_prefix %
+                                      self.uuid_mapping['__DefaultFields'])
+        # mangled name -> (form name, field name), see `_field_of_attr`
+        self._attr_fields = {}
+        types = {}
+        defaults = {}
+        for form_name, form in self._forms.items():
+            prefix = self.field_set_prefix % self.uuid_mapping[form_name]
+            form_defaults = form.from_defaults()
+            for field in form.field_schema:
+                name = '%s%s' % (prefix, field.name)
+                self._attr_fields[name] = form_name, field.name
+                types[name] = get_type_from_schema(field)
+                defaults[name] = form_defaults[field.name].value
+        if columnar:
+            #: The field values of the rows, when `columnar`
+            self.store = ColumnStore(types, defaults)
+        else:
+            self.store = None
         self._columns = []
         self._full_field_to_field_def = {}
         if not enabled_attrs:
@@ -184,9 +222,14 @@ class CombinedFields(ObjectList):
         self.connect('item-right-clicked', self._on_right_clicked)
         self.enabled_fields_by_form_name = enabled_attrs
 
-        self.connect('item-added', lambda x, y: self.reset_row_ids())
-        self.connect('item-inserted', lambda x, y, z: self.reset_row_ids())
-        self.connect('item-removed', lambda x, y: self.reset_row_ids())
+        self.connect('item-added',
+                     lambda x, y: self.renumber_rows(len(self) - 1))
+        self.connect('items-added', self._on_rows_added)
+        self.connect('item-inserted',
+                     lambda x, y, position: self.renumber_rows(position))
+        self.connect('item-removed', self._on_row_removed)
+        self.model.connect('rows-reordered',
+                           lambda *args: self.renumber_rows(0))
 
     def _set_rows_attr(self, row_ids, column_title, value, prompt=False):
         title_map = dict([(c.title, c.attr) for c in self.columns])
@@ -204,13 +247,128 @@ class CombinedFields(ObjectList):
             title_map = dict([(c.title, c.attr) for c in self.columns])
             attr = title_map.get(column_title)
 
-        for i in row_ids:
-            setattr(self[i], attr, value)
+        self.set_values(row_ids, attr, value, broadcast=True)
         logging.debug('Set rows attr: row_ids=%s column_title=%s value=%s',
                       row_ids, column_title, value)
-        self._on_multiple_changed(attr)
         return True
 
+    @classmethod
+    def from_frame(cls, data_frame, forms, enabled_attrs=None, **kwargs):
+        """Create a columnar CombinedFields holding the rows of a data frame
+
+        The columns of the frame are (form name, field name) pairs, as
+        returned by `to_frame`.  Each column is copied into the field's array
+        at once, fields without a column keep their default values, and all
+        rows are added in one `batch()`::
+
+            combined_fields = CombinedFields.from_frame(df, forms)
+
+        :param data_frame: A `pandas.DataFrame` with one row per row
+        :param forms: The forms, as for `CombinedFields`
+        :param enabled_attrs: The fields shown, as for `CombinedFields`
+        :raises ValueError: If a column is not a (form name, field name)
+                            pair naming a field of `forms`
+        """
+        for column in data_frame.columns:
+            if not (isinstance(column, tuple) and len(column) == 2 and
+                    column[0] in forms and
+                    column[1] in forms[column[0]].field_schema_mapping):
+                raise ValueError('from_frame() failed, column %r is not a '
+                                 '(form name, field name) pair of a field '
+                                 'of forms' % (column, ))
+        kwargs['columnar'] = True
+        combined_fields = cls(forms, enabled_attrs, **kwargs)
+        store = combined_fields.store
+        slots = store.allocate_many(len(data_frame))
+        for column in data_frame.columns:
+            form_name, field_name = column
+            name = '%s%s' % (cls.field_set_prefix %
+                             combined_fields.uuid_mapping[form_name],
+                             field_name)
+            store.set_many(name, slots, data_frame[column].to_numpy())
+        store.set_many(combined_fields._row_id_attr, slots,
+                       np.arange(1, len(slots) + 1))
+        rows = [ColumnarRow._for_slot(combined_fields, slot)
+                for slot in slots.tolist()]
+        # the ids were set along with the values
+        with combined_fields.deferred_row_ids(renumber=False):
+            combined_fields.extend(rows, batch=True)
+        return combined_fields
+
+    def to_frame(self):
+        """Return the field values of the rows as a data frame
+
+        The frame has one column per form field, named by a (form name,
+        field name) pair, and is indexed by the row ids.  Columnar rows are
+        copied one array at a time.
+
+        :rtype: pandas.DataFrame
+        """
+        import pandas as pd
+
+        rows = list(self)
+        store = self.store
+        if store is not None:
+            slots = np.fromiter((row.slot for row in rows), dtype=np.intp,
+                                count=len(rows))
+        data = {}
+        for form_name in sorted(self.forms):
+            prefix = self.field_set_prefix % self.uuid_mapping[form_name]
+            for field in self._forms[form_name].field_schema:
+                name = '%s%s' % (prefix, field.name)
+                if store is not None:
+                    values = store.get_many(name, slots)
+                else:
+                    values = [getattr(row, name) for row in rows]
+                data[(form_name, field.name)] = values
+        index = pd.RangeIndex(1, len(rows) + 1, name='id')
+        if not data:
+            return pd.DataFrame(index=index)
+        return pd.DataFrame(data, index=index)
+
+    def set_values(self, row_ids, attr, values, broadcast=False):
+        """Set a field of many rows at once
+
+        The values are written in one pass, with a single array write when
+        the rows are `columnar`.  The rows are then refreshed together (see
+        `update_many`), and a single `rows-changed` signal is emitted with
+        the row ids::
+
+            combined_fields.set_values(range(len(combined_fields)),
+                                       attr, 0.5, broadcast=True)
+
+        :param row_ids: The positions of the rows to change
+        :param attr: The mangled name of the field
+        :param values: A sequence of one value per row, or with `broadcast`
+                       the value to set in every row
+        :param broadcast: Whether `values` is a single value, even if it is
+                          a sequence itself
+        :raises ValueError: If there is not one value per row
+        """
+        row_ids = list(row_ids)
+        rows = [self[i] for i in row_ids]
+        if not broadcast and len(values) != len(rows):
+            raise ValueError('set_values() needs one value per row, got %d '
+                             'values for %d rows' % (len(values), len(rows)))
+        store = self.store
+        if store is not None and self._field_of_attr(attr) is not None:
+            if attr not in store:
+                store.add_column(attr)
+            slots = [row.slot for row in rows]
+            if broadcast:
+                store.fill(attr, slots, values)
+            else:
+                store.set_many(attr, slots, values)
+        elif broadcast:
+            for row in rows:
+                setattr(row, attr, values)
+        else:
+            for row, value in zip(rows, values):
+                setattr(row, attr, value)
+        self.update_many(rows)
+        self.emit('rows-changed', tuple(row_ids),
+                  [Gtk.TreePath(i) for i in row_ids], attr)
+
     def _deselect_all(self, *args, **kwargs):
         s = self.get_selection()
         s.unselect_all()
@@ -250,7 +408,7 @@ class CombinedFields(ObjectList):
             menu_items += [('Deselect all rows', self._deselect_all),
                            ('Invert row selection', invert_rows)]
 
-        item_id = [r for r in self].index(item)
+        item_id = self.index_of(item)
         if item_id not in row_ids:
             logging.debug('[ProtocolGridController] _on_right_clicked(): '
                           'clicked item is not selected')
@@ -310,23 +468,127 @@ class CombinedFields(ObjectList):
             setattr(form_row, attr, value)
         self.update(combined_row)
 
-    def _on_multiple_changed(self, attr):
-        selection = self.get_selection()
-        model, rows = selection.get_selected_rows()
-        row_ids = zip(*rows)[0]
-        logging.debug('[CombinedFields] _on_multiple_changed(): attr=%s '
-                      'selected_rows=%s', attr, row_ids)
-        self.emit('rows-changed', row_ids, rows, attr)
-
     def _on_item_changed(self, widget, row_data, attr, value, **kwargs):
-        row_id = [r for r in self].index(row_data)
+        row_id = self.index_of(row_data)
         logging.debug('[CombinedFields] _on_item_changed(): name=%s value=%s',
                       attr, value)
         self.emit('row-changed', row_id, row_data, attr, value)
 
     def reset_row_ids(self):
-        for i, combined_row in enumerate(self):
-            combined_row.set_row_fields_attr('__DefaultFields', 'id', i + 1)
+        self.renumber_rows(0)
+
+    def renumber_rows(self, start=0):
+        """Renumber the ids of the rows from position `start` on
+
+        Rows before `start` keep their ids, and only rows whose id changed
+        are redrawn.  Inside `deferred_row_ids()` the lowest `start` is
+        recorded, and the rows are renumbered once on exit.
+
+        :param start: The position of the first row to renumber
+        """
+        if self._row_ids_depth:
+            if self._row_ids_start is None or start < self._row_ids_start:
+                self._row_ids_start = start
+            return
+        if self.lazy_ids:
+            if start < len(self):
+                self._on_row_ids_moved()
+            return
+        model = self.model
+        id_attr = self._row_id_attr
+        itr = model.iter_nth_child(None, start) if start >= 0 else None
+        row_id = start + 1
+        while itr is not None:
+            row = model.get_value(itr, 0)
+            if getattr(row, id_attr) != row_id:
+                setattr(row, id_attr, row_id)
+                self._invalidate_item(row)
+                model.row_changed(model.get_path(itr), itr)
+            row_id += 1
+            itr = model.iter_next(itr)
+
+    @contextlib.contextmanager
+    def deferred_row_ids(self, renumber=True):
+        """Context manager renumbering the rows once, after the block
+
+        Use it around a loop adding, inserting or removing rows one at a
+        time, e.g. while loading a protocol::
+
+            with combined_fields.deferred_row_ids():
+                for step in steps:
+                    combined_fields.append(step)
+
+        Blocks may be nested; rows are renumbered when the outermost one
+        exits.  Row ids are not reliable inside the block.
+
+        :param renumber: Whether the rows changed inside the block are
+                         renumbered, False if the block sets their ids
+        """
+        start = self._row_ids_start
+        self._row_ids_depth += 1
+        try:
+            yield self
+        finally:
+            self._row_ids_depth -= 1
+            if not renumber:
+                # forget the rows changed inside the block
+                self._row_ids_start = start
+            if not self._row_ids_depth and self._row_ids_start is not None:
+                start, self._row_ids_start = self._row_ids_start, None
+                self.renumber_rows(start)
+
+    def row_id_of(self, combined_row):
+        """The id of a row, its position in the list plus one"""
+        if self.lazy_ids:
+            try:
+                return self.index_of(combined_row) + 1
+            except ValueError:
+                # not listed (yet)
+                return 0
+        return getattr(combined_row, self._row_id_attr)
+
+    def _field_of_attr(self, attr):
+        """The (form name, field name) of a mangled attribute name
+
+        Names are matched by the prefix of their form once, and then looked
+        up in a dict.
+
+        :returns: The form and field names, or None for names of no form
+        """
+        try:
+            return self._attr_fields[attr]
+        except KeyError:
+            pass
+        field = None
+        for form_name, uuid_code in self.uuid_mapping.items():
+            prefix = self.field_set_prefix % uuid_code
+            if attr.startswith(prefix):
+                field = form_name, attr[len(prefix):]
+                break
+        self._attr_fields[attr] = field
+        return field
+
+    def _on_rows_added(self, object_list, rows):
+        # a batch may have inserted rows anywhere, not only appended them
+        get_path = self.model.get_path
+        self.renumber_rows(min(get_path(self._iter_for(row)).get_indices()[0]
+                               for row in rows))
+
+    def _on_row_removed(self, object_list, row, position):
+        # `position` is the displayed position, which is never past the
+        # position in the model, and may be -1 for a filtered out row
+        start = max(position, 0)
+        if not self.lazy_ids:
+            # a stored id is one past the position the row had
+            start = max(start, getattr(row, self._row_id_attr) - 1)
+        self.renumber_rows(min(start, len(self)))
+
+    def _on_row_ids_moved(self):
+        # lazy ids are read when drawn, only cached values can be stale
+        for view in self._model_views():
+            view._sort_engine.clear()
+            if view._render_cache is not None:
+                view._render_cache.clear()
 
 
 class CombinedRow(object):
@@ -390,16 +652,28 @@ class CombinedRow(object):
     ...     for form_name, row_fields in combined_row.attributes.items()])) # doctest:+SKIP
     {'another_form': {'my_int_field': 1234},
      'example_form': {'my_string_field': u'foo'}}
+
+    If `combined_fields` was created with `columnar=True`, a `ColumnarRow`
+    (a subclass) is returned instead.
     """
+    __slots__ = ('__dict__', '__weakref__')
+
     field_set_prefix = '_%s__'
 
+    def __new__(cls, combined_fields=None, attributes=None):
+        if cls is CombinedRow and \
+                getattr(combined_fields, 'store', None) is not None:
+            # initialised by `ColumnarRow.__init__`
+            cls = ColumnarRow
+        return object.__new__(cls)
+
     def __init__(self, combined_fields, attributes=None):
         self.combined_fields = combined_fields
 
         self.attributes = dict()
-        for form_name, form in combined_fields._forms.iteritems():
+        for form_name, form in combined_fields._forms.items():
             temp = form.from_defaults()
-            attr_values = dict([(k, v.value) for k, v in temp.iteritems()])
+            attr_values = dict([(k, v.value) for k, v in temp.items()])
             self.attributes[form_name] = RowFields(**attr_values)
         if attributes:
             self.attributes.update(attributes)
@@ -420,28 +694,179 @@ class CombinedRow(object):
 
     def __getattr__(self, name):
         if name not in ['attributes', 'combined_fields']:
-            for form_name, uuid_code in self.combined_fields.uuid_mapping\
-                    .iteritems():
-                field_set_prefix = self.field_set_prefix % uuid_code
-                if name.startswith(field_set_prefix):
-                    return getattr(self.attributes[form_name],
-                                   name[len(field_set_prefix):])
+            combined_fields = self.combined_fields
+            if combined_fields.lazy_ids and \
+                    name == combined_fields._row_id_attr:
+                return combined_fields.row_id_of(self)
+            field = combined_fields._field_of_attr(name)
+            if field is not None:
+                return getattr(self.attributes[field[0]], field[1])
         return object.__getattribute__(self, name)
 
     def __setattr__(self, name, value):
         if name not in ['attributes', 'combined_fields']:
-            for form_name, uuid_code in self.combined_fields.uuid_mapping\
-                    .iteritems():
-                field_set_prefix = self.field_set_prefix % uuid_code
-                if name.startswith(field_set_prefix):
-                    # Update value
-                    setattr(self.attributes[form_name],
-                            name[len(field_set_prefix):], value)
-                    logging.debug('[CombinedRow] setattr %s=%s', name, value)
-                    break
+            field = self.combined_fields._field_of_attr(name)
+            if field is not None:
+                # Update value
+                setattr(self.attributes[field[0]], field[1], value)
+                logging.debug('[CombinedRow] setattr %s=%s', name, value)
         else:
             self.__dict__[name] = value
 
     def __str__(self):
         return '<CombinedRow attributes=%s>' % [(k, v.attrs) for k, v in
-                                                self.attributes.iteritems()]
+                                                self.attributes.items()]
+
+
+class ColumnarRow(CombinedRow):
+    """
+    A row of a CombinedFields instance created with `columnar=True`.
+
+    The field values are stored in the `ColumnStore` of the CombinedFields
+    instance, at the row's `slot`, and the row itself only holds the slot.
+    Attribute access maps the mangled field names to the store, like
+    `CombinedRow`.  Values of names of a form which are not fields of the
+    form are stored in object columns added on first use.  Other attributes
+    cannot be set.
+
+    The slot is released when the row is garbage collected, so copies of
+    a row get a slot of their own, and rows are pickled by their values.
+
+    Use `CombinedRow(combined_fields)` rather than creating this directly.
+    """
+    __slots__ = ('combined_fields', 'slot')
+
+    def __init__(self, combined_fields, attributes=None):
+        object.__setattr__(self, 'combined_fields', combined_fields)
+        object.__setattr__(self, 'slot', combined_fields.store.allocate())
+        if attributes:
+            for form_name, row_fields in attributes.items():
+                if isinstance(row_fields, (RowFields, _RowFieldsView)):
+                    row_fields = row_fields.attrs
+                for attr, value in row_fields.items():
+                    self.set_row_fields_attr(form_name, attr, value)
+
+    @classmethod
+    def _for_slot(cls, combined_fields, slot):
+        # a view of an already allocated slot
+        row = object.__new__(cls)
+        object.__setattr__(row, 'combined_fields', combined_fields)
+        object.__setattr__(row, 'slot', slot)
+        return row
+
+    def __del__(self):
+        try:
+            self.combined_fields.store.release(self.slot)
+        except AttributeError:
+            # not fully initialised
+            pass
+
+    def __copy__(self):
+        combined_fields = self.combined_fields
+        store = combined_fields.store
+        row = ColumnarRow._for_slot(combined_fields, store.allocate())
+        store.copy_slot(self.slot, row.slot)
+        return row
+
+    def __deepcopy__(self, memo):
+        row = self.__copy__()
+        memo[id(self)] = row
+        # typed columns hold immutable values
+        for column in self.combined_fields.store.columns.values():
+            if column.dtype.kind == 'O':
+                column[row.slot] = deepcopy(column[row.slot], memo)
+        return row
+
+    def __reduce__(self):
+        # the slot is only valid in this store
+        store = self.combined_fields.store
+        values = dict((name, store.get(name, self.slot))
+                      for name in store.columns)
+        return _columnar_row, (self.combined_fields, values)
+
+    @property
+    def attributes(self):
+        """The values of each form, as `RowFields` like views"""
+        return dict((form_name, _RowFieldsView(self, form_name))
+                    for form_name in self.combined_fields._forms)
+
+    def set_row_fields_attr(self, form_name, attr, value):
+        setattr(self, self._attr_name(form_name, attr), value)
+
+    def get_row_fields(self, form_name):
+        if form_name not in self.combined_fields._forms:
+            raise KeyError(form_name)
+        return _RowFieldsView(self, form_name)
+
+    def set_row_id(self, row_id):
+        if row_id is not None:
+            setattr(self, self.combined_fields._row_id_attr, row_id)
+
+    def _attr_name(self, form_name, attr):
+        uuid_code = self.combined_fields.uuid_mapping[form_name]
+        return '%s%s' % (self.field_set_prefix % uuid_code, attr)
+
+    def __getattr__(self, name):
+        if name in ColumnarRow.__slots__:
+            # not initialised yet
+            raise AttributeError(name)
+        combined_fields = self.combined_fields
+        store = combined_fields.store
+        if name in store.columns:
+            if combined_fields.lazy_ids and \
+                    name == combined_fields._row_id_attr:
+                return combined_fields.row_id_of(self)
+            return store.get(name, self.slot)
+        if combined_fields._field_of_attr(name) is not None:
+            # like RowFields, unset attributes are None
+            return None
+        return object.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        if name in ColumnarRow.__slots__:
+            raise AttributeError('%s is read-only' % name)
+        combined_fields = self.combined_fields
+        store = combined_fields.store
+        if name not in store.columns:
+            if combined_fields._field_of_attr(name) is None:
+                raise AttributeError('%s is not a field of any form' % name)
+            store.add_column(name)
+        store.set(name, self.slot, value)
+        logging.debug('[ColumnarRow] setattr %s=%s', name, value)
+
+    def __str__(self):
+        return '<ColumnarRow attributes=%s>' % [
+            (k, v.attrs) for k, v in self.attributes.items()]
+
+
+def _columnar_row(combined_fields, values):
+    # unpickle a ColumnarRow, see `ColumnarRow.__reduce__`
+    row = ColumnarRow(combined_fields)
+    for name, value in values.items():
+        setattr(row, name, value)
+    return row
+
+
+class _RowFieldsView(object):
+    """The values of one form in a `ColumnarRow`, like `RowFields`"""
+
+    def __init__(self, row, form_name):
+        object.__setattr__(self, '_row', row)
+        object.__setattr__(self, '_prefix', row.field_set_prefix %
+                           row.combined_fields.uuid_mapping[form_name])
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._row, self._prefix + name)
+
+    def __setattr__(self, name, value):
+        setattr(self._row, self._prefix + name, value)
+
+    @property
+    def attrs(self):
+        prefix = self._prefix
+        row = self._row
+        return dict((name[len(prefix):], getattr(row, name))
+                    for name in row.combined_fields.store.columns
+                    if name.startswith(prefix))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.identity
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Finding the model row of an item.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import weakref
+
+from gi.repository import Gtk
+
+_MISSING = object()
+
+# id(model) -> IterIndex, to find the index of a model shared between views
+_model_indexes = weakref.WeakValueDictionary()
+
+
+class IterIndex(object):
+    """Map the items of an ObjectList to the iters of their model rows
+
+    Items are identified in one of two ways:
+
+    * by `id(item)`, the default.  The model holds a reference to every
+      listed item, so the id of a listed item cannot be reused by another
+      object, and entries are dropped when their rows are removed.
+    * by `key(item)`, when a key function is given.  Items with equal keys
+      are the same row, so immutable rows such as tuples can be listed, and
+      membership tests and lookups accept either an item or its key, see
+      `lookup`.
+
+    The iters of `Gtk.ListStore` and `Gtk.TreeStore` rows persist, so only
+    their `user_data` pointer is stored, and iters are recreated on lookup.
+
+    :param model: The model holding the rows
+    :param key: An optional callable returning the identity key of an item
+    """
+
+    def __init__(self, model, key=None):
+        self.model = model
+        self.key = key
+        self.compact = isinstance(model, (Gtk.ListStore, Gtk.TreeStore))
+        self._stamp = None
+        self._iters = {}
+        #: The native columns stored in the model, see `Column`
+        self.native_columns = ()
+        #: The views showing the model, see `ObjectList(shared_model=...)`
+        self.views = weakref.WeakSet()
+        _model_indexes[id(model)] = self
+
+    @classmethod
+    def for_model(cls, model):
+        """Return the index of a model, or None if it has none"""
+        index = _model_indexes.get(id(model))
+        if index is not None and index.model is model:
+            return index
+        return None
+
+    def key_of(self, item):
+        """The identity key of an item in this index"""
+        if self.key is None:
+            return id(item)
+        return self.key(item)
+
+    def __contains__(self, item_or_key):
+        # dict lookups only, without reading the model, see `lookup`
+        if self.key is None:
+            return id(item_or_key) in self._iters
+        try:
+            if item_or_key in self._iters:
+                return True
+        except TypeError:
+            # not hashable, so not a key
+            pass
+        try:
+            return self.key(item_or_key) in self._iters
+        except Exception:
+            return False
+
+    def __len__(self):
+        return len(self._iters)
+
+    def add(self, item, itr):
+        """Record the row of an item"""
+        item_key = self.key_of(item)
+        if self.compact:
+            self._stamp = itr.stamp
+            self._iters[item_key] = itr.user_data
+        else:
+            self._iters[item_key] = itr
+
+    def discard(self, item):
+        """Forget the row of an item, if it is indexed"""
+        self._iters.pop(self.key_of(item), None)
+
+    def clear(self):
+        self._iters.clear()
+
+    def iter_for(self, item):
+        """Return the model iter of an item
+
+        :raises KeyError: If the item is not indexed
+        """
+        return self._make_iter(self._iters[self.key_of(item)])
+
+    def lookup(self, item_or_key):
+        """Return the listed item for an item or, with a key function, a key
+
+        :returns: The item stored in the model, or None if there is none
+        """
+        if self.key is None:
+            if id(item_or_key) in self._iters:
+                return item_or_key
+            return None
+        itr = _MISSING
+        try:
+            itr = self._iters.get(item_or_key, _MISSING)
+        except TypeError:
+            # not hashable, so not a key
+            pass
+        if itr is _MISSING:
+            try:
+                itr = self._iters.get(self.key(item_or_key), _MISSING)
+            except Exception:
+                return None
+            if itr is _MISSING:
+                return None
+        return self.model.get_value(self._make_iter(itr), 0)
+
+    def _make_iter(self, itr):
+        if not self.compact:
+            return itr
+        giter = Gtk.TreeIter()
+        giter.stamp = self._stamp
+        giter.user_data = itr
+        return giter
+
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.search_index
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Substring search over a column's values without walking the model.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+
+
+class SearchIndex(object):
+    """Case-insensitive substring index over the items of a list
+
+    Each item's lowercased search text is cached, and a trigram index maps
+    every three-character substring to the items containing it.  Keys of
+    three characters or more are answered by intersecting trigram sets and
+    checking the few remaining candidates; shorter keys scan the cached
+    strings.
+
+    :param text_func: A callable returning the search text of an item
+    """
+
+    def __init__(self, text_func):
+        self.text_func = text_func
+        self.items = {}
+        self.texts = {}
+        self.trigrams = {}
+        self._last_key = None
+        self._last_matches = frozenset()
+
+    def build(self, items):
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        item_id = id(item)
+        if item_id in self.texts:
+            self.remove(item)
+        text = self.text_func(item).lower()
+        self.items[item_id] = item
+        self.texts[item_id] = text
+        for trigram in _trigrams(text):
+            self.trigrams.setdefault(trigram, set()).add(item_id)
+        self._last_key = None
+
+    def remove(self, item):
+        item_id = id(item)
+        text = self.texts.pop(item_id, None)
+        if text is None:
+            return
+        del self.items[item_id]
+        for trigram in _trigrams(text):
+            ids = self.trigrams[trigram]
+            ids.discard(item_id)
+            if not ids:
+                del self.trigrams[trigram]
+        self._last_key = None
+
+    def update(self, item):
+        if id(item) in self.texts:
+            self.add(item)
+
+    def clear(self):
+        self.items.clear()
+        self.texts.clear()
+        self.trigrams.clear()
+        self._last_key = None
+
+    def match_ids(self, key):
+        """Return the ids of items whose search text contains `key`
+
+        The result for the last key is cached, since interactive search
+        tests every row against the same key.
+        """
+        key = key.lower()
+        if key == self._last_key:
+            return self._last_matches
+        texts = self.texts
+        if len(key) < 3:
+            matches = frozenset(item_id for item_id, text in texts.items()
+                                if key in text)
+        else:
+            candidates = sorted((self.trigrams.get(trigram, ())
+                                 for trigram in _trigrams(key)), key=len)
+            if candidates and candidates[0]:
+                ids = set(candidates[0]).intersection(*candidates[1:])
+            else:
+                ids = ()
+            matches = frozenset(item_id for item_id in ids
+                                if key in texts[item_id])
+        self._last_key, self._last_matches = key, matches
+        return matches
+
+    def matches(self, key, item):
+        """Return whether an item's search text contains `key`"""
+        return id(item) in self.match_ids(key)
+
+    def find(self, key):
+        """Return the items whose search text contains `key`, unordered"""
+        items = self.items
+        return [items[item_id] for item_id in self.match_ids(key)]
+
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
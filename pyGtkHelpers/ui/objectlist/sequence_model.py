@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.sequence_model
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A virtual TreeModel backend over a Python sequence, so an ObjectList can
+    display large sequences without copying them into a ListStore.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+
+import random
+
+from gi.repository import GObject, Gtk
+
+# pending shifts kept before the position map is rebuilt, at least
+_MIN_SHIFTS = 64
+
+
+class SequenceModel(GObject.Object, Gtk.TreeModel):
+    """A flat, single column TreeModel that reads its rows from a sequence
+
+    Rows are only read from the sequence when GTK asks for them, so nothing is
+    copied up-front.  Iters are positional, so they are only valid until the
+    next structural change (they do not persist like ListStore iters).
+
+    The mutating methods mirror the subset of the `Gtk.ListStore` API used by
+    `ObjectList`, and require the source to be a mutable sequence.  If the
+    source is changed behind the model's back, call `reset` to resynchronise
+    any attached views.
+
+    The position of each item is kept in a map from `id(item)`, maintained
+    incrementally: inserts and removals are recorded as shifts, which are
+    applied to an entry when it is looked up.  The map is rebuilt only when
+    more than about `sqrt(len(source))` shifts are pending, or when an entry
+    turns out to be stale because the source was changed directly.
+
+    :param source: The sequence of items to display
+    """
+
+    def __init__(self, source):
+        GObject.Object.__init__(self)
+        self.source = source
+        self._stamp = random.randint(1, 2 ** 31 - 1)
+        # id(item) -> (position, number of shifts applied to the position)
+        self._positions = None
+        # (position, +1 for an insert or -1 for a removal), in order
+        self._shifts = []
+
+    # TreeModel interface
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return 1
+
+    def do_get_column_type(self, column):
+        return GObject.TYPE_PYOBJECT
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self.source):
+            return True, self._create_iter(indices[0])
+        return False, None
+
+    def do_get_path(self, itr):
+        return Gtk.TreePath((itr.user_data, ))
+
+    def do_get_value(self, itr, column):
+        return self.source[itr.user_data]
+
+    def do_iter_next(self, itr):
+        position = itr.user_data + 1
+        if position < len(self.source):
+            itr.user_data = position
+            return True
+        itr.stamp = 0
+        return False
+
+    def do_iter_previous(self, itr):
+        position = itr.user_data - 1
+        if position >= 0:
+            itr.user_data = position
+            return True
+        itr.stamp = 0
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None and len(self.source):
+            return True, self._create_iter(0)
+        return False, None
+
+    def do_iter_has_child(self, itr):
+        return False
+
+    def do_iter_n_children(self, itr):
+        if itr is None:
+            return len(self.source)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < len(self.source):
+            return True, self._create_iter(n)
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
+
+    # position lookup
+
+    def iter_for_position(self, position):
+        """Return a (positional) iter for a row index"""
+        return self._create_iter(position)
+
+    def position_of_id(self, item_id):
+        """Return the position of the item with `id(item) == item_id`
+
+        The id to position map is built on first use, and rebuilt if an
+        entry turns out to be stale.  Items missing from the map are not
+        listed, so a miss costs O(1).
+
+        :rtype: int or None
+        """
+        if self._positions is None:
+            self._rebuild_positions()
+        entry = self._positions.get(item_id)
+        if entry is None:
+            return None
+        position = self._shifted(*entry)
+        source = self.source
+        if not (0 <= position < len(source) and
+                id(source[position]) == item_id):
+            # the source was changed behind the model's back
+            self._rebuild_positions()
+            entry = self._positions.get(item_id)
+            if entry is None:
+                return None
+            position = entry[0]
+        elif entry[1] != len(self._shifts):
+            self._positions[item_id] = (position, len(self._shifts))
+        return position
+
+    def reset(self):
+        """Notify attached views that the source changed arbitrarily
+
+        Views must be detached and reattached for GTK to pick up the new row
+        count, which is what `ObjectList.refresh_source` does.
+        """
+        self._positions = None
+        self._shifts = []
+        self._stamp = self._stamp % (2 ** 31 - 1) + 1
+
+    def _shifted(self, position, applied):
+        # apply the shifts recorded since the entry was stored
+        for shift_position, delta in self._shifts[applied:]:
+            if position >= shift_position:
+                position += delta
+        return position
+
+    def _record_position(self, item, position):
+        if self._positions is not None:
+            self._positions[id(item)] = (position, len(self._shifts))
+
+    def _record_shift(self, position, delta):
+        if self._positions is None:
+            return
+        self._shifts.append((position, delta))
+        if len(self._shifts) > max(_MIN_SHIFTS,
+                                   int(len(self.source) ** 0.5)):
+            # lookups would get slow, start over
+            self._positions = None
+            self._shifts = []
+
+    def _rebuild_positions(self):
+        self._shifts = []
+        self._positions = dict((id(item), (i, 0))
+                               for i, item in enumerate(self.source))
+
+    # ListStore-like mutation API
+
+    def append(self, row):
+        return self.insert(len(self.source), row)
+
+    def insert(self, position, row):
+        if position < 0 or position > len(self.source):
+            position = len(self.source)
+        self.source.insert(position, row[0])
+        if position < len(self.source) - 1:
+            self._record_shift(position, 1)
+        self._record_position(row[0], position)
+        itr = self._create_iter(position)
+        self.row_inserted(Gtk.TreePath((position, )), itr)
+        return itr
+
+    def remove(self, itr):
+        position = itr.user_data
+        item = self.source[position]
+        del self.source[position]
+        if self._positions is not None:
+            self._positions.pop(id(item), None)
+            if position < len(self.source):
+                # a removal at `position` moves the later rows up
+                self._record_shift(position + 1, -1)
+        self.row_deleted(Gtk.TreePath((position, )))
+        return False
+
+    def set(self, itr, column, value):
+        position = itr.user_data
+        if self._positions is not None:
+            self._positions.pop(id(self.source[position]), None)
+        self.source[position] = value
+        self._record_position(value, position)
+        self.row_changed(Gtk.TreePath((position, )), itr)
+
+    def swap(self, itr1, itr2):
+        source = self.source
+        a, b = itr1.user_data, itr2.user_data
+        source[a], source[b] = source[b], source[a]
+        self._record_position(source[a], a)
+        self._record_position(source[b], b)
+        self.row_changed(Gtk.TreePath((a, )), self._create_iter(a))
+        self.row_changed(Gtk.TreePath((b, )), self._create_iter(b))
+
+    def clear(self):
+        for position in range(len(self.source) - 1, -1, -1):
+            del self.source[position]
+            self.row_deleted(Gtk.TreePath((position, )))
+        self._positions = {}
+        self._shifts = []
+
+    def _create_iter(self, position):
+        itr = Gtk.TreeIter()
+        itr.stamp = self._stamp
+        itr.user_data = position
+        return itr
+
+
+class SequenceIterIndex(object):
+    """Stand-in for the `IterIndex` of an ObjectList over a SequenceModel
+
+    Iters are computed from the model on lookup rather than stored, since
+    SequenceModel iters do not persist.  Writes are ignored, because the model
+    keeps its own id to position map.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __contains__(self, item):
+        return self.model.position_of_id(id(item)) is not None
+
+    def iter_for(self, item):
+        position = self.model.position_of_id(id(item))
+        if position is None:
+            raise KeyError(item)
+        return self.model.iter_for_position(position)
+
+    def lookup(self, item):
+        if item in self:
+            return item
+        return None
+
+    def add(self, item, itr):
+        pass
+
+    def discard(self, item):
+        pass
+
+    def __len__(self):
+        return len(self.model.source)
+
+    def clear(self):
+        pass
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.sort_engine
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sorting of ObjectList rows by precomputed keys.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import bisect
+
+
+class SortEngine(object):
+    """Sort the rows of a ListStore by keys extracted once per row
+
+    Keys are cached per sort spec and item, so sorting again (or comparing
+    rows from a TreeModelSort comparator) does not re-run `getattr` or key
+    functions.  Items that changed must be passed to `forget` so their keys
+    are recomputed.
+
+    A sort spec is either an attribute name or a callable taking the item and
+    returning its key.
+    """
+
+    def __init__(self):
+        self._keys = {}
+
+    def key_for(self, spec, item):
+        """Return the (cached) sort key of an item
+
+        :param spec: An attribute name or key callable
+        :param item: The item to get the key for
+        """
+        cache = self._keys.get(spec)
+        if cache is None:
+            cache = self._keys[spec] = {}
+        item_id = id(item)
+        try:
+            return cache[item_id]
+        except KeyError:
+            if callable(spec):
+                key = spec(item)
+            else:
+                key = getattr(item, spec, None)
+            cache[item_id] = key
+            return key
+
+    def forget(self, item):
+        """Drop the cached keys of an item, e.g. after it was updated"""
+        item_id = id(item)
+        for cache in self._keys.values():
+            cache.pop(item_id, None)
+
+    def discard(self, spec):
+        """Drop the cached keys of a sort spec which is no longer used"""
+        self._keys.pop(spec, None)
+
+    def clear(self):
+        """Drop all cached keys"""
+        self._keys.clear()
+
+    def sort_order(self, items, spec, reverse=False):
+        """Return the permutation that sorts `items` by `spec`
+
+        The permutation is in the form expected by `Gtk.ListStore.reorder`,
+        i.e. ``order[new_position] == old_position``.  `None` keys sort
+        before all other keys.
+        """
+        key_for = self.key_for
+        return sort_permutation([key_for(spec, item) for item in items],
+                                reverse)
+
+    def sort(self, model, spec, reverse=False):
+        """Sort the rows of a flat model in place using `model.reorder`
+
+        :returns: Whether any rows were moved
+        """
+        order = self.sort_order([row[0] for row in model], spec, reverse)
+        if any(i != j for i, j in enumerate(order)):
+            model.reorder(order)
+            return True
+        return False
+
+
+class RankIndex(object):
+    """Sort ranks of the rows of a model, for a TreeModelSort to sort by
+
+    Each item is given a float rank, ordered like its sort key, which is
+    stored in a model column that GTK sorts in C, so the rows keep their
+    order in the model.  `build` ranks all items from keys extracted once
+    per item.  An item added later, or whose key changed, is ranked halfway
+    between its neighbours in key order, so only its own rank changes.
+    Once no float is left between two neighbours, the index is `stale` and
+    must be built again.
+    """
+
+    def __init__(self):
+        #: The spec ranked by, or None while ranking is off
+        self.spec = None
+        self.stale = False
+        self._key_for = None
+        # the (None first) keys of the ranked items, in order, and their ranks
+        self._keys = []
+        self._ranks = []
+        # id(item) -> rank
+        self._rank_of = {}
+
+    def build(self, items, spec, key_for):
+        """Rank `items` by `spec`, returning the rank of each item
+
+        :param items: The items to rank
+        :param spec: An attribute name or key callable
+        :param key_for: Returns the key of an item for a spec, e.g.
+                        `SortEngine.key_for`
+        """
+        self.spec = spec
+        self._key_for = key_for
+        keys = [_none_first(key_for(spec, item)) for item in items]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        ranks = [0.] * len(keys)
+        for rank, i in enumerate(order):
+            ranks[i] = float(rank)
+        self._keys = [keys[i] for i in order]
+        self._ranks = [float(rank) for rank in range(len(keys))]
+        self._rank_of = dict((id(item), rank)
+                             for item, rank in zip(items, ranks))
+        self.stale = False
+        return ranks
+
+    def rebuild(self, items):
+        """Rank `items` again by the current spec, see `build`"""
+        return self.build(items, self.spec, self._key_for)
+
+    def add(self, item):
+        """Rank an item that was added, or whose key changed
+
+        :returns: The rank of the item, 0 while ranking is off
+        """
+        if self.spec is None:
+            return 0.
+        self.remove(item)
+        if self.stale:
+            # ranked when the index is built again
+            return 0.
+        key = _none_first(self._key_for(self.spec, item))
+        position = bisect.bisect_right(self._keys, key)
+        ranks = self._ranks
+        if not ranks:
+            rank = 0.
+        elif position == 0:
+            rank = ranks[0] - 1
+        elif position == len(ranks):
+            rank = ranks[-1] + 1
+        else:
+            low, high = ranks[position - 1], ranks[position]
+            rank = (low + high) / 2
+            if not low < rank < high:
+                self.stale = True
+                return rank
+        self._keys.insert(position, key)
+        ranks.insert(position, rank)
+        self._rank_of[id(item)] = rank
+        return rank
+
+    def remove(self, item):
+        """Drop the rank of an item"""
+        rank = self._rank_of.pop(id(item), None)
+        if rank is None or self.stale:
+            return
+        position = bisect.bisect_left(self._ranks, rank)
+        del self._keys[position]
+        del self._ranks[position]
+
+    def invalidate(self):
+        """Mark the index stale, e.g. while many items are added at once"""
+        if self.spec is not None:
+            self.stale = True
+
+    def clear(self):
+        """Drop all ranks, keeping the spec"""
+        self._keys = []
+        self._ranks = []
+        self._rank_of = {}
+        self.stale = False
+
+    def stop(self):
+        """Stop ranking items"""
+        self.clear()
+        self.spec = None
+        self._key_for = None
+
+
+def sort_permutation(keys, reverse=False):
+    """Return the permutation that sorts `keys`, see `SortEngine.sort_order`
+
+    This is a plain function of the keys, so it can run on another thread or
+    in another process.
+    """
+    keys = [_none_first(key) for key in keys]
+    return sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+
+
+def _none_first(key):
+    return (key is not None, key)
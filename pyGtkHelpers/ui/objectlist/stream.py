@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.stream
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Populate an ObjectList from a (slow) iterable without blocking the UI.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import queue
+import sys
+import threading
+import time
+
+from gi.repository import GLib
+
+_END = object()
+
+
+class StreamTask(object):
+    """Stream items from an iterable into an ObjectList
+
+    Items are pulled from the iterable on a worker thread into a bounded
+    queue, so a slow source (database cursor, file, socket) never blocks the
+    main loop and at most `chunk_size * max_chunks` pending items are held in
+    memory.  On the main loop the queue is drained in chunks of `chunk_size`
+    items, spending at most `budget_ms` per frame.  Chunks added to an empty
+    list are bulk-loaded with `batch()`; later chunks are appended to the
+    attached model, so the cost of a chunk does not grow with the length of
+    the list, and the selection and scroll position are kept.  An exception
+    raised by the iterable ends the stream, and is stored in `error` and
+    passed to `sys.excepthook` on the main loop.
+
+    Use `ObjectList.stream_from` rather than creating this directly.
+
+    :param object_list: The list to extend
+    :param iterable: The source of items
+    :param chunk_size: The number of items added to the list at once
+    :param budget_ms: The time spent adding items per main loop iteration
+    :param max_chunks: The number of chunks the worker may read ahead
+    :param progress_callback: Called on the main loop as
+                              `progress_callback(count)` after items were
+                              added, with the total number of items so far
+    :param complete_callback: Called on the main loop as
+                              `complete_callback(count)` when the stream is
+                              exhausted, failed (see `error`) or cancelled
+    """
+
+    #: How often the queue is drained, roughly once per frame
+    interval_ms = 16
+
+    def __init__(self, object_list, iterable, chunk_size=500, budget_ms=8,
+                 max_chunks=4, progress_callback=None,
+                 complete_callback=None):
+        self.object_list = object_list
+        self.iterable = iterable
+        self.chunk_size = chunk_size
+        self.budget_ms = budget_ms
+        self.progress_callback = progress_callback
+        self.complete_callback = complete_callback
+        self.count = 0
+        self.done = False
+        self.error = None
+        self._exc_info = None
+        self._queue = queue.Queue(maxsize=chunk_size * max_chunks)
+        self._cancelled = threading.Event()
+        self._source_id = None
+
+    def start(self):
+        """Start reading the iterable and adding items to the list"""
+        thread = threading.Thread(target=self._work)
+        thread.daemon = True
+        thread.start()
+        self._source_id = GLib.timeout_add(self.interval_ms, self._on_timeout)
+
+    def cancel(self):
+        """Stop streaming, keeping the items added so far"""
+        self._cancelled.set()
+        if not self.done:
+            self._finish()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def pending(self):
+        """The number of items read but not yet added to the list"""
+        return self._queue.qsize()
+
+    def _work(self):
+        try:
+            for item in self.iterable:
+                if not self._put(item):
+                    return
+        except Exception as exception:
+            self.error = exception
+            self._exc_info = sys.exc_info()
+        self._put(_END)
+
+    def _put(self, item):
+        # block while the queue is full, unless cancelled
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _on_timeout(self):
+        if self.done:
+            return False
+        deadline = time.monotonic() + self.budget_ms / 1000.
+        added = 0
+        finished = False
+        while not finished and time.monotonic() < deadline:
+            chunk = []
+            try:
+                while len(chunk) < self.chunk_size:
+                    item = self._queue.get_nowait()
+                    if item is _END:
+                        finished = True
+                        break
+                    chunk.append(item)
+            except queue.Empty:
+                pass
+            if chunk:
+                object_list = self.object_list
+                object_list.extend(chunk, batch=not len(object_list))
+                added += len(chunk)
+            elif not finished:
+                # nothing ready yet, wait for the next frame
+                break
+        if added:
+            self.count += added
+            if self.progress_callback is not None:
+                self.progress_callback(self.count)
+        if finished:
+            self._source_id = None
+            if self._exc_info is not None:
+                sys.excepthook(*self._exc_info)
+            self._finish()
+            return False
+        return True
+
+    def _finish(self):
+        self.done = True
+        if self._source_id is not None:
+            GLib.source_remove(self._source_id)
+            self._source_id = None
+        if self.complete_callback is not None:
+            self.complete_callback(self.count)
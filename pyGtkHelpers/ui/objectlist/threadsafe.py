@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.threadsafe
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Mutate an ObjectList from worker threads.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+import collections
+import sys
+import time
+
+from gi.repository import GLib
+
+
+class ThreadSafeList(object):
+    """Queue mutations of an ObjectList or ObjectTree from any thread
+
+    Mutations are appended to a `collections.deque`, which needs no lock, and
+    applied in order on the main loop by a single idle callback, instead of
+    one `gcall` per mutation.  Consecutive appends are coalesced into one
+    `extend`, bulk-loaded with `batch()` when there are at least `batch_size`
+    of them, and updates go through `update(item, deferred=True)`, so an item
+    updated many times is redrawn once per frame::
+
+        proxy = objectlist.threadsafe()
+        # in a worker thread
+        for row in rows:
+            proxy.append(row)
+
+    Use `ObjectList.threadsafe` rather than creating this directly.
+    Exceptions raised by a mutation are passed to `sys.excepthook`, and the
+    remaining mutations are still applied.
+
+    :param object_list: The list to mutate
+    """
+
+    #: Runs of appended items at least this long are loaded with `batch()`
+    batch_size = 1000
+
+    def __init__(self, object_list):
+        self.object_list = object_list
+        self._queue = collections.deque()
+        self._scheduled = False
+        #: The largest number of queued mutations seen
+        self.max_queue_depth = 0
+        #: The number of mutations applied
+        self.applied_count = 0
+        #: Seconds between queueing and applying the last mutation
+        self.last_latency = 0.
+        #: The longest time between queueing and applying a mutation
+        self.max_latency = 0.
+        self._total_latency = 0.
+
+    @property
+    def queue_depth(self):
+        """The number of mutations waiting to be applied"""
+        return len(self._queue)
+
+    @property
+    def mean_latency(self):
+        """The mean time between queueing and applying a mutation"""
+        if not self.applied_count:
+            return 0.
+        return self._total_latency / self.applied_count
+
+    def reset_stats(self):
+        self.max_queue_depth = len(self._queue)
+        self.applied_count = 0
+        self.last_latency = self.max_latency = self._total_latency = 0.
+
+    def append(self, item, parent=None):
+        """Queue adding an item at the end of the list
+
+        :param parent: For an ObjectTree, the parent item or None
+        """
+        self._put('extend', [item], parent)
+
+    def extend(self, items, parent=None):
+        """Queue adding several items at the end of the list"""
+        self._put('extend', list(items), parent)
+
+    def insert(self, *args, **kwargs):
+        """Queue an `insert`, taking the same arguments"""
+        self._put('insert', args, kwargs)
+
+    def remove(self, item):
+        """Queue removing an item"""
+        self._put('remove', (item, ), {})
+
+    def update(self, item):
+        """Queue redrawing an item, see `ObjectList.update`"""
+        self._put('update', item, None)
+
+    def clear(self):
+        """Queue removing all items"""
+        self._put('clear', (), {})
+
+    def flush(self):
+        """Apply the queued mutations now, must be called on the main loop"""
+        self._scheduled = False
+        queue = self._queue
+        # only take what is queued now, so busy producers cannot stall the
+        # main loop
+        pending = [queue.popleft() for _ in range(len(queue))]
+        position = 0
+        while position < len(pending):
+            name, args, kwargs, queued = pending[position]
+            end = position + 1
+            if name == 'extend':
+                # coalesce a run of appends to the same parent
+                items = list(args)
+                while (end < len(pending) and pending[end][0] == 'extend' and
+                       pending[end][2] is kwargs):
+                    items.extend(pending[end][1])
+                    end += 1
+                extend_kwargs = {'batch': len(items) >= self.batch_size}
+                if kwargs is not None:
+                    extend_kwargs['parent'] = kwargs
+                self._apply(self.object_list.extend, (items, ), extend_kwargs)
+            elif name == 'update':
+                self._apply(self.object_list.update, (args, ),
+                            {'deferred': True})
+            else:
+                self._apply(getattr(self.object_list, name), args, kwargs)
+            now = time.monotonic()
+            for name, args, kwargs, queued in pending[position:end]:
+                self._record_latency(now - queued)
+            position = end
+        return False
+
+    def _put(self, name, args, kwargs):
+        # deque.append is atomic, so producers need no lock
+        self._queue.append((name, args, kwargs, time.monotonic()))
+        depth = len(self._queue)
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if not self._scheduled:
+            # a race may schedule a second, harmless, flush
+            self._scheduled = True
+            GLib.idle_add(self.flush)
+
+    def _apply(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+
+    def _record_latency(self, latency):
+        self.applied_count += 1
+        self.last_latency = latency
+        self._total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+    pyGtkHelpers.ui.objectlist.tree_index
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The structure of an ObjectTree, kept in Python for subtree operations.
+
+    :copyright: 2021 by pyGtkHelpers Authors
+    :license: LGPL 2 or later (see README/COPYING/LICENSE)
+"""
+
+
+class TreeIndex(object):
+    """Parent and children of each item in a tree, by `id(item)`
+
+    Depths are kept up to date on insertion, and sibling positions, once
+    computed, on every change, renumbering only the siblings after the
+    change.  Preorder numbers are computed for the whole tree in one pass on
+    first use after a structural change, so sorting or checking many items
+    costs O(1) per item.
+
+    Top-level items have the parent `None`.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.parents = {}
+        self.children = {None: []}
+        self.depths = {}
+        self._preorder = None
+        self._positions = None
+
+    def __contains__(self, item):
+        return id(item) in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, parent=None, position=None):
+        """Add an item as a child of `parent`
+
+        :param position: The position among the siblings, or None to add the
+                         item as the last child
+        """
+        item_id = id(item)
+        siblings = self.children[id(parent) if parent is not None else None]
+        if position is None or position >= len(siblings):
+            position = len(siblings)
+            siblings.append(item)
+        else:
+            siblings.insert(position, item)
+        self.items[item_id] = item
+        self.parents[item_id] = parent
+        self.children[item_id] = []
+        if parent is None:
+            self.depths[item_id] = 0
+        else:
+            self.depths[item_id] = self.depths[id(parent)] + 1
+        self._renumber(siblings, position)
+        self._preorder = None
+
+    def remove(self, item):
+        """Remove an item and its descendants
+
+        :returns: The removed descendants, not including `item`
+        """
+        descendants = list(self.iter_subtree(item))[1:]
+        for child in descendants:
+            self._drop(child)
+        parent = self.parents[id(item)]
+        siblings = self.children[id(parent) if parent is not None else None]
+        # by identity, as a sibling may compare equal to the item
+        position = self._position_in(siblings, item)
+        del siblings[position]
+        self._drop(item)
+        self._renumber(siblings, position)
+        self._preorder = None
+        return descendants
+
+    def remove_descendants(self, item):
+        """Remove the descendants of an item, keeping the item
+
+        :returns: The removed descendants
+        """
+        descendants = list(self.iter_subtree(item))[1:]
+        for child in descendants:
+            self._drop(child)
+        self.children[id(item)] = []
+        self._preorder = None
+        return descendants
+
+    def set_children(self, parent, children):
+        """Replace the order of the children of `parent`
+
+        Used after the model reordered the rows, the items must already be
+        children of `parent`.
+        """
+        siblings = list(children)
+        self.children[id(parent) if parent is not None else None] = siblings
+        self._renumber(siblings)
+        self._preorder = None
+
+    def clear(self):
+        self.items.clear()
+        self.parents.clear()
+        self.children.clear()
+        self.children[None] = []
+        self.depths.clear()
+        self._invalidate()
+
+    def parent_of(self, item):
+        return self.parents[id(item)]
+
+    def children_of(self, item):
+        """The children of an item, or the top-level items for `None`"""
+        return self.children[id(item) if item is not None else None]
+
+    def depth_of(self, item):
+        return self.depths[id(item)]
+
+    def preorder_of(self, item):
+        """The position of an item in a depth-first walk of the tree"""
+        if self._preorder is None:
+            self._preorder = dict((id(item), i)
+                                  for i, item in enumerate(self))
+        return self._preorder[id(item)]
+
+    def position_of(self, item):
+        """The position of an item among its siblings"""
+        if self._positions is None:
+            self._positions = {}
+            for siblings in self.children.values():
+                self._renumber(siblings)
+        return self._positions[id(item)]
+
+    def path_of(self, item):
+        """The tree path of an item, as a tuple of positions"""
+        path = []
+        while item is not None:
+            path.append(self.position_of(item))
+            item = self.parents[id(item)]
+        return tuple(reversed(path))
+
+    def iter_subtree(self, item):
+        """Yield an item and then its descendants, depth first"""
+        children = self.children
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            yield item
+            stack.extend(reversed(children[id(item)]))
+
+    def __iter__(self):
+        """Yield all items, depth first"""
+        children = self.children
+        stack = list(reversed(children[None]))
+        while stack:
+            item = stack.pop()
+            yield item
+            stack.extend(reversed(children[id(item)]))
+
+    def _renumber(self, siblings, start=0):
+        # update the positions of `siblings[start:]`, once positions are kept
+        positions = self._positions
+        if positions is not None:
+            for i in range(start, len(siblings)):
+                positions[id(siblings[i])] = i
+
+    def _position_in(self, siblings, item):
+        if self._positions is not None:
+            return self._positions[id(item)]
+        for position, sibling in enumerate(siblings):
+            if sibling is item:
+                return position
+        raise ValueError('item not in tree index')
+
+    def _invalidate(self):
+        self._preorder = None
+        self._positions = None
+
+    def _drop(self, item):
+        item_id = id(item)
+        del self.items[item_id]
+        del self.parents[item_id]
+        del self.children[item_id]
+        del self.depths[item_id]
+        if self._positions is not None:
+            self._positions.pop(item_id, None)
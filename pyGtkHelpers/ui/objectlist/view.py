@@ -10,11 +10,25 @@
     :license: LGPL 2 or later (see README/COPYING/LICENSE)
 """
 
-import itertools
+import collections
+import contextlib
+import functools
 import copy
+import random
+import threading
+import weakref
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 from pyGtkHelpers.utils import gsignal, cmp
+from .sequence_model import SequenceModel, SequenceIterIndex
+from .sort_engine import SortEngine, RankIndex, sort_permutation
+from .background import BackgroundJob, key_permutation, visibility_mask
+from .search_index import SearchIndex
+from .tree_index import TreeIndex
+from .identity import IterIndex
+from .column import Column
+from .stream import StreamTask
+from .threadsafe import ThreadSafeList
 
 
 class ObjectTreeViewBase(Gtk.TreeView):
@@ -24,6 +38,23 @@ class ObjectTreeViewBase(Gtk.TreeView):
     :param searchable: Whether this view is searchable
     :param sortable: Whether this view is sortable
     :param show_tooltips: Whether this view shows tooltips
+    :param render_cache: Whether to cache the formatted cell values of each
+                         item, so rows scrolled back into view are not
+                         formatted again.  Cached values are dropped by
+                         `update()` and in-place edits.
+    :param large_list: Whether to optimise the view for very long lists: all
+                       columns use fixed sizing, with widths measured from a
+                       sample of rows, and fixed-height mode is enabled, so
+                       GTK never measures every row.
+    :param key: An optional callable returning the identity key of an item.
+                Items with equal keys are then the same row, so value-equal
+                immutable rows such as tuples work, and `__contains__`,
+                `remove` and `update` also accept a key instead of an item.
+    :param shared_model: The `model_base` of another ObjectList, to show the
+                         same rows without copying them.  Rows added, removed
+                         or updated through either list appear in both, while
+                         filtering, sorting and selection stay independent.
+                         Native columns are those of the first list.
     """
 
     gsignal('item-activated', object)
@@ -34,30 +65,112 @@ class ObjectTreeViewBase(Gtk.TreeView):
     gsignal('item-middle-clicked', object, Gdk.Event)
     gsignal('item-double-clicked', object, Gdk.Event)
     gsignal('item-added', object)
+    # items-added(list of items), emitted once at the end of a batch
+    gsignal('items-added', object)
+    # selection-delta(list of selected items, list of unselected items)
+    gsignal('selection-delta', object, object)
     # editing-started(cellrenderer, editable, path, column)
     gsignal('editing-started', object, object, object, object)
     # editing-canceled(cellrenderer, column)
     gsignal('editing-canceled', object, object)
     # editing-done(editable, cellrenderer, path, column)
     gsignal('editing-done', object, object, object, object)
+    # emitted once the order of a background `sort_by()` is applied
+    gsignal('sort-done')
+    # emitted once the results of a background `set_visible_func()` are
+    # applied
+    gsignal('filter-done')
+
+    #: The sequence backing a virtual model, see `ObjectList`
+    source = None
+    _default_sort_order = None
+    _sort_spec = None
+    _resort_source = None
+    _visible_column = None
+    _visible_func_installed = False
+    _selection_blocked = False
+    _threadsafe = None
+    _view_sort = None
+    # the spec passed to the last `sort_by()`
+    _last_sort_spec = None
+    # the Gtk.TreeViewColumn of the last header click sorting by rank
+    _header_sort_column = None
+    # whether header clicks sort by rank, see `ObjectList`
+    _header_sorts_by_key = False
+    # the model column of the ranks header clicks sort by, see `RankIndex`
+    _rank_column = None
+    _sort_background = False
+    # whether to sort again once the running background sort is applied
+    _resort_again = False
+    # ids of items changed while a background filter job runs
+    _filter_dirty = None
 
     def __init__(self, columns=(), **kwargs):
         Gtk.TreeView.__init__(self)
+        shared_model = kwargs.pop('shared_model', None)
+        self._shared_index = None
+        if shared_model is not None:
+            self._shared_index = IterIndex.for_model(shared_model)
+            if self._shared_index is None or self.source is not None:
+                raise ValueError('shared_model must be the model_base of '
+                                 'another (non sequence-backed) ObjectList')
+        # typed copies of these columns' values are stored in the model
+        # alongside the item, see `Column`
+        if self._shared_index is not None:
+            self._native_columns = self._shared_index.native_columns
+        elif self.source is None:
+            self._native_columns = tuple(c for c in columns if c.native)
+        else:
+            self._native_columns = ()
         # XXX: make replacable
-        self.model = self.create_model()
+        if shared_model is not None:
+            self.model = shared_model
+        else:
+            self.model = self.create_model()
         self.model_base = self.model
-        self.model_filter = self.model.filter_new()
-        self.model_sort = Gtk.TreeModelSort(model=self.model_filter)
-        self.model_tree = self.model_sort
-        self.set_model(self.model_sort)
-        # setup sorting
+        self.columns = None
         self.sortable = kwargs.pop('sortable', True)
+        self.key = kwargs.pop('key', None)
+        self._position_indexes = {'base': PositionIndex(
+            depth_first=not (self.model.get_flags() &
+                             Gtk.TreeModelFlags.LIST_ONLY))}
+        self._position_indexes['base'].connect_model(self.model)
+        self._sort_engine = SortEngine()
+        # off-main-loop sort and filter computations, see `sort_by` and
+        # `set_visible_func`
+        self._sort_job = BackgroundJob()
+        self._filter_job = BackgroundJob()
+        # bumped whenever rows are added, removed or moved
+        self._model_version = 0
+        # id(item) -> cached result of the visible function
+        self._visibility = {}
+        # Column -> SearchIndex, built on first search
+        self._search_indexes = {}
+        # id(item) -> item, for `update(item, deferred=True)`
+        self._dirty_items = {}
+        self._update_flush = None
+        # id(item) -> item for the selected rows, in view order
+        self._selected = {}
+        # id(item) -> {Cell: [(property, value), ...]}
+        if kwargs.pop('render_cache', False):
+            self._render_cache = {}
+        else:
+            self._render_cache = None
+        self._create_proxy_models()
+        self.set_model(self.model_sort)
+        # bulk-load state, see `batch()`
+        self._batch_depth = 0
+        self._batch_items = None
+        self._batch_sort_state = None
+        self._batch_view_state = None
         self.searchable = kwargs.pop('searchable', True)
         self.set_enable_search(self.searchable)
         if self.searchable:
             self.set_search_column(0)
-        self.columns = None
         self.set_columns(columns)
+        self.large_list = kwargs.pop('large_list', False)
+        if self.large_list:
+            self._setup_large_list()
         # misc initial setup
         self.set_property('has-tooltip', kwargs.pop('show_tooltips', True))
         self._connect_internal()
@@ -72,6 +185,224 @@ class ObjectTreeViewBase(Gtk.TreeView):
         """
         raise NotImplementedError
 
+    def create_iter_index(self):
+        """Create the mapping of items to model iters for the model
+
+        :rtype: IterIndex
+        """
+        return IterIndex(self.model, key=self.key)
+
+    def _model_types(self):
+        # column types for the base model: the item, then native columns
+        return (object, ) + tuple(c.native_type for c in self._native_columns)
+
+    def native_column_index(self, column):
+        """Return the model column index holding a native column's values
+
+        :param column: A Column created with `native=True`
+        :rtype: int
+        """
+        if column in self._native_columns:
+            return self._native_columns.index(column) + 1
+        # a view of a shared model, whose columns were created by its owner
+        for idx, native in enumerate(self._native_columns):
+            if (native.attr == column.attr and
+                    native.native_type == column.native_type):
+                return idx + 1
+        raise ValueError('no native column for %r' % column.attr)
+
+    def python_sort_column_id(self, column):
+        """Return the sort column id of a column sorted by a Python function
+
+        The ids follow the model columns, so they never collide with the
+        ids of native columns, which are model column indexes.
+
+        :param column: A Column of this list
+        :rtype: int
+        """
+        return self.model.get_n_columns() + self.columns.index(column)
+
+    def _row_for(self, item):
+        if not self._native_columns:
+            return (item, )
+        return (item, ) + tuple(c.native_value(item)
+                                for c in self._native_columns)
+
+    def _set_row(self, giter, item):
+        row = self._row_for(item)
+        if len(row) == 1:
+            self.model.set(giter, 0, item)
+        else:
+            self.model.set(giter, list(range(len(row))), list(row))
+
+    def _create_proxy_models(self):
+        # (re)build the filter and sort models on top of the base model,
+        # restoring the visible function and column sort functions
+        if self.source is not None:
+            # virtual models are shown directly, so only the rows GTK asks
+            # for are ever read
+            self.model_filter = self.model_sort = self.model_tree = self.model
+            return
+        self.model_filter = self.model.filter_new()
+        self._visible_func_installed = False
+        if self._visible_column is not None:
+            self.model_filter.set_visible_column(self._visible_column)
+        elif '_visible_func' in vars(self):
+            self._install_visible_func()
+        self.model_sort = Gtk.TreeModelSort(model=self.model_filter)
+        self.model_tree = self.model_sort
+        if self._view_sort is not None:
+            self._install_view_sort()
+        for name, model in (('filter', self.model_filter),
+                            ('sort', self.model_sort)):
+            self._position_indexes[name] = PositionIndex()
+            self._position_indexes[name].connect_model(model)
+        self.model_sort.connect('rows-reordered', self._on_rows_reordered)
+        self.model_sort.connect('sort-column-changed',
+                                self._on_sort_column_changed)
+        if self.columns and self.sortable and not self._header_sorts_by_key:
+            for col in self.columns:
+                if col.sorted and not col.sorts_natively:
+                    self.model_sort.set_sort_func(
+                        self.python_sort_column_id(col),
+                        col._default_sort_func, self)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager to bulk-load items into the view.
+
+        While the block runs, the view is detached from its models and the
+        filter and sort models are dropped, so inserted rows are not
+        reprocessed one at a time.  On exit the models are rebuilt and
+        reattached once, and a single `items-added` signal is emitted with
+        the list of items added during the block::
+
+            with objectlist.batch():
+                for item in items:
+                    objectlist.append(item)
+
+        Batches may be nested; only the outermost one has any effect.  The
+        selection, cursor and top row of the view are kept.  While a batch
+        is active, items may be added, updated and looked up, and the
+        selection, sort order and visible function set; the view shows the
+        changes when the batch ends.
+        """
+        self._begin_batch()
+        try:
+            yield self
+        finally:
+            self._end_batch()
+
+    @property
+    def in_batch(self):
+        """Whether a bulk-load `batch()` is currently active"""
+        return self._batch_depth > 0
+
+    def _begin_batch(self):
+        self._batch_depth += 1
+        if self._batch_depth > 1:
+            return
+        self._batch_items = []
+        self._batch_sort_state = (self._get_sort_state(self.model),
+                                  self._get_sort_state(self.model_sort))
+        self._batch_view_state = self._save_view_state()
+        # the view unselects all rows when its model is unset: keep
+        # `_selected`, which stands in for the selection until the batch ends
+        self.selection.handler_block(self.selection_connect)
+        self.set_model(None)
+        # until the proxies are rebuilt, their rows are the model's rows, as
+        # for virtual models, so lookups and updates keep working
+        self.model_filter = self.model_sort = self.model_tree = self.model
+        sort_column_id, order = self._batch_sort_state[0]
+        if sort_column_id is not None:
+            # keep the base model from re-sorting on every insert
+            self.model.set_sort_column_id(
+                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, order)
+
+    def _end_batch(self):
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return
+        base_state, sort_state = self._batch_sort_state
+        if base_state[0] is not None:
+            self.model.set_sort_column_id(*base_state)
+        self._create_proxy_models()
+        if sort_state[0] is not None and self._view_sort is None:
+            # (a view sort is installed with the proxies)
+            self.model_sort.set_sort_column_id(*sort_state)
+        self.set_model(self.model_sort)
+        items, self._batch_items = self._batch_items, None
+        view_state, self._batch_view_state = self._batch_view_state, None
+        self._batch_sort_state = None
+        self.selection.handler_unblock(self.selection_connect)
+        self._restore_view_state(*view_state)
+        if items:
+            self.emit('items-added', items)
+
+    def _save_view_state(self):
+        # the selection, cursor and top row, which the view forgets along
+        # with its model
+        cursor_path = self.get_cursor()[0]
+        cursor_item = (self._object_at_sort_path(cursor_path)
+                       if cursor_path is not None else None)
+        visible_range = (self.get_visible_range() if self.get_realized()
+                         else None)
+        top_path = visible_range[0] if visible_range else None
+        top_item = (self._object_at_sort_path(top_path)
+                    if top_path is not None else None)
+        return dict(self._selected), cursor_item, top_item
+
+    def _restore_view_state(self, selected, cursor_item, top_item):
+        # `_selected` holds the selection made during the batch, `selected`
+        # the one the view had before, to report the difference against
+        new_selection, self._selected = self._selected, selected
+        with self._bulk_selection():
+            cursor_path = self._shown_sort_path(cursor_item)
+            if cursor_path is not None:
+                # moving the cursor selects its row
+                self.set_cursor(cursor_path)
+            self.selection.unselect_all()
+            for item in new_selection.values():
+                path = self._shown_sort_path(item)
+                if path is not None:
+                    self.selection.select_path(path)
+        top_path = self._shown_sort_path(top_item)
+        if top_path is not None:
+            # done once the rows are laid out
+            self.scroll_to_cell(top_path, None, True, 0., 0.)
+
+    def _shown_sort_path(self, item):
+        # the path of a listed item in the view, or None if it is not shown
+        if item is None or self._lookup(item) is not item:
+            return None
+        try:
+            return self.model_sort.get_path(self._sort_iter_for(item))
+        except ValueError:
+            # filtered out
+            return None
+
+    def _get_sort_state(self, model):
+        # (sort_column_id, order), or (None, None) for unsorted models
+        if not isinstance(model, Gtk.TreeSortable):
+            return None, None
+        sort_column_id, order = model.get_sort_column_id()
+        if (sort_column_id is None and model is self.model and
+                self._default_sort_order is not None):
+            # the default sort func installed by `sort_by()`
+            return (Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID,
+                    self._default_sort_order)
+        if (sort_column_id is None and model is self.model_sort and
+                self._view_sort is not None):
+            # the view's own `sort_by()` order over a shared model
+            return (Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID,
+                    self._view_sort[1])
+        return sort_column_id, order
+
+    def _add_batch_item(self, item, select):
+        self._batch_items.append(item)
+        if select:
+            self.selected_item = item
+
     def __len__(self):
         """Number of items in this list
         """
@@ -80,9 +411,10 @@ class ObjectTreeViewBase(Gtk.TreeView):
     def __contains__(self, item):
         """Identity based check of membership
 
-        :param item: The item to check membership for
+        :param item: The item to check membership for, or its key if the
+                     list was created with a `key` function
         """
-        return id(item) in self._id_to_iter
+        return item in self._id_to_iter
 
     def __iter__(self):
         """Iterable
@@ -94,24 +426,133 @@ class ObjectTreeViewBase(Gtk.TreeView):
         # index can be an integer or an iter
         return self._object_at_iter(index)
 
+    def index_of(self, item):
+        """Return the position of an item in the list
+
+        The position is looked up in an index that is maintained from the
+        model's signals, rather than by walking the rows.  For an ObjectTree
+        the position is the item's index in depth-first order.
+
+        :param item: The item to find
+        :raises ValueError: If the item is not present in the list.
+        :rtype: int
+        """
+        position = self._index_position('base', item)
+        if position is None:
+            raise ValueError('objectlist.index_of(item) failed, item not in '
+                             'list')
+        return position
+
+    def view_index_of(self, item):
+        """Return the position at which an item is displayed
+
+        This takes the current filter and sort order into account.  For an
+        ObjectTree only top-level rows have a view position.
+
+        :param item: The item to find
+        :returns: The displayed position, or None if the item is not shown.
+        """
+        return self._index_position('sort', item)
+
+    def item_at(self, view_position):
+        """Return the item displayed at a position
+
+        :param view_position: The displayed (filtered and sorted) position
+        :raises IndexError: If there is no row at the position.
+        """
+        if self.source is not None:
+            return self.source[view_position]
+        return self._get_position_index('sort').item_at(view_position)
+
+    def _index_position(self, name, item):
+        if self.source is not None:
+            return self.model.position_of_id(id(item))
+        return self._get_position_index(name).index_of(item)
+
+    def _get_position_index(self, name):
+        if self.in_batch:
+            # the view shows the model's rows until the batch ends
+            name = 'base'
+        index = self._position_indexes[name]
+        if index.stale:
+            if name == 'base':
+                index.build(iter(self))
+            else:
+                model = getattr(self, 'model_' + name)
+                index.build(row[0] for row in model)
+        return index
+
     def __delitem__(self, itr):  # XXX
         obj = self._object_at_iter(itr)
-        del self._id_to_iter[id(obj)]
+        self._id_to_iter.discard(obj)
+        self._forget_item(obj)
         self.model.remove(itr)
 
     def set_columns(self, columns):
         assert not self.columns
         self.columns = tuple(columns)
+        # (Column, Gtk.TreeViewColumn) pairs
+        self._view_columns = []
         for idx, col in enumerate(columns):
             view_col = col.create_treecolumn(self)
             view_col.set_data('pyGtkHelpers::objectlist', self)
             self.append_column(view_col)
+            self._view_columns.append((col, view_col))
             # needs to be done after adding the column
             if col.expander:
                 self.set_expander_column(view_col)
-        self._id_to_iter = {}
+        if self._shared_index is not None:
+            self._id_to_iter = self._shared_index
+        else:
+            self._id_to_iter = self.create_iter_index()
+            self._id_to_iter.native_columns = self._native_columns
+        if hasattr(self._id_to_iter, 'views'):
+            self._id_to_iter.views.add(self)
         self._attach_edited_signals()
 
+    def _setup_large_list(self):
+        for col, view_col in self._view_columns:
+            view_col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            if col.width is None:
+                view_col.set_fixed_width(_header_width(view_col))
+        self.set_fixed_height_mode(True)
+        self._first_map_connect = self.connect('map', self._on_first_map)
+        self.connect('items-added', lambda *args:
+                     self.measure_column_widths())
+
+    def _on_first_map(self, widget):
+        self.disconnect(self._first_map_connect)
+        self.measure_column_widths()
+
+    def measure_column_widths(self, sample_size=1000):
+        """Set the fixed width of each column from a sample of rows
+
+        The widths are measured over the first rows plus a random sample of
+        `sample_size` rows, so the cost does not depend on the length of the
+        list.  Columns created with an explicit `width` are left alone.  This
+        is done automatically for `large_list` views when they are first
+        shown and after each `batch()`.
+
+        :param sample_size: The number of randomly chosen rows to measure
+        """
+        n_rows = self.model.iter_n_children(None)
+        positions = set(range(min(n_rows, _MEASURE_HEAD_ROWS)))
+        positions.update(random.sample(range(n_rows),
+                                       min(n_rows, sample_size)))
+        iters = [self.model.get_iter(Gtk.TreePath((i, )))
+                 for i in sorted(positions)]
+        for col, view_col in self._view_columns:
+            if col.width is not None:
+                continue
+            width = _header_width(view_col)
+            cells = view_col.get_cells()
+            spacing = view_col.get_spacing() * max(len(cells) - 1, 0)
+            for itr in iters:
+                view_col.cell_set_cell_data(self.model, itr, False, False)
+                width = max(width, spacing + sum(
+                    cell.get_preferred_width(self)[1] for cell in cells))
+            view_col.set_fixed_width(max(width, 1))
+
     def _attach_edited_signals(self):
         def register_done(treeview, cellrenderer, editable, path, column):
             def on_done(editable, cellrenderer, path, column):
@@ -137,6 +578,8 @@ class ObjectTreeViewBase(Gtk.TreeView):
         selection = self.get_selection()
         if selection.get_mode() != Gtk.SELECTION_SINGLE:
             raise AttributeError('selected_item not valid for select_multiple')
+        if self.in_batch:
+            return next(iter(self._selected.values()), None)
         model, selected = selection.get_selected()
         if selected is not None:
             return self._object_at_sort_iter(selected)
@@ -145,6 +588,10 @@ class ObjectTreeViewBase(Gtk.TreeView):
         selection = self.get_selection()
         if selection.get_mode() != Gtk.SELECTION_SINGLE:
             raise AttributeError('selected_item not valid for select_multiple')
+        if self.in_batch:
+            # the view's selection is set when the batch ends
+            self._selected = {} if item is None else {id(item): item}
+            return
         if item is None:
             selection.unselect_all()
         else:
@@ -165,22 +612,21 @@ class ObjectTreeViewBase(Gtk.TreeView):
         if selection.get_mode() != Gtk.SelectionMode.MULTIPLE:
             raise AttributeError('selected_items only valid for '
                                  'select_multiple')
-        model, selected_paths = selection.get_selected_rows()
-        result = []
-        for path in selected_paths:
-            result.append(model[path][0])
-        return result
+        return list(self._selected.values())
 
     def _set_selected_items(self, new_selection):
         selection = self.get_selection()
         if selection.get_mode() != Gtk.SelectionMode.MULTIPLE:
             raise AttributeError('selected_items only valid for '
                                  'select_multiple')
-        selection.unselect_all()
-        if new_selection is None:
-            new_selection = ()
-        for item in new_selection:
-            selection.select_iter(self._sort_iter_for(item))
+        if self.in_batch:
+            self._selected = {}
+            self.select_items(new_selection or ())
+            return
+        with self._bulk_selection():
+            selection.unselect_all()
+            if new_selection is not None:
+                self.select_items(new_selection)
 
     selected_items = property(
             fget=_get_selected_items,
@@ -191,9 +637,8 @@ class ObjectTreeViewBase(Gtk.TreeView):
 
     def _get_selected_id(self):
         selected_item = self.selected_item
-        selected_id = [i for i, v in enumerate(self) if v == selected_item]
-        if selected_id:
-            return selected_id[0]
+        if selected_item is not None:
+            return self._index_position('base', selected_item)
 
     def _set_selected_id(self, id):
         self.selected_item = self[id]
@@ -210,22 +655,24 @@ class ObjectTreeViewBase(Gtk.TreeView):
         selection = self.get_selection()
         if selection.get_mode() != Gtk.SelectionMode.MULTIPLE:
             raise AttributeError('selected_ids only valid for select_multiple')
+        if self.in_batch:
+            return tuple(self._index_position('sort', item)
+                         for item in self._selected.values())
         model, selected_paths = selection.get_selected_rows()
-        if selected_paths:
-            return zip(*selected_paths)[0]
-        else:
-            return ()
+        return tuple(path[0] for path in selected_paths)
 
     def _set_selected_ids(self, new_selection):
         selection = self.get_selection()
         if selection.get_mode() != Gtk.SelectionMode.MULTIPLE:
             raise AttributeError('selected_ids only valid for select_multiple')
-        selection.unselect_all()
-        if new_selection is None:
-            new_selection = ()
-        for row_id in new_selection:
-            giter = self._sort_iter_for(self[row_id])
-            selection.select_iter(giter)
+        if self.in_batch:
+            self._selected = {}
+            self.select_items(self[row_id] for row_id in new_selection or ())
+            return
+        with self._bulk_selection():
+            selection.unselect_all()
+            if new_selection is not None:
+                self.select_items(self[row_id] for row_id in new_selection)
 
     selected_ids = property(
             fget=_get_selected_ids,
@@ -234,18 +681,214 @@ class ObjectTreeViewBase(Gtk.TreeView):
             doc=_get_selected_ids.__doc__,
             )
 
+    def is_selected(self, item):
+        """Return whether an item is selected, without querying the view
+
+        :param item: The item to check
+        """
+        return id(item) in self._selected
+
+    def select_items(self, items):
+        """Add items to the selection
+
+        The selection handler is blocked while the rows are selected, so
+        `selection-changed` and `selection-delta` are emitted once rather
+        than once per row.
+
+        :param items: The items to select
+        """
+        if self.in_batch:
+            self._selected.update((id(item), item) for item in items)
+            return
+        selection = self.get_selection()
+        with self._bulk_selection():
+            for item in items:
+                selection.select_iter(self._sort_iter_for(item))
+
+    def unselect_items(self, items):
+        """Remove items from the selection, see `select_items`
+
+        :param items: The items to unselect
+        """
+        if self.in_batch:
+            for item in items:
+                self._selected.pop(id(item), None)
+            return
+        selection = self.get_selection()
+        with self._bulk_selection():
+            for item in items:
+                selection.unselect_iter(self._sort_iter_for(item))
+
+    def select_range(self, start, end):
+        """Select the displayed rows from `start` to `end`, inclusive
+
+        Positions are view positions, see `view_index_of`, and the selection
+        must allow multiple rows.  Use `select_range(0, len(view) - 1)` to
+        select all rows with a single notification.
+
+        :param start: The position of the first row to select
+        :param end: The position of the last row to select
+        """
+        if self.in_batch:
+            self.select_items([self.item_at(position)
+                               for position in range(start, end + 1)])
+            return
+        with self._bulk_selection():
+            self.get_selection().select_range(Gtk.TreePath(start),
+                                              Gtk.TreePath(end))
+
+    @contextlib.contextmanager
+    def _bulk_selection(self):
+        # block the per-change handler, then sync the selection once
+        if self._selection_blocked or self.in_batch:
+            yield
+            return
+        self._selection_blocked = True
+        self.selection.handler_block(self.selection_connect)
+        try:
+            yield
+        finally:
+            self.selection.handler_unblock(self.selection_connect)
+            self._selection_blocked = False
+            self._on_selection_changed(self.selection)
+
+    def _sync_selection(self):
+        # refresh the selected set, returning the (added, removed) items
+        model, paths = self.selection.get_selected_rows()
+        old = self._selected
+        if paths:
+            # skipping the placeholder rows of unloaded ObjectTree nodes
+            selected = dict((id(item), item)
+                            for item in (model[path][0] for path in paths)
+                            if item is not None)
+        else:
+            selected = {}
+        self._selected = selected
+        added = [item for item_id, item in selected.items()
+                 if item_id not in old]
+        removed = [item for item_id, item in old.items()
+                   if item_id not in selected]
+        return added, removed
+
+    def _on_rows_reordered(self, model, path, itr, new_order):
+        # keep `selected_items` in view order without re-reading the view
+        if len(self._selected) > 1:
+            order_key = self._view_order_key
+            self._selected = dict(sorted(
+                self._selected.items(), key=lambda pair: order_key(pair[1])))
+
+    def _view_order_key(self, item):
+        # a key sorting items in the order the view shows them
+        path = self.model_sort.get_path(self._sort_iter_for(item))
+        return path.get_indices()
+
     def clear(self):
         """Clear all the items in the list
         """
         self.model.clear()
         self._id_to_iter.clear()
-
-    def update(self, item):
+        for view in self._model_views():
+            view._clear_caches()
+
+    def _clear_caches(self):
+        self._sort_engine.clear()
+        self._visibility.clear()
+        for index in self._search_indexes.values():
+            index.clear()
+        self._dirty_items.clear()
+        if self._render_cache is not None:
+            self._render_cache.clear()
+
+    def update(self, item, deferred=False):
         """Manually update an item's display in the list
 
-        :param item: The item to be updated.
+        :param item: The item to be updated, or its key.
+        :param deferred: Whether to queue the update rather than apply it
+                         now. Queued items are updated together once per
+                         frame (or when the main loop is idle if the view is
+                         not mapped), however often they were queued, see
+                         `update_many`.
+        """
+        if self.key is not None:
+            item = self._listed_item(item, 'update')
+        if deferred:
+            self._dirty_items[id(item)] = item
+            self._queue_update_flush()
+            return
+        self._invalidate_item(item)
+        self._set_row(self._iter_for(item), item)
+
+    def update_many(self, items):
+        """Update the display of several items at once
+
+        Each row gets a single row-changed, and the sort order is re-evaluated
+        once for the whole batch rather than once per row when a large part
+        of the list changed.
+
+        :param items: The items to be updated, or their keys.
+        """
+        if self.key is not None:
+            items = [self._listed_item(item, 'update_many') for item in items]
+        else:
+            items = list(items)
+        if not items:
+            return
+        sort_state = (None, None)
+        if (self.model_sort is not self.model and
+                len(items) * _BULK_RESORT_RATIO >= len(self)):
+            # one full sort is cheaper than moving each changed row
+            sort_state = self._get_sort_state(self.model_sort)
+            if sort_state[0] is not None:
+                self.model_sort.set_sort_column_id(
+                    Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, sort_state[1])
+        try:
+            for item in items:
+                self._invalidate_item(item)
+                self._set_row(self._iter_for(item), item)
+        finally:
+            if sort_state[0] is not None:
+                self.model_sort.set_sort_column_id(*sort_state)
+
+    def threadsafe(self):
+        """Return a proxy to mutate this list from any thread
+
+        The proxy queues `append`, `extend`, `insert`, `remove`, `update` and
+        `clear` calls and applies them on the main loop in batches, see
+        `ThreadSafeList`.  The same proxy is returned on every call.
+
+        :rtype: ThreadSafeList
         """
-        self.model.set(self._iter_for(item), 0, item)
+        if self._threadsafe is None:
+            self._threadsafe = ThreadSafeList(self)
+        return self._threadsafe
+
+    def flush_updates(self):
+        """Apply the updates queued by `update(item, deferred=True)` now"""
+        if self._update_flush is not None:
+            kind, source_id = self._update_flush
+            if kind == 'tick':
+                self.remove_tick_callback(source_id)
+            else:
+                GLib.source_remove(source_id)
+            self._update_flush = None
+        items = list(self._dirty_items.values())
+        self._dirty_items.clear()
+        self.update_many(items)
+
+    def _queue_update_flush(self):
+        if self._update_flush is not None:
+            return
+        if self.get_mapped():
+            self._update_flush = ('tick', self.add_tick_callback(
+                self._on_update_flush))
+        else:
+            self._update_flush = ('idle', GLib.idle_add(
+                self._on_update_flush))
+
+    def _on_update_flush(self, *args):
+        self._update_flush = None
+        self.flush_updates()
+        return False
 
     def move_item_down(self, item):
         """Move an item down in the list.
@@ -256,7 +899,7 @@ class ObjectTreeViewBase(Gtk.TreeView):
         """
         next_iter = self._next_iter_for(item)
         if next_iter is not None:
-            self.model.swap(self._iter_for(item), next_iter)
+            self._swap_rows(self._iter_for(item), next_iter)
 
     def move_item_up(self, item):
         """Move an item up in the list.
@@ -267,7 +910,7 @@ class ObjectTreeViewBase(Gtk.TreeView):
         """
         prev_iter = self._prev_iter_for(item)
         if prev_iter is not None:
-            self.model.swap(prev_iter, self._iter_for(item))
+            self._swap_rows(prev_iter, self._iter_for(item))
 
     def item_after(self, item):
         """The item after an item
@@ -285,37 +928,170 @@ class ObjectTreeViewBase(Gtk.TreeView):
         if prev_iter is not None:
             return self._object_at_iter(prev_iter)
 
-    def set_visible_func(self, visible_func):
+    def set_visible_func(self, visible_func, narrowing=False,
+                         background=False, executor=None):
         """Set the function to decide visibility of an item
 
+        The result of the function is cached per item, so it is only called
+        again for items that are added, passed to `update()` or `refilter()`,
+        or edited in place.
+
         :param visible_func: A callable that returns a boolean result to
                              decide if an item should be visible, for
                              example::
 
                                 def is_visible(item):
                                     return True
+        :param narrowing: Whether `visible_func` hides at least the items
+                          hidden by the current function (e.g. a search
+                          string only got longer). Only the currently visible
+                          items are then tested again.
+        :param background: Whether to test the items off the main loop.  The
+                           current function stays in effect until all items
+                           were tested, then the view is refiltered once
+                           from the results, unless a newer function was set
+                           meanwhile, and `filter-done` is emitted.
+                           `visible_func` must then be safe to call from
+                           another thread.
+        :param executor: A `concurrent.futures` executor to test the items
+                         in, instead of a new thread.  With a process pool,
+                         the items and `visible_func` must be picklable.
         """
-        self.model_filter.set_visible_func(
-                self._internal_visible_func,
-                visible_func,
-                )
+        if self.source is not None:
+            raise ValueError('filtering is not supported for '
+                             'sequence-backed lists')
+        if self._visible_column is not None:
+            raise ValueError('visibility is already decided by the %r '
+                             'column' % self._visible_column)
+        self._filter_job.cancel()
+        self._filter_dirty = None
+        if background:
+            self._start_background_filter(visible_func, narrowing, executor)
+            return
+        if narrowing:
+            self._visibility = dict((item_id, visible) for item_id, visible
+                                    in self._visibility.items()
+                                    if not visible)
+        else:
+            self._visibility = {}
         self._visible_func = visible_func
+        if self.in_batch:
+            # installed with the filter model when the batch ends
+            return
+        if not self._visible_func_installed:
+            self._install_visible_func()
         self.model_filter.refilter()
 
+    def _start_background_filter(self, visible_func, narrowing, executor):
+        if narrowing:
+            known = dict((item_id, visible) for item_id, visible
+                         in self._visibility.items() if not visible)
+        else:
+            known = {}
+        items = [item for item in self if id(item) not in known]
+        self._filter_dirty = set()
+        self._filter_job.executor = executor
+        self._filter_job.start(visibility_mask, (items, visible_func),
+                               functools.partial(
+                                   self._on_visibility_computed, visible_func,
+                                   self._model_version, known, items))
+
+    def _on_visibility_computed(self, visible_func, version, visibility,
+                                items, mask):
+        dirty, self._filter_dirty = self._filter_dirty, None
+        lookup = self._id_to_iter.lookup
+        for item, visible in zip(items, mask):
+            if id(item) in dirty:
+                # changed meanwhile, test again when shown
+                continue
+            if version != self._model_version and lookup(item) is not item:
+                # removed meanwhile
+                continue
+            visibility[id(item)] = visible
+        self._visibility = visibility
+        self._visible_func = visible_func
+        if not self.in_batch:
+            # in a batch, the filter is installed when it ends
+            if not self._visible_func_installed:
+                self._install_visible_func()
+            self.model_filter.refilter()
+        self.emit('filter-done')
+
+    def refilter(self, items=None):
+        """Test the visibility of items again
+
+        :param items: The items whose visibility may have changed, or None to
+                      test all items
+        """
+        if items is None:
+            self._visibility.clear()
+            if not self.in_batch:
+                self.model_filter.refilter()
+            return
+        for item in items:
+            self._visibility.pop(id(item), None)
+            giter = self._iter_for(item)
+            # the filter model re-tests rows when they change
+            self.model.row_changed(self.model.get_path(giter), giter)
+
+    def _install_visible_func(self):
+        # a filter model only accepts one visible func, so install a single
+        # trampoline that reads the current `_visible_func`
+        self.model_filter.set_visible_func(self._internal_visible_func)
+        self._visible_func_installed = True
+
+    def set_visible_attr(self, attr):
+        """Show only items whose native bool column `attr` is True
+
+        Unlike `set_visible_func`, visibility is decided by GTK from the
+        typed model column, without calling back into Python.  Like the
+        visible function, this can only be set once.
+
+        :param attr: The attribute of a Column created with `type=bool` and
+                     `native=True`
+        """
+        columns = [c for c in self._native_columns
+                   if c.attr == attr and c.type is bool]
+        if not columns:
+            raise ValueError('no native bool column for attribute %r' % attr)
+        self._visible_column = self.native_column_index(columns[0])
+        if not self.in_batch:
+            self.model_filter.set_visible_column(self._visible_column)
+        self._visible_func = lambda item: bool(getattr(item, attr))
+
     def item_visible(self, item):
         """Return whether an item is visible
 
         :param item: The item to test visibility
         :rtype: bool
         """
-        return self._visible_func(item)
+        try:
+            return self._visibility[id(item)]
+        except KeyError:
+            return self._visible_func(item)
 
-    def sort_by(self, attr_or_key, direction='asc'):
+    def sort_by(self, attr_or_key, direction='asc', background=False,
+                executor=None):
         """Sort the view by an attribute or key
 
         :param attr_or_key: The attribute or key to sort by
         :param direction: Either `asc` or `desc` indicating the direction of
                           sorting
+        :param background: Whether to compute the sort order off the main
+                           loop.  Attribute values are read up-front, while
+                           key functions are called on the worker.  The rows
+                           are then moved with a single reorder once the
+                           order is ready, unless a newer sort was requested
+                           meanwhile, and `sort-done` is emitted.  Rows
+                           added meanwhile are sorted by one more job.
+                           Re-sorting after rows change is done the same
+                           way.  Only flat lists that do not share
+                           their model sort in the background; others sort
+                           immediately.
+        :param executor: A `concurrent.futures` executor to compute the
+                         order in, instead of a new thread.  With a process
+                         pool, keys (or the items and key function) must be
+                         picklable.
         """
         # work out the direction
         if direction in ('+', 'asc', Gtk.SortType.ASCENDING):
@@ -324,6 +1100,31 @@ class ObjectTreeViewBase(Gtk.TreeView):
             direction = Gtk.SortType.DESCENDING
         else:
             raise AttributeError('unrecognised direction')
+        if self.source is not None:
+            raise ValueError('sorting is not supported for '
+                             'sequence-backed lists')
+        self._end_header_sort()
+        if self._last_sort_spec is not None and \
+                self._last_sort_spec != attr_or_key:
+            # keep key caches from piling up, one per spec ever sorted by
+            self._sort_engine.discard(self._last_sort_spec)
+        self._last_sort_spec = attr_or_key
+        if self._model_is_shared():
+            # sort this view only, leaving the shared rows in place
+            self._sort_spec = None
+            self._view_sort = (attr_or_key, direction)
+            self._install_view_sort()
+            return
+        self._sort_job.cancel()
+        if isinstance(self.model, Gtk.ListStore):
+            # sort by precomputed keys and reorder the rows in one go, rather
+            # than having GTK call a Python comparator O(n log n) times
+            self._sort_spec = (attr_or_key,
+                               direction == Gtk.SortType.DESCENDING)
+            self._sort_background = background
+            self._sort_job.executor = executor
+            self._resort()
+            return
         if callable(attr_or_key):
             # is a key
             sort_func = self._key_sort_func
@@ -332,6 +1133,168 @@ class ObjectTreeViewBase(Gtk.TreeView):
             sort_func = self._attr_sort_func
         self.model.set_default_sort_func(sort_func, attr_or_key)
         self.model.set_sort_column_id(-1, direction)
+        self._default_sort_order = direction
+
+    def _show_header_sort(self, view_col, direction=None):
+        if self._header_sort_column is not None:
+            self._header_sort_column.set_sort_indicator(False)
+        self._header_sort_column = view_col
+        if view_col is not None:
+            view_col.set_sort_indicator(True)
+            view_col.set_sort_order(direction)
+
+    def _end_header_sort(self):
+        # a sort other than a header click's took over
+        self._show_header_sort(None)
+
+    def _on_sort_column_changed(self, model_sort):
+        sort_column_id = model_sort.get_sort_column_id()[0]
+        if sort_column_id is not None and sort_column_id != self._rank_column:
+            # GTK sorts by a native column now
+            self._end_header_sort()
+
+    def _install_view_sort(self):
+        if self.in_batch:
+            # installed with the sort model when the batch ends
+            return
+        spec, direction = self._view_sort
+        self.model_sort.set_default_sort_func(self._view_sort_func, spec)
+        self.model_sort.set_sort_column_id(
+            Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID, direction)
+
+    def _view_sort_func(self, model, itr1, itr2, spec):
+        # `model` is the filter model below the view's sort model
+        return self._compare_keys(spec, model.get_value(itr1, 0),
+                                  model.get_value(itr2, 0))
+
+    def _compare_keys(self, spec, item1, item2):
+        if item1 is None or item2 is None:
+            # placeholder rows of unloaded ObjectTree nodes sort first
+            return cmp(item2 is None, item1 is None)
+        key_for = self._sort_engine.key_for
+        return cmp(key_for(spec, item1), key_for(spec, item2))
+
+    def _resort(self):
+        if self._resort_source is not None:
+            GLib.source_remove(self._resort_source)
+            self._resort_source = None
+        if self._sort_spec is None:
+            return
+        spec, reverse = self._sort_spec
+        if self._model_is_shared():
+            # another view showed up on the rows meanwhile, which must keep
+            # their order: sort this view's sort model instead
+            self._sort_job.cancel()
+            self._sort_spec = None
+            self._view_sort = (spec, Gtk.SortType.DESCENDING if reverse
+                               else Gtk.SortType.ASCENDING)
+            self._install_view_sort()
+            return
+        if not self._sort_background:
+            self._reorder_model(self._sort_engine.sort_order(
+                [row[0] for row in self.model], spec, reverse))
+            return
+        if self._sort_job.pending:
+            # let the running job finish, rather than superseding it for
+            # every change, and sort again then
+            self._resort_again = True
+            return
+        items = [row[0] for row in self.model]
+        if callable(spec):
+            work, args = key_permutation, (items, spec, reverse)
+        else:
+            # read the attributes now, only sort on the worker
+            key_for = self._sort_engine.key_for
+            work, args = sort_permutation, (
+                [key_for(spec, item) for item in items], reverse)
+        self._sort_job.start(work, args, functools.partial(
+            self._on_sort_computed, self._model_version, items))
+
+    def _on_sort_computed(self, version, items, order):
+        if version != self._model_version:
+            # rows were added, removed or moved meanwhile: apply the order to
+            # the rows that were sorted, and sort once more for the others
+            order = self._order_of_sorted(items, order)
+            self._resort_again = True
+        self._reorder_model(order)
+        if self._resort_again:
+            self._resort_again = False
+            self._queue_resort()
+        else:
+            self.emit('sort-done')
+
+    def _order_of_sorted(self, items, order):
+        # a reorder of the current rows which moves the rows of `items` still
+        # in the list into their sorted order, within the positions they
+        # hold, and leaves the other rows in place
+        positions = dict((id(row[0]), i) for i, row in enumerate(self.model))
+        ranked = [positions[id(items[i])] for i in order
+                  if id(items[i]) in positions]
+        new_order = list(range(len(positions)))
+        for position, old_position in zip(sorted(ranked), ranked):
+            new_order[position] = old_position
+        return new_order
+
+    def _reorder_model(self, order):
+        # reorder the base model, unless the order is the identity, and let
+        # the position indexes apply the known permutation
+        if all(i == j for i, j in enumerate(order)):
+            return
+        for view in self._model_views():
+            view._position_indexes['base'].expect_reorder(order)
+        self.model.reorder(order)
+
+    def _swap_rows(self, itr1, itr2):
+        positions = [self.model.get_path(itr).get_indices()[0]
+                     for itr in (itr1, itr2)]
+        for view in self._model_views():
+            view._position_indexes['base'].expect_swap(*positions)
+        self.model.swap(itr1, itr2)
+
+    def _bump_model_version(self, *args):
+        self._model_version += 1
+
+    def _queue_resort(self, *args):
+        # keep a `sort_by()` order after rows are added or changed, resorting
+        # once for any number of changes made before the main loop idles
+        if self._sort_spec is not None and self._resort_source is None:
+            self._resort_source = GLib.idle_add(self._on_resort_idle)
+
+    def _on_resort_idle(self):
+        self._resort_source = None
+        self._resort()
+        return False
+
+    def find(self, column, text):
+        """Return the items whose value for a column contains `text`
+
+        The match is case-insensitive, like the interactive search.  Columns
+        created with `search_index=True` are answered from their search index
+        without walking the model; other columns are scanned.
+
+        :param column: A Column of this list, or the attribute of one
+        :param text: The text to search for
+        :returns: The matching items, in list order
+        """
+        if not isinstance(column, Column):
+            columns = self._cols_for_attr(column)
+            if not columns:
+                raise ValueError('no column for attribute %r' % column)
+            column = columns[0]
+        if column.search_index:
+            found = self._get_search_index(column).find(text)
+            return sorted(found, key=self.index_of)
+        text = text.lower()
+        return [item for item in self
+                if text in column._search_text(item).lower()]
+
+    def _get_search_index(self, column):
+        index = self._search_indexes.get(column)
+        if index is None:
+            index = self._search_indexes[column] = \
+                SearchIndex(column._search_text)
+            index.build(self)
+        return index
 
     def search_by(self, attr_or_test):
         if callable(attr_or_test):
@@ -340,14 +1303,29 @@ class ObjectTreeViewBase(Gtk.TreeView):
             self.set_search_equal_func(self._attr_search_func, attr_or_test)
 
     def _iter_for(self, obj):
-        return self._id_to_iter[id(obj)]
+        return self._id_to_iter.iter_for(obj)
+
+    def _lookup(self, item):
+        # the listed item for an item or identity key
+        return self._id_to_iter.lookup(item)
+
+    def _listed_item(self, item, method):
+        listed = self._id_to_iter.lookup(item)
+        if listed is None:
+            raise ValueError('objectlist.%s(item) failed, item not in list'
+                             % method)
+        return listed
 
     def _view_iter_for(self, obj):
         giter = self._iter_for(obj)
+        if self.model_filter is self.model:
+            return giter
         return self.model_filter.convert_child_iter_to_iter(giter)
 
     def _sort_iter_for(self, obj):
         viter = self._view_iter_for(obj)
+        if self.model_sort is self.model_filter:
+            return viter
         return self.model_sort.convert_child_iter_to_iter(None, viter)
 
     def _next_iter_for(self, obj):
@@ -416,6 +1394,11 @@ class ObjectTreeViewBase(Gtk.TreeView):
 
     def _connect_internal(self):
         # connect internal signals
+        self.model.connect('row-inserted', self._on_model_row_inserted)
+        self.model.connect('row-deleted', self._bump_model_version)
+        self.model.connect('rows-reordered', self._bump_model_version)
+        self.model.connect('row-changed', self._queue_resort)
+        self.connect('item-changed', self._on_item_changed_internal)
         self.connect('button-press-event', self._on_button_press_event)
         self.connect('query-tooltip', self._on_query_tooltip)
         self.connect('row-activated', self._on_row_activated)
@@ -423,6 +1406,73 @@ class ObjectTreeViewBase(Gtk.TreeView):
         self.selection_connect = self.selection.connect(
                 'changed', self._on_selection_changed)
 
+    def _on_model_row_inserted(self, model, path, itr):
+        self._model_version += 1
+        if self._search_indexes:
+            item = model.get_value(itr, 0)
+            if item is not None:
+                for index in self._search_indexes.values():
+                    index.add(item)
+        self._queue_resort()
+
+    def _model_views(self):
+        # the views sharing this view's model, including this one
+        return getattr(self._id_to_iter, 'views', None) or (self, )
+
+    def _model_is_shared(self):
+        # whether the base model is shown by other views too, either as the
+        # view created with `shared_model` or as the one owning the model
+        return self._shared_index is not None or len(self._model_views()) > 1
+
+    def _forget_item(self, item):
+        # drop everything cached about an item leaving the list, in every
+        # view of the model
+        for view in self._model_views():
+            view._forget_cached_item(item)
+
+    def _forget_cached_item(self, item):
+        self._sort_engine.forget(item)
+        self._visibility.pop(id(item), None)
+        self._dirty_items.pop(id(item), None)
+        if self._render_cache is not None:
+            self._render_cache.pop(id(item), None)
+        for index in self._search_indexes.values():
+            index.remove(item)
+
+    def _index_item(self, item):
+        # add an item taking over a row to the search indexes of every view
+        for view in self._model_views():
+            for index in view._search_indexes.values():
+                index.add(item)
+
+    def _invalidate_item(self, item):
+        # drop everything cached about an item whose attributes changed, in
+        # every view of the model
+        for view in self._model_views():
+            view._invalidate_cached_item(item)
+
+    def _invalidate_cached_item(self, item):
+        self._sort_engine.forget(item)
+        if self._filter_dirty is not None:
+            self._filter_dirty.add(id(item))
+        self._visibility.pop(id(item), None)
+        if self._render_cache is not None:
+            self._render_cache.pop(id(item), None)
+        for index in self._search_indexes.values():
+            index.update(item)
+
+    def _before_edit(self, item):
+        # called by editable cells before they change an item in place
+        pass
+
+    def _on_item_changed_internal(self, object_list, item, attr, value):
+        # an item was edited in place, so its sort keys, visibility, search
+        # text and native column values are out of date
+        self._invalidate_item(item)
+        if item in self:
+            self._set_row(self._iter_for(item), item)
+        self._queue_resort()
+
     def _emit_for_path(self, path, event):
         item = self._object_at_sort_path(path)
         signal_map = {
@@ -443,6 +1493,10 @@ class ObjectTreeViewBase(Gtk.TreeView):
             self._emit_for_path(path, event)
 
     def _on_selection_changed(self, selection):
+        added, removed = self._sync_selection()
+        if not (added or removed):
+            return
+        self.emit('selection-delta', added, removed)
         self.emit('selection-changed')
         self.connect('query-tooltip', self._on_query_tooltip)
 
@@ -466,19 +1520,28 @@ class ObjectTreeViewBase(Gtk.TreeView):
         # XXX: this one gets dynamically replaced
         return True
 
-    def _internal_visible_func(self, model, itr, visible_func):
-        return visible_func(model[itr][0])
+    def _internal_visible_func(self, model, itr, data=None):
+        item = model.get_value(itr, 0)
+        if item is None:
+            # placeholder rows of unloaded ObjectTree nodes stay visible, so
+            # the node keeps its expander
+            return True
+        item_id = id(item)
+        try:
+            return self._visibility[item_id]
+        except KeyError:
+            visible = bool(self._visible_func(item))
+            self._visibility[item_id] = visible
+            return visible
 
     def _attr_sort_func(self, model, itr1, itr2, attr):
         # how the hell is this a filter model?
-        obj1 = self._object_at_iter(itr1)
-        obj2 = self._object_at_iter(itr2)
-        return cmp(getattr(obj1, attr, None), getattr(obj2, attr, None))
+        return self._compare_keys(attr, self._object_at_iter(itr1),
+                                  self._object_at_iter(itr2))
 
     def _key_sort_func(self, model, itr1, itr2, key):
-        obj1 = self._object_at_iter(itr1)
-        obj2 = self._object_at_iter(itr2)
-        return cmp(key(obj1), key(obj2))
+        return self._compare_keys(key, self._object_at_iter(itr1),
+                                  self._object_at_iter(itr2))
 
     def _attr_search_func(self, model, column, key, itr, attr):
         obj = model[itr][0]
@@ -496,6 +1559,11 @@ class ObjectTreeViewBase(Gtk.TreeView):
 
 class ObjectList(ObjectTreeViewBase):
     """An object list
+
+    :param source: An optional sequence to display through a virtual model
+                   instead of copying items into a `Gtk.ListStore`. Only the
+                   rows GTK asks to render are read from the sequence.
+                   Sorting and filtering are not available in this mode.
     """
 
     __gtype_name__ = "PyGTKHelpersObjectList"
@@ -503,21 +1571,87 @@ class ObjectList(ObjectTreeViewBase):
     gsignal('item-inserted', object, int)
     gsignal('item-removed', object, int)
 
+    _rerank_source = None
+
+    def __init__(self, columns=(), source=None, **kwargs):
+        self.source = source
+        if source is not None:
+            kwargs['sortable'] = False
+        ObjectTreeViewBase.__init__(self, columns, **kwargs)
+
+    def __iter__(self):
+        """Iterable
+        """
+        if self.source is not None:
+            return iter(self.source)
+        return ObjectTreeViewBase.__iter__(self)
+
+    def refresh_source(self):
+        """Resynchronise the view after the source sequence was changed
+        directly rather than through the list API.
+        """
+        if self.source is None:
+            raise ValueError('refresh_source() requires a sequence-backed '
+                             'list')
+        self.set_model(None)
+        self.model.reset()
+        self.set_model(self.model_sort)
+
     def remove(self, item):
         """Remove an item from the list
 
-        :param item: The item to remove from the list.
+        :param item: The item to remove from the list, or its key.
         :raises ValueError: If the item is not present in the list.
         """
-        if item not in self:
-            raise ValueError('objectlist.remove(item) failed, item not in list')
-        item_id = int(self._view_path_for(item))
+        item = self._listed_item(item, 'remove')
+        item_id = self._index_position('filter', item)
+        if item_id is None:
+            # the item is currently filtered out of the view
+            item_id = -1
         giter = self._iter_for(item)
         del self[giter]
         self.emit('item-removed', item, item_id)
 
     def create_model(self):
-        return Gtk.ListStore(object)
+        if self.source is not None:
+            return SequenceModel(self.source)
+        return Gtk.ListStore(*self._model_types())
+
+    def create_iter_index(self):
+        if self.source is not None:
+            return SequenceIterIndex(self.model)
+        index = ObjectTreeViewBase.create_iter_index(self)
+        # the ranks of the rows, shared by the views of the model
+        index.ranking = RankIndex()
+        return index
+
+    def _model_types(self):
+        # plus the rank column header clicks sort by
+        return ObjectTreeViewBase._model_types(self) + (float, )
+
+    @property
+    def _rank_column(self):
+        if self.source is None:
+            return len(self._native_columns) + 1
+
+    @property
+    def _ranking(self):
+        return getattr(self._id_to_iter, 'ranking', None)
+
+    @property
+    def _header_sorts_by_key(self):
+        # clicks on the headers of the view owning the model sort by rank
+        return self.source is None and self._shared_index is None
+
+    def _row_for(self, item):
+        row = ObjectTreeViewBase._row_for(self, item)
+        ranking = self._ranking
+        if ranking is None:
+            return row
+        rank = ranking.add(item)
+        if ranking.stale and not self.in_batch:
+            self._queue_rerank()
+        return row + (rank, )
 
     def insert(self, position, item, select=False):
         """Insert an item at the specified position in the list.
@@ -528,8 +1662,11 @@ class ObjectList(ObjectTreeViewBase):
         """
         if item in self:
             raise ValueError("item %s already in list" % item)
-        modeliter = self.model.insert(position, (item,))
-        self._id_to_iter[id(item)] = modeliter
+        modeliter = self.model.insert(position, self._row_for(item))
+        self._id_to_iter.add(item, modeliter)
+        if self.in_batch:
+            self._add_batch_item(item, select)
+            return
         if select:
             self.selected_item = item
         self.emit('item-inserted', item, position)
@@ -542,28 +1679,544 @@ class ObjectList(ObjectTreeViewBase):
         """
         if item in self:
             raise ValueError("item %s already in list" % item)
-        modeliter = self.model.append((item,))
-        self._id_to_iter[id(item)] = modeliter
+        modeliter = self.model.append(self._row_for(item))
+        self._id_to_iter.add(item, modeliter)
+        if self.in_batch:
+            self._add_batch_item(item, select)
+            return
         if select:
             self.selected_item = item
         self.emit('item-added', item)
 
-    def extend(self, itr):
+    def extend(self, itr, batch=False):
         """Add a sequence of items to the end of the list
 
         :param itr: The iterable of items to add.
+        :param batch: Whether to bulk-load the items, see `batch()`. A single
+                      `items-added` signal is emitted instead of one
+                      `item-added` per item.
+        """
+        if batch and not self.in_batch:
+            with self.batch():
+                self._extend(itr)
+        else:
+            self._extend(itr)
+
+    def set_items(self, new_items, key=None):
+        """Make the list contain `new_items`, changing as few rows as possible
+
+        Current and new items are matched by `key`.  Rows whose key is gone
+        are removed, emitting `item-removed` like `remove()`, new keys are
+        appended, and the rows are then moved into the order of `new_items`
+        with a single reorder.  A matched row holds the new item if it is a
+        different object that does not compare equal to the current one;
+        otherwise the current object is kept.  Either way the row is updated,
+        see `update()`.  Selection and scroll position are preserved, unlike
+        `clear()` followed by `extend()`::
+
+            objectlist.set_items(query(), key=operator.attrgetter('id'))
+
+        :param new_items: The items the list should contain, in order
+        :param key: A callable returning the identity key of an item, or None
+                    to match items by the list's `key` (or by identity)
+        :raises ValueError: If two new items have the same key.
         """
+        if self.in_batch:
+            raise ValueError('set_items() cannot be used during a batch')
+        if self.source is not None:
+            raise NotImplementedError('set_items() is not supported for '
+                                      'sequence-backed lists')
+        if key is None:
+            key = self.key or id
+        new_items = list(new_items)
+        new_keys = [key(item) for item in new_items]
+        wanted = dict(zip(new_keys, new_items))
+        if len(wanted) != len(new_items):
+            raise ValueError('objectlist.set_items() failed, duplicate keys')
+
+        current = list(self)
+        kept = {}
+        removed = []
+        for position, item in enumerate(current):
+            item_key = key(item)
+            if item_key in wanted and item_key not in kept:
+                kept[item_key] = item
+            else:
+                removed.append((position, item))
+        # remove from the end, so the view positions of the rows before
+        # stay valid
+        for position, item in reversed(removed):
+            view_position = self._index_position('filter', item)
+            if view_position is None:
+                # the item is currently filtered out of the view
+                view_position = -1
+            del self[self._iter_for(item)]
+            self.emit('item-removed', item, view_position)
+
+        for item_key, old_item in kept.items():
+            new_item = wanted[item_key]
+            giter = self._iter_for(old_item)
+            if new_item is old_item or new_item == old_item:
+                # the object may have changed in place since it was listed
+                self._invalidate_item(old_item)
+                self._set_row(giter, old_item)
+                continue
+            self._id_to_iter.discard(old_item)
+            self._forget_item(old_item)
+            self._id_to_iter.add(new_item, giter)
+            self._index_item(new_item)
+            self._set_row(giter, new_item)
+
+        model_keys = []
+        for item in current:
+            item_key = key(item)
+            if kept.get(item_key) is item:
+                model_keys.append(item_key)
+        for item_key, item in zip(new_keys, new_items):
+            if item_key not in kept:
+                self.append(item)
+                model_keys.append(item_key)
+
+        positions = dict((item_key, i)
+                         for i, item_key in enumerate(model_keys))
+        order = [positions[item_key] for item_key in new_keys]
+        self._reorder_model(order)
+
+    def stream_from(self, iterable, chunk_size=500, budget_ms=8,
+                    progress_callback=None, complete_callback=None):
+        """Add items from an iterable without blocking the main loop
+
+        The iterable is consumed on a worker thread through a bounded queue,
+        and its items are added in chunks on the main loop, within a time
+        budget per frame.  The first rows are shown as soon as they are read,
+        and memory use does not depend on the length of the iterable::
+
+            task = objectlist.stream_from(cursor, chunk_size=1000)
+            ...
+            task.cancel()
+
+        :param iterable: The items to add, e.g. a database cursor
+        :param chunk_size: The number of items added at once
+        :param budget_ms: The time spent adding items per frame
+        :param progress_callback: Called as `progress_callback(count)`
+                                  after items were added
+        :param complete_callback: Called as `complete_callback(count)` once
+                                  the iterable is exhausted or the stream is
+                                  cancelled
+        :rtype: StreamTask
+        """
+        task = StreamTask(self, iterable, chunk_size=chunk_size,
+                          budget_ms=budget_ms,
+                          progress_callback=progress_callback,
+                          complete_callback=complete_callback)
+        task.start()
+        return task
+
+    def _extend(self, itr):
+        if not self.in_batch:
+            for item in itr:
+                self.append(item)
+            return
+        # bulk path: insert in one pass and index the new iters at once
+        model_append = self.model.append
+        index = self._id_to_iter
         for item in itr:
-            self.append(item)
+            if item in index:
+                raise ValueError("item %s already in list" % item)
+            index.add(item, model_append(self._row_for(item)))
+            self._batch_items.append(item)
+
+    def _view_order_key(self, item):
+        # rows are flat, so their position in the view will do
+        return self._get_position_index('sort').index_of(item)
+
+    def _on_header_clicked(self, view_col, column):
+        # like GTK, sort ascending first and toggle on further clicks
+        if (self._header_sort_column is view_col and
+                view_col.get_sort_order() == Gtk.SortType.ASCENDING):
+            direction = Gtk.SortType.DESCENDING
+        else:
+            direction = Gtk.SortType.ASCENDING
+        # a `sort_by()` order is replaced, as by a native column
+        self._sort_job.cancel()
+        self._sort_spec = None
+        self._view_sort = None
+        self._rank_rows(column._sort_spec, direction)
+        self._show_header_sort(view_col, direction)
+
+    def _rank_rows(self, spec, direction):
+        # rank the rows by precomputed keys and let the sort model sort the
+        # rank column in C, leaving the rows of the model in their order
+        ranks = self._ranking.build([row[0] for row in self.model], spec,
+                                    self._sort_engine.key_for)
+        # no re-sorting for each rank written
+        self.model_sort.set_sort_column_id(
+            Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, direction)
+        self._write_ranks(ranks)
+        self.model_sort.set_sort_column_id(self._rank_column, direction)
+
+    def _write_ranks(self, ranks):
+        model = self.model
+        column = self._rank_column
+        for row, rank in zip(model, ranks):
+            if row[column] != rank:
+                model.set_value(row.iter, column, rank)
+
+    def _end_header_sort(self):
+        ObjectTreeViewBase._end_header_sort(self)
+        # the ranks are this view's, not those of other views of the model
+        if not self._header_sorts_by_key or self._ranking.spec is None:
+            return
+        self._ranking.stop()
+        if self.in_batch:
+            # leave the sort model unsorted when it is rebuilt
+            base_state, sort_state = self._batch_sort_state
+            if sort_state[0] == self._rank_column:
+                self._batch_sort_state = (base_state, (None, None))
+        elif self.model_sort.get_sort_column_id()[0] == self._rank_column:
+            self.model_sort.set_sort_column_id(
+                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+                Gtk.SortType.ASCENDING)
+
+    def _queue_rerank(self):
+        # rank all rows again once the main loop idles, after an item could
+        # not be ranked between its neighbours
+        if self._rerank_source is None:
+            self._rerank_source = GLib.idle_add(self._on_rerank_idle)
+
+    def _on_rerank_idle(self):
+        self._rerank_source = None
+        self._rerank()
+        return False
+
+    def _rerank(self):
+        ranking = self._ranking
+        if ranking.spec is not None and ranking.stale:
+            self._write_ranks(ranking.rebuild([row[0] for row in self.model]))
+
+    def _begin_batch(self):
+        ObjectTreeViewBase._begin_batch(self)
+        if self._ranking is not None:
+            # rank the added rows at once when the batch ends
+            self._ranking.invalidate()
+
+    def _end_batch(self):
+        if self._batch_depth == 1 and self._ranking is not None:
+            # before the sort model is rebuilt
+            self._rerank()
+        ObjectTreeViewBase._end_batch(self)
+
+    def _forget_cached_item(self, item):
+        ObjectTreeViewBase._forget_cached_item(self, item)
+        if self._ranking is not None:
+            self._ranking.remove(item)
+
+    def _clear_caches(self):
+        ObjectTreeViewBase._clear_caches(self)
+        if self._ranking is not None:
+            self._ranking.clear()
+
+
+# pending position shifts kept before a PositionIndex is recomputed, at least
+_MIN_SHIFTS = 64
+
+# rows always measured by `measure_column_widths`, besides the random sample
+_MEASURE_HEAD_ROWS = 100
+
+
+def _header_width(view_col):
+    button = view_col.get_button()
+    if button is None:
+        return 1
+    return button.get_preferred_width()[1]
+
+
+# `update_many` resorts the whole view at once if at least 1 / ratio of the
+# items changed
+_BULK_RESORT_RATIO = 8
+
+
+class PositionIndex(object):
+    """Item <-> position map for the rows of a TreeModel
+
+    The map is built on first use from the model's rows and kept up to date
+    from the model's row-inserted, row-deleted, row-changed and
+    rows-reordered signals.
+
+    For the top-level rows of a model, rows are inserted into and removed
+    from a list of the items in place, and the positions of the later rows
+    are shifted lazily: each insert or removal is recorded, and applied to a
+    position when it is looked up.  The positions are recomputed from the
+    list once more than about `sqrt(n)` shifts are pending.  A reorder
+    announced with `expect_reorder` or `expect_swap` is applied to the list
+    directly; other reorders mark the map stale.
+
+    With `depth_first`, items are numbered in depth-first order over the
+    whole tree.  Appending or removing the last row then updates the map in
+    place, and any other structural change marks it stale, so it is rebuilt
+    on the next lookup.
+
+    :param depth_first: Whether to number the rows of all levels
+    """
+
+    def __init__(self, depth_first=False):
+        self.depth_first = depth_first
+        self.items = None
+        # id(item) -> (position, number of shifts applied to the position)
+        self.positions = None
+        # (position, +1 for an insert or -1 for a removal), in order
+        self._shifts = []
+        self._pending_reorder = None
+
+    @property
+    def stale(self):
+        return self.items is None
+
+    def build(self, items):
+        self.items = list(items)
+        self._build_positions()
+
+    def invalidate(self, *args):
+        self.items = None
+        self.positions = None
+        self._shifts = []
+
+    def index_of(self, item):
+        entry = self.positions.get(id(item))
+        if entry is None:
+            return None
+        position, applied = entry
+        shifts = self._shifts
+        if applied != len(shifts):
+            for shift_position, delta in shifts[applied:]:
+                if position >= shift_position:
+                    position += delta
+            self.positions[id(item)] = (position, len(shifts))
+        return position
+
+    def item_at(self, position):
+        return self.items[position]
+
+    def expect_reorder(self, new_order):
+        """Announce the permutation of the next top-level rows-reordered
+
+        :param new_order: The order passed to `Gtk.ListStore.reorder`, i.e.
+                          ``new_order[new_position] == old_position``
+        """
+        def reorder():
+            items = self.items
+            self.items = [items[i] for i in new_order]
+            self._build_positions()
+        self._pending_reorder = reorder
+
+    def expect_swap(self, position1, position2):
+        """Announce that the next top-level rows-reordered swaps two rows"""
+        def swap():
+            items = self.items
+            items[position1], items[position2] = (items[position2],
+                                                  items[position1])
+            for position in (position1, position2):
+                if items[position] is not None:
+                    self.positions[id(items[position])] = (
+                        position, len(self._shifts))
+        self._pending_reorder = swap
+
+    def connect_model(self, model):
+        model.connect('row-inserted', self._on_row_inserted)
+        model.connect('row-deleted', self._on_row_deleted)
+        model.connect('row-changed', self._on_row_changed)
+        model.connect('rows-reordered', self._on_rows_reordered)
+
+    def _build_positions(self):
+        self._shifts = []
+        self.positions = dict((id(item), (i, 0))
+                              for i, item in enumerate(self.items)
+                              if item is not None)
+
+    def _record_shift(self, position, delta):
+        self._shifts.append((position, delta))
+        if len(self._shifts) > max(_MIN_SHIFTS, int(len(self.items) ** 0.5)):
+            # lookups would get slow, start over
+            self._build_positions()
+
+    def _on_row_inserted(self, model, path, itr):
+        if self.items is None:
+            return
+        indices = path.get_indices()
+        item = model[itr][0]
+        if self.depth_first:
+            if (len(indices) == 1 and indices[0] == len(self.items) and
+                    item is not None):
+                self.positions[id(item)] = (len(self.items), len(self._shifts))
+                self.items.append(item)
+            else:
+                self.invalidate()
+            return
+        if len(indices) != 1:
+            return
+        position = indices[0]
+        self.items.insert(position, item)
+        if position < len(self.items) - 1:
+            self._record_shift(position, 1)
+        if item is not None:
+            # (TreeStore.insert_before/after set the value afterwards, see
+            # `_on_row_changed`)
+            self.positions[id(item)] = (position, len(self._shifts))
+
+    def _on_row_deleted(self, model, path):
+        if self.items is None:
+            return
+        indices = path.get_indices()
+        if self.depth_first:
+            if len(indices) == 1 and indices[0] == len(self.items) - 1:
+                self.positions.pop(id(self.items.pop()), None)
+            else:
+                self.invalidate()
+            return
+        if len(indices) != 1:
+            return
+        position = indices[0]
+        self.positions.pop(id(self.items.pop(position)), None)
+        if position < len(self.items):
+            # the later rows move up
+            self._record_shift(position + 1, -1)
+
+    def _on_row_changed(self, model, path, itr):
+        if self.items is None:
+            return
+        item = model[itr][0]
+        if self.depth_first:
+            if item is not None and id(item) not in self.positions:
+                # the row now holds a different item
+                self.invalidate()
+            return
+        indices = path.get_indices()
+        if len(indices) != 1:
+            return
+        position = indices[0]
+        old_item = self.items[position]
+        if old_item is not item:
+            # the row now holds a different item
+            self.positions.pop(id(old_item), None)
+            self.items[position] = item
+            if item is not None:
+                self.positions[id(item)] = (position, len(self._shifts))
+
+    def _on_rows_reordered(self, model, path, itr, *args):
+        pending, self._pending_reorder = self._pending_reorder, None
+        if self.items is None:
+            return
+        if self.depth_first:
+            self.invalidate()
+        elif itr is None:
+            if pending is None:
+                # the new order cannot be read from Python
+                self.invalidate()
+            else:
+                pending()
 
 
 class SubObjectTree(object):
-    def __init__(self, items, item_paths):
+    """A subtree of items and their tree paths, e.g. for a clipboard
+
+    Copies are copy-on-write: `copy()` only copies references, and each item
+    is cloned the first time it is about to change, either in the copy
+    through `writable_item`, or in the tree through
+    `ObjectTree.detach_copies`, or when the subtree is pasted with
+    `ObjectTree.insert_subtree`.  Paths are never modified, so copies share
+    them.
+
+    :param items: The items, in depth first order
+    :param item_paths: The tree path of each item, as tuples
+    :param clone: A callable returning a copy of an item, `copy.deepcopy` by
+                  default
+    """
+
+    def __init__(self, items, item_paths, clone=None):
         self.items = items
         self.item_paths = item_paths
+        self.clone = clone
+        # for copies, 1 for each item still shared with the original
+        self._shared = None
+        # id(item) -> index of the shared items, built by `detach`
+        self._shared_index = None
+
+    def copy(self, clone=None):
+        """Return a copy-on-write copy of this subtree
+
+        :param clone: The clone hook of the copy, defaults to this subtree's
+        """
+        subtree = SubObjectTree(list(self.items), self.item_paths,
+                                clone or self.clone)
+        subtree._share_all()
+        return subtree
+
+    def _share_all(self):
+        self._shared = bytearray(b'\x01') * len(self.items)
+        self._shared_index = None
+
+    def is_shared(self, index):
+        """Whether the item at `index` is still shared with the original"""
+        return self._shared is not None and bool(self._shared[index])
+
+    def writable_item(self, index):
+        """Return the item at `index`, cloning it first if it is shared
+
+        Use this rather than `items[index]` to change an item of a copy.
+        """
+        if self.is_shared(index):
+            self._unshare(index)
+        return self.items[index]
+
+    def detach(self, item):
+        """Clone `item` if it is shared, before the original is changed
+
+        :param item: An item of the original, about to change in place
+        :returns: Whether the item was shared
+        """
+        if self._shared is None:
+            return False
+        if self._shared_index is None:
+            self._shared_index = dict(
+                (id(shared), index) for index, shared in enumerate(self.items)
+                if self._shared[index])
+        index = self._shared_index.get(id(item))
+        if index is None or self.items[index] is not item:
+            return False
+        self._unshare(index)
+        return True
+
+    def _unshare(self, index):
+        item = self.items[index]
+        self.items[index] = self._clone(item)
+        self._shared[index] = 0
+        if self._shared_index is not None:
+            self._shared_index.pop(id(item), None)
 
-    def copy(self):
-        return copy.deepcopy(self)
+    def paste_items(self, clone=None):
+        """Return the items to insert into a tree when pasting
+
+        Shared items are cloned, while items this subtree owns are returned
+        as they are, and are treated as shared from then on, so pasting the
+        same subtree again inserts fresh clones.
+
+        :param clone: A clone hook applied to every item, overriding the
+                      subtree's
+        """
+        if clone is not None:
+            return [clone(item) for item in self.items]
+        if self._shared is None:
+            items = list(self.items)
+        else:
+            items = [self._clone(item) if shared else item
+                     for item, shared in zip(self.items, self._shared)]
+        self._share_all()
+        return items
+
+    def _clone(self, item):
+        if self.clone is None:
+            return copy.deepcopy(item)
+        return self.clone(item)
 
     def __iter__(self):
         if self.item_paths:
@@ -572,7 +2225,7 @@ class SubObjectTree(object):
                 yield self.items[i], item_path
 
     def __str__(self):
-        return str(zip(self.items, self.item_paths))
+        return str(list(zip(self.items, self.item_paths)))
 
 
 class Node(object):
@@ -616,6 +2269,24 @@ def get_node_tree(subtree):
 
 class ObjectTree(ObjectTreeViewBase):
     """An object tree
+
+    :param children_loader: An optional callable returning the children of an
+                            item.  Items then get their children on demand:
+                            a placeholder child row is added so the item can
+                            be expanded, and the loader is called the first
+                            time the item is expanded.
+    :param has_children: An optional callable returning whether an item may
+                         have children, used with `children_loader`.  By
+                         default every item may have children, and the
+                         expander disappears if the loader returns none.
+    :param threaded_loading: Whether to call `children_loader` on a worker
+                             thread, adding the children on the main loop
+                             once it returns.
+    :param loaded_cache_size: The number of collapsed nodes whose loaded
+                              children are kept.  Beyond that, the children
+                              of the least recently collapsed nodes are
+                              dropped and loaded again on the next expand.
+                              None (the default) keeps all of them.
     """
 
     __gtype_name__ = "PyGTKHelpersObjectTree"
@@ -625,13 +2296,39 @@ class ObjectTree(ObjectTreeViewBase):
     gsignal('item-inserted', object, object)
     gsignal('item-removed', object, object)
 
+    def __init__(self, columns=(), children_loader=None, has_children=None,
+                 threaded_loading=False, loaded_cache_size=None, **kwargs):
+        if kwargs.get('shared_model') is not None:
+            raise NotImplementedError('shared models are only supported by '
+                                      'ObjectList')
+        self.children_loader = children_loader
+        self.has_children = has_children
+        self.threaded_loading = threaded_loading
+        self.loaded_cache_size = loaded_cache_size
+        # id(item) -> item for nodes whose children are not loaded yet
+        self._unloaded = {}
+        # id(item) -> item for nodes loading on a worker thread
+        self._loading = {}
+        # id(item) -> item for nodes whose children came from the loader
+        self._loaded = {}
+        # the collapsed ones among those, least recently collapsed first
+        self._collapsed_loaded = collections.OrderedDict()
+        # parent, children, depth and preorder number of each item
+        self._tree_index = TreeIndex()
+        # the subtrees sharing items with this tree, see `detach_copies`
+        self._copies = weakref.WeakSet()
+        ObjectTreeViewBase.__init__(self, columns, **kwargs)
+
     def _connect_internal(self):
         ObjectTreeViewBase._connect_internal(self)
+        if self.children_loader is not None:
+            self.selection.set_select_function(self._select_function, None)
+        self.model.connect('rows-reordered', self._on_model_rows_reordered)
         self.connect('row-expanded', self._on_row_expanded)
         self.connect('row-collapsed', self._on_row_collapsed)
 
     def create_model(self):
-        return Gtk.TreeStore(object)
+        return Gtk.TreeStore(*self._model_types())
 
     def append(self, item, parent=None, select=False):
         """Add an item to the end of the list.
@@ -647,18 +2344,30 @@ class ObjectTree(ObjectTreeViewBase):
             giter = self._iter_for(parent)
         else:
             giter = None
-        modeliter = self.model.append(giter, (item,))
-        self._id_to_iter[id(item)] = modeliter
-        if select:
+        modeliter = self.model.append(giter, self._row_for(item))
+        self._id_to_iter.add(item, modeliter)
+        self._add_to_index(item, parent)
+        self._child_added(item, modeliter, parent)
+        if self.in_batch:
+            self._add_batch_item(item, select)
+        elif select:
             self.selected_item = item
 
-    def extend(self, itr, parent=None):
+    def extend(self, itr, parent=None, batch=False):
         """Add a sequence of items to the end of the list
 
         :param itr: The iterable of items to add.
         :param parent: The node to add the items as a child of, or None for
                        top-level nodes.
+        :param batch: Whether to bulk-load the items, see `batch()`.
         """
+        if batch and not self.in_batch:
+            with self.batch():
+                self._extend(itr, parent)
+        else:
+            self._extend(itr, parent)
+
+    def _extend(self, itr, parent):
         for item in itr:
             self.append(item, parent)
 
@@ -669,7 +2378,16 @@ class ObjectTree(ObjectTreeViewBase):
         :param open_all: Whether all child nodes should be recursively
                          expanded.
         """
-        self.expand_row(self._view_path_for(item), open_all)
+        if open_all and self.children_loader is not None:
+            # expand the loaded descendants only, rather than loading the
+            # whole hierarchy
+            self.expand_row(self._view_path_for(item), False)
+            for child in self._child_items(item):
+                if id(child) not in self._unloaded and self.item_has_child(
+                        child):
+                    self.expand_item(child, open_all)
+        else:
+            self.expand_row(self._view_path_for(item), open_all)
 
     def collapse_item(self, item):
         """Display a node as collapsed
@@ -687,16 +2405,157 @@ class ObjectTree(ObjectTreeViewBase):
 
     def _on_row_expanded(self, object_tree, giter, path):
         item = self._object_at_sort_iter(giter)
+        self._collapsed_loaded.pop(id(item), None)
+        if id(item) in self._unloaded:
+            self._load_children(item)
         if item in self.selected_items:
             # Since this item was selected before expanding, select all
             # children.
-            self.selection.handler_block(self.selection_connect)
-            self.selected_items += self._get_children(item)
-            self.selection.handler_unblock(self.selection_connect)
+            with self._bulk_selection():
+                self.selected_items += self._get_children(item)
         return self.emit('item-expanded', self._object_at_sort_iter(giter))
 
     def _on_row_collapsed(self, object_tree, giter, path):
-        return self.emit('item-collapsed', self._object_at_sort_iter(giter))
+        item = self._object_at_sort_iter(giter)
+        if self.loaded_cache_size is not None and id(item) in self._loaded:
+            self._collapsed_loaded[id(item)] = item
+            while len(self._collapsed_loaded) > self.loaded_cache_size:
+                item_id, old = self._collapsed_loaded.popitem(last=False)
+                self._unload_children(old)
+        return self.emit('item-collapsed', item)
+
+    def _add_to_index(self, item, parent, position=None):
+        if self._get_sort_state(self.model)[0] is None:
+            self._tree_index.add(item, parent, position)
+        else:
+            # the model placed the row by its sort order
+            self._tree_index.add(item, parent)
+            self._tree_index.set_children(parent, self._model_children(parent))
+
+    def _model_children(self, parent):
+        # the items of the child rows of `parent`, in model order
+        model = self.model
+        if parent is None:
+            giter = model.get_iter_first()
+        else:
+            giter = model.iter_children(self._iter_for(parent))
+        children = []
+        while giter is not None:
+            child = model.get_value(giter, 0)
+            if child is not None:
+                children.append(child)
+            giter = model.iter_next(giter)
+        return children
+
+    def _on_model_rows_reordered(self, model, path, giter, new_order):
+        # new_order can not be read from Python, so re-read the children
+        if giter is None:
+            parent = None
+        else:
+            parent = model.get_value(giter, 0)
+        if parent is None or parent in self._tree_index:
+            self._tree_index.set_children(parent,
+                                          self._model_children(parent))
+
+    def _child_added(self, item, giter, parent):
+        # called for every item added to the tree
+        if (self.children_loader is not None and
+                (self.has_children is None or self.has_children(item))):
+            self._unloaded[id(item)] = item
+            self.model.append(giter)
+        if parent is not None and id(parent) in self._unloaded:
+            # children added explicitly (or by the loader) replace the
+            # placeholder
+            self._remove_placeholder(parent)
+
+    def _select_function(self, selection, model, path, selected, data):
+        # placeholder rows cannot be selected (but can be unselected)
+        return selected or model[path][0] is not None
+
+    def _remove_placeholder(self, item):
+        del self._unloaded[id(item)]
+        model = self.model
+        giter = model.iter_children(self._iter_for(item))
+        while giter is not None:
+            if model.get_value(giter, 0) is None:
+                model.remove(giter)
+                return
+            giter = model.iter_next(giter)
+
+    def _child_items(self, item):
+        # the direct children of an item, without loading them
+        return list(self._tree_index.children_of(item))
+
+    def _load_children(self, item):
+        if id(item) in self._loading:
+            return
+        if not self.threaded_loading:
+            self._add_loaded_children(item, self.children_loader(item))
+            return
+        self._loading[id(item)] = item
+        thread = threading.Thread(target=self._load_children_thread,
+                                  args=(item, ))
+        thread.daemon = True
+        thread.start()
+
+    def _load_children_thread(self, item):
+        try:
+            children = list(self.children_loader(item))
+        except Exception:
+            # leave the node unloaded, so the next expand tries again
+            children = None
+        GLib.idle_add(self._on_children_loaded, item, children)
+
+    def _on_children_loaded(self, item, children):
+        if self._loading.pop(id(item), None) is not item:
+            # removed from the tree while loading
+            return False
+        if children is None:
+            self.collapse_row(self._view_path_for(item))
+        elif id(item) in self._unloaded:
+            self._add_loaded_children(item, children)
+        return False
+
+    def _add_loaded_children(self, item, children):
+        for child in children:
+            self.append(child, item)
+        if id(item) in self._unloaded:
+            # no children after all
+            self._remove_placeholder(item)
+        self._loaded[id(item)] = item
+
+    def _unload_children(self, item):
+        # drop the loaded children of a collapsed node, restoring its
+        # placeholder
+        for child in self._tree_index.remove_descendants(item):
+            self._id_to_iter.discard(child)
+            self._forget_item(child)
+        del self._loaded[id(item)]
+        model = self.model
+        giter = self._iter_for(item)
+        model.append(giter)
+        self._unloaded[id(item)] = item
+        child_iter = model.iter_children(giter)
+        while model.get_value(child_iter, 0) is not None:
+            model.remove(child_iter)
+
+    def clear(self):
+        """Clear all the items in the tree
+        """
+        ObjectTreeViewBase.clear(self)
+        self._tree_index.clear()
+        self._unloaded.clear()
+        self._loading.clear()
+        self._loaded.clear()
+        self._collapsed_loaded.clear()
+
+    def _forget_item(self, item):
+        ObjectTreeViewBase._forget_item(self, item)
+        item_id = id(item)
+        self._unloaded.pop(item_id, None)
+        self._loading.pop(item_id, None)
+        self._loaded.pop(item_id, None)
+        self._collapsed_loaded.pop(item_id, None)
 
     def item_iter(self, item):
         return self.model[self._path_for(item)].iter
@@ -708,48 +2567,63 @@ class ObjectTree(ObjectTreeViewBase):
         if item not in self:
             raise ValueError('objectlist.item_has_child(item) failed, item not'
                              ' in list')
+        if id(item) in self._unloaded:
+            return True
         return self.model_sort.iter_has_child(self.item_view_iter(item))
 
     def _iter_siblings(self, item):
-        giter = self.item_view_iter(item)
-        while giter:
-            item = self[self.model_sort.get_path(giter)]
-            for c in self._iter_children(item):
+        index = self._tree_index
+        siblings = index.children_of(index.parent_of(item))
+        for sibling in siblings[index.position_of(item):]:
+            for c in index.iter_subtree(sibling):
                 yield c
-            giter = self.model_sort.iter_next(giter)
 
     def _iter_children(self, item):
-        yield item
-        if self.item_has_child(item):
-            row = self.model[self._path_for(item)]
-            for i in row.iterchildren():
-                for c in self._get_children(i[0]):
-                    yield c
+        return self._tree_index.iter_subtree(item)
 
     def _get_children(self, item):
-        return [c for c in self._iter_children(item)]
+        return list(self._tree_index.iter_subtree(item))
 
     def _get_selected_items(self):
         selected_items = super(ObjectTree, self)._get_selected_items()
         all_items = []
+        seen = set()
         for item in selected_items:
+            if id(item) in seen:
+                # already added as a descendant of a collapsed item
+                continue
             if self.item_expanded(item):
                 all_items.append(item)
+                seen.add(id(item))
             else:
-                all_items += self._get_children(item)
+                children = self._get_children(item)
+                all_items += children
+                seen.update(id(c) for c in children)
         return all_items
 
     def insert_before(self, sibling, item, select=False):
-        self._insert_sibling(self.model.insert_before, sibling, item, select)
+        self._insert_sibling(sibling, item, 0, select)
 
     def insert_after(self, sibling, item, select=False):
-        self._insert_sibling(self.model.insert_after, sibling, item, select)
+        self._insert_sibling(sibling, item, 1, select)
 
-    def _insert_sibling(self, insert_func, sibling, item, select=False):
+    def _insert_sibling(self, sibling, item, offset, select=False):
         if item in self:
             raise ValueError("item %s already in list" % item)
-        modeliter = insert_func(None, self._iter_for(sibling), (item, ))
-        self._id_to_iter[id(item)] = modeliter
+        sibling_iter = self._iter_for(sibling)
+        parent = self._tree_index.parent_of(sibling)
+        position = self._tree_index.position_of(sibling) + offset
+        # insert the row with its values, so row-inserted handlers (e.g. the
+        # search indexes) see the item, which TreeStore.insert_before/after
+        # only set afterwards
+        modeliter = self.model.insert(self.model.iter_parent(sibling_iter),
+                                      position, self._row_for(item))
+        self._id_to_iter.add(item, modeliter)
+        self._add_to_index(item, parent, position)
+        self._child_added(item, modeliter, parent)
+        if self.in_batch:
+            self._add_batch_item(item, select)
+            return
         item_path = self._view_path_for(item)
         if select:
             self.selected_item = item
@@ -764,30 +2638,58 @@ class ObjectTree(ObjectTreeViewBase):
         """
         if item in self:
             raise ValueError("item %s already in list" % item)
-        modeliter = self.model.insert(parent, position, (item,))
-        self._id_to_iter[id(item)] = modeliter
+        modeliter = self.model.insert(parent, position,
+                                      self._row_for(item))
+        self._id_to_iter.add(item, modeliter)
+        if parent is not None:
+            parent_item = self.model.get_value(parent, 0)
+        else:
+            parent_item = None
+        if position < 0:
+            position = None
+        self._add_to_index(item, parent_item, position)
+        self._child_added(item, modeliter, parent_item)
+        if self.in_batch:
+            self._add_batch_item(item, select)
+            return modeliter
         if select:
             self.selected_item = item
         item_path = self._view_path_for(item)
         self.emit('item-inserted', item, item_path)
         return modeliter
 
-    def insert_subtree(self, parent_iter, position, subtree):
-        # Disable selection-changed handler for insert
-        self.selection.handler_block(self.selection_connect)
-        node_tree = get_node_tree(subtree)
-        self._insert_subtree(parent_iter, node_tree.root, position=position)
-        new_subtree = self.get_subtree(subtree.items)
-        self.selection.handler_unblock(self.selection_connect)
+    def insert_subtree(self, parent_iter, position, subtree, clone=None):
+        """Insert a subtree, e.g. from `copy_subtree`
+
+        Items the subtree shares with another tree are cloned, see
+        `SubObjectTree.paste_items`.
+
+        :param clone: A callable returning a copy of an item, to insert
+                      copies of all the subtree's items
+        :returns: The inserted subtree
+        """
+        items = subtree.paste_items(clone)
+        # the inserted items may be shared with the subtree from now on
+        self._copies.add(subtree)
+        # notify selection changes once, after the insert
+        with self._bulk_selection():
+            node_tree = get_node_tree(SubObjectTree(items,
+                                                    subtree.item_paths))
+            self._insert_subtree(parent_iter, node_tree.root,
+                                 position=position)
+            new_subtree = self.get_subtree(items)
         return new_subtree
 
-    def insert_subtree_before(self, subtree, item=None):
-        return self._insert_subtree_relative(subtree, item, before=True)
+    def insert_subtree_before(self, subtree, item=None, clone=None):
+        return self._insert_subtree_relative(subtree, item, before=True,
+                                             clone=clone)
 
-    def insert_subtree_after(self, subtree, item=None):
-        return self._insert_subtree_relative(subtree, item, before=False)
+    def insert_subtree_after(self, subtree, item=None, clone=None):
+        return self._insert_subtree_relative(subtree, item, before=False,
+                                             clone=clone)
 
-    def _insert_subtree_relative(self, subtree, item=None, before=False):
+    def _insert_subtree_relative(self, subtree, item=None, before=False,
+                                 clone=None):
         if item is None:
             node_tree = get_node_tree(self.get_selected_subtree(relative=True))
             item = node_tree.root.children[-1].item
@@ -800,7 +2702,7 @@ class ObjectTree(ObjectTreeViewBase):
         position = insert_path[-1]
         if not before:
             position += 1
-        return self.insert_subtree(parent_iter, position, subtree)
+        return self.insert_subtree(parent_iter, position, subtree, clone)
 
     def _insert_subtree(self, parent_iter, parent_node, position=None):
         if position is None:
@@ -813,44 +2715,80 @@ class ObjectTree(ObjectTreeViewBase):
     def remove(self, item):
         """Remove an item from the list
 
-        :param item: The item to remove from the list.
+        :param item: The item to remove from the list, or its key.
         :raises ValueError: If the item is not present in the list.
         """
-        if item not in self:
-            raise ValueError('objectlist.remove(item) failed, item not in list')
+        item = self._listed_item(item, 'remove')
         item_path = self._view_path_for(item)
         giter = self._iter_for(item)
+        # the model drops the descendant rows along with the item
+        for child in self._tree_index.remove(item):
+            self._id_to_iter.discard(child)
+            self._forget_item(child)
         del self[giter]
         self.emit('item-removed', item, item_path)
 
     def is_subtree(self, items):
         if not items:
             return True
-        siblings_iter = self._iter_siblings(items[0])
-        contiguous_check = (items == [i for i in
-                                      itertools.islice(siblings_iter,
-                                                       len(items))])
-        try:
-            next_item = siblings_iter.next()
-            if len(self._path_for(next_item)) <= len(self._path_for(items[0])):
-                complete_check = True
-            else:
-                complete_check = False
-        except StopIteration:
-            complete_check = True
-        return contiguous_check and complete_check
+        index = self._tree_index
+        start = index.preorder_of(items[0])
+        depth = index.depth_of(items[0])
+        for offset, item in enumerate(items):
+            # contiguous in depth first order, below the level of the first
+            if (item not in index or
+                    index.preorder_of(item) != start + offset or
+                    index.depth_of(item) < depth):
+                return False
+        # complete: the next item is not a descendant of the last one
+        last = items[-1]
+        if index.children_of(last):
+            return False
+        # walk up to the next item in depth first order
+        item = last
+        while item is not None and index.depth_of(item) >= depth:
+            parent = index.parent_of(item)
+            siblings = index.children_of(parent)
+            position = index.position_of(item)
+            if position + 1 < len(siblings):
+                return index.depth_of(siblings[position + 1]) <= depth
+            item = parent
+        return True
 
     def get_selected_subtree(self, relative=False):
         return self.get_subtree(self.selected_items, relative=relative)
 
-    def copy_selected_subtree(self):
-        return self.copy_subtree(self.selected_items)
+    def copy_selected_subtree(self, clone=None):
+        return self.copy_subtree(self.selected_items, clone)
+
+    def copy_subtree(self, items, clone=None):
+        """Return a copy of a subtree, see `SubObjectTree`
 
-    def copy_subtree(self, items):
+        :param clone: A callable returning a copy of an item, used when the
+                      copy or the tree changes an item, or when the copy is
+                      pasted
+        """
         subtree = self.get_subtree(items, relative=True)
         if subtree is None:
             return None
-        return subtree.copy()
+        subtree = subtree.copy(clone)
+        self._copies.add(subtree)
+        return subtree
+
+    def detach_copies(self, item):
+        """Clone an item in the copied subtrees still sharing it
+
+        Call this before changing an item of the tree in place, so that
+        copies made with `copy_subtree` keep its current state.  Editable
+        cells do so before they change an item.
+
+        :param item: The item about to change
+        """
+        for subtree in list(self._copies):
+            subtree.detach(item)
+
+    def _before_edit(self, item):
+        self.detach_copies(item)
 
     def get_subtree(self, items, relative=False):
         if not items:
@@ -861,7 +2799,7 @@ class ObjectTree(ObjectTreeViewBase):
                              'sub-tree.')
 
         items = items[:]
-        item_paths = [self.model.get_path(self._iter_for(i)) for i in items]
+        item_paths = [self._tree_index.path_of(i) for i in items]
 
         if relative:
             # Normalize item paths to root path (0, )
@@ -877,20 +2815,23 @@ class ObjectTree(ObjectTreeViewBase):
         return SubObjectTree(items, item_paths)
 
     def remove_items(self, items):
-        # Get items sorted by model path
-        sorted_items = zip(*sorted([(self.model.get_path(self.item_iter(i)), i)
-                                    for i in items]))[1]
+        # Get items sorted by model path, i.e. in depth first order
+        sorted_items = sorted(items, key=self._tree_index.preorder_of)
 
         # Delete items in reverse order to ensure all children are
         # removed before removing the corresponding parent.
         for item in sorted_items[::-1]:
             self.remove(item)
 
-    def cut_selected_subtree(self):
-        return self.cut_subtree(self.selected_items)
+    def cut_selected_subtree(self, clone=None):
+        return self.cut_subtree(self.selected_items, clone)
 
-    def cut_subtree(self, items):
-        subtree = self.copy_subtree(items)
+    def cut_subtree(self, items, clone=None):
+        # the items leave the tree, so the subtree can own them uncopied
+        subtree = self.get_subtree(items, relative=True)
+        if subtree is None:
+            return None
+        subtree.clone = clone
         self.remove_items(items)
         return subtree
 
@@ -1,9 +1,16 @@
+import threading
+import time
 import unittest
+from collections import namedtuple
+from operator import attrgetter, itemgetter
+from unittest import mock
+
 import gi
 
 gi.require_version('Gtk', '3.0')
 
 from gi.repository import Gtk
+from pyGtkHelpers.ui.objectlist import ObjectList, Column
 from pyGtkHelpers.utils import refresh_gui
 from .conftest import (
     User,
@@ -53,6 +60,55 @@ class TestApi(unittest.TestCase):
             ])
         self.assertEqual(len(items), 2)
 
+    def test_extend_batch(self):
+        items_added = CheckCalled(items, 'items-added')
+        item_added = CheckCalled(items, 'item-added')
+        items.extend([user, user2, user3], batch=True)
+        self.assertEqual(len(items), 3)
+        self.assertIn(user3, items)
+        self.assertEqual(items_added.called_count, 1)
+        self.assertEqual(items_added.called[1], [user, user2, user3])
+        self.assertEqual(item_added.called_count, 0)
+
+    def test_batch_context(self):
+        items_added = CheckCalled(items, 'items-added')
+        with items.batch():
+            items.append(user)
+            items.append(user2)
+            self.assertIsNone(items.get_model())
+        self.assertIs(items.get_model(), items.model_sort)
+        self.assertEqual([i[0] for i in items.model_sort], [user, user2])
+        self.assertEqual(items_added.called[1], [user, user2])
+
+    def test_batch_calls(self):
+        items.extend([user, user2])
+        items.selected_item = user
+        selection_changed = CheckCalled(items, 'selection-changed')
+        with items.batch():
+            items.append(user3)
+            # the view has no model, the selection is kept meanwhile
+            self.assertIsNone(items.get_model())
+            self.assertIs(items.selected_item, user)
+            self.assertEqual(items.index_of(user3), 2)
+            self.assertEqual(items.view_index_of(user2), 1)
+            items.update(user2)
+            items.set_visible_func(lambda item: item is not user2)
+        self.assertIs(items.get_model(), items.model_sort)
+        self.assertIs(items.selected_item, user)
+        self.assertEqual(selection_changed.called_count, 0)
+        self.assertEqual([row[0] for row in items.model_sort], [user, user3])
+        self.assertEqual(items.view_index_of(user3), 1)
+
+    def test_batch_select(self):
+        items.extend([user, user2])
+        items.selected_item = user
+        selection_changed = CheckCalled(items, 'selection-changed')
+        with items.batch():
+            items.append(user3, select=True)
+            self.assertIs(items.selected_item, user3)
+        self.assertIs(items.selected_item, user3)
+        self.assertEqual(selection_changed.called_count, 1)
+
     def test_remove(self):
         items.append(user)
         self.assertIn(user, items)
@@ -93,6 +149,26 @@ class TestApi(unittest.TestCase):
         items.selected_item = user
         self.assertTrue(selection_changed.called)
 
+    def test_selection_delta(self):
+        items.extend([user, user2, user3])
+        items.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+        delta = CheckCalled(items, 'selection-delta')
+        changed = CheckCalled(items, 'selection-changed')
+        items.select_items([user, user3])
+        self.assertEqual(delta.called_count, 1)
+        self.assertEqual(changed.called_count, 1)
+        self.assertEqual(delta.called[1:], ([user, user3], []))
+        self.assertTrue(items.is_selected(user3))
+        self.assertFalse(items.is_selected(user2))
+        items.unselect_items([user])
+        self.assertEqual(delta.called[1:], ([], [user]))
+        self.assertFalse(items.is_selected(user))
+        items.select_range(0, 2)
+        self.assertEqual(delta.called_count, 3)
+        self.assertEqual(delta.called[1:], ([user, user2], []))
+        self.assertEqual(items.selected_items, [user, user2, user3])
+        self.assertEqual(items.selected_ids, (0, 1, 2))
+
     def test_move_item_up(self):
         items.append(user)
         items.append(user2)
@@ -168,6 +244,84 @@ class TestApi(unittest.TestCase):
         self.assertTrue(items.item_visible(user))
         self.assertFalse(items.item_visible(user3))
 
+    def test_index_of(self):
+        items.extend([user, user2])
+        self.assertEqual(items.index_of(user2), 1)
+        items.append(user3)
+        self.assertEqual(items.index_of(user3), 2)
+        items.remove(user)
+        self.assertEqual(items.index_of(user3), 1)
+        self.assertRaises(ValueError, items.index_of, user)
+
+    def test_index_of_incremental(self):
+        user4 = User(name='Mother', age=40)
+        items.extend([user, user2, user3])
+        index = items._get_position_index('base')
+        items.insert(0, user4)
+        items.remove(user2)
+        items.move_item_up(user3)
+        self.assertFalse(index.stale)
+        self.assertEqual(
+            [items.index_of(item) for item in (user4, user3, user)],
+            [0, 1, 2])
+
+    def test_item_at_view_position(self):
+        items.extend([user, user2, user3])
+        items.sort_by('name')
+        self.assertIs(items.item_at(0), user2)
+        self.assertEqual(items.view_index_of(user3), 2)
+        items.set_visible_func(lambda obj: obj.age < 100)
+        self.assertIsNone(items.view_index_of(user3))
+
+    def test_visible_func_cached(self):
+        items.extend([user, user2, user3])
+        calls = []
+
+        def is_young(obj):
+            calls.append(obj)
+            return obj.age < 100
+        items.set_visible_func(is_young)
+        refresh_gui()
+        del calls[:]
+        self.assertFalse(items.item_visible(user3))
+        self.assertEqual(calls, [])
+        items.update(user2)
+        self.assertEqual(calls, [user2])
+
+    def test_visible_func_narrowing(self):
+        items.extend([user, user2, user3])
+        items.set_visible_func(lambda obj: obj.age < 100)
+        calls = []
+
+        def is_younger(obj):
+            calls.append(obj)
+            return obj.age < 11
+        items.set_visible_func(is_younger, narrowing=True)
+        self.assertNotIn(user3, calls)
+        self.assertTrue(items.item_visible(user))
+        self.assertFalse(items.item_visible(user2))
+
+    def test_update_deferred(self):
+        items.extend([user, user2])
+        changed = []
+        items.model.connect('row-changed',
+                            lambda model, path, itr: changed.append(path))
+        for i in range(10):
+            items.update(user, deferred=True)
+            items.update(user2, deferred=True)
+        self.assertEqual(changed, [])
+        refresh_gui()
+        self.assertEqual(len(changed), 2)
+
+    def test_flush_updates(self):
+        items.append(user)
+        items.update(user, deferred=True)
+        row_changed = CheckCalled(items.model, 'row-changed')
+        items.flush_updates()
+        self.assertEqual(row_changed.called_count, 1)
+        items.flush_updates()
+        self.assertEqual(row_changed.called_count, 1)
+
     def test_item_after(self):
         items.extend([user, user2, user3])
         self.assertIs(items.item_after(user), user2)
@@ -180,6 +334,213 @@ class TestApi(unittest.TestCase):
         self.assertIs(items.item_before(user3), user2)
         self.assertIsNone(items.item_before(user))
 
+    def test_set_items(self):
+        items.extend([user, user2, user3])
+        items.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+        items.selected_items = [user2]
+        removed = CheckCalled(items, 'item-removed')
+        hans = User(name='Hans', age=10)
+        mother = User(name='Mother', age=40)
+        items.set_items([user3, mother, user2, hans], key=attrgetter('name'))
+        self.assertEqual(list(items), [user3, mother, user2, user])
+        # equal items keep the existing object
+        self.assertIs(items[3], user)
+        self.assertEqual(removed.called_count, 0)
+        self.assertEqual(items.selected_items, [user2])
+        items.set_items([mother], key=attrgetter('name'))
+        self.assertEqual(list(items), [mother])
+        self.assertEqual(removed.called_count, 3)
+        self.assertRaises(ValueError, items.set_items, [user, user])
+
+    def test_set_items_removed_view_position(self):
+        items.extend([user, user2, user3])
+        items.set_visible_func(lambda item: item.age > 10)
+        removed = CheckCalled(items, 'item-removed')
+        # like remove(), the position is the one in the filtered view
+        items.set_items([user, user2])
+        self.assertEqual(removed.called, (items, user3, 1))
+        items.set_items([user2])
+        self.assertEqual(removed.called, (items, user, -1))
+
+    def test_stream_from(self):
+        source = [User(name='user%d' % i, age=i) for i in range(50)]
+        done = []
+        task = items.stream_from(iter(source), chunk_size=7,
+                                 complete_callback=done.append)
+        deadline = time.time() + 5
+        while not task.done and time.time() < deadline:
+            refresh_gui(delay=0.02)
+        self.assertEqual(done, [50])
+        self.assertEqual(list(items), source)
+
+    def test_stream_keeps_selection(self):
+        items.extend([user, user2])
+        items.selected_item = user2
+        added = CheckCalled(items, 'items-added')
+        source = [User(name='user%d' % i, age=i) for i in range(20)]
+        task = items.stream_from(iter(source), chunk_size=7)
+        deadline = time.time() + 5
+        while not task.done and time.time() < deadline:
+            refresh_gui(delay=0.02)
+        # chunks are appended to the attached model, not bulk-loaded
+        self.assertFalse(added.called)
+        self.assertIs(items.selected_item, user2)
+        self.assertEqual(len(items), 22)
+
+    def test_stream_error(self):
+
+        def failing():
+            yield User(name='first', age=1)
+            raise IOError('connection lost')
+        with mock.patch('sys.excepthook') as excepthook:
+            task = items.stream_from(failing())
+            deadline = time.time() + 5
+            while not task.done and time.time() < deadline:
+                refresh_gui(delay=0.02)
+        self.assertIsInstance(task.error, IOError)
+        self.assertIs(excepthook.call_args[0][0], IOError)
+        self.assertEqual(len(items), 1)
+
+    def test_threadsafe(self):
+        source = [User(name='user%d' % i, age=i) for i in range(20)]
+        proxy = items.threadsafe()
+        self.assertIs(items.threadsafe(), proxy)
+        added = CheckCalled(items, 'item-added')
+
+        def work():
+            for item in source:
+                proxy.append(item)
+            proxy.remove(source[0])
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertEqual(proxy.queue_depth, 21)
+        refresh_gui()
+        self.assertEqual(proxy.queue_depth, 0)
+        self.assertEqual(list(items), source[1:])
+        self.assertEqual(added.called_count, 20)
+        self.assertEqual(proxy.applied_count, 21)
+        self.assertGreaterEqual(proxy.max_latency, proxy.mean_latency)
+
+    def test_key_identity(self):
+        Row = namedtuple('Row', 'name age')
+        rows = ObjectList([Column('name', str), Column('age', int)],
+                          key=itemgetter(0))
+        first, second = Row('hans', 10), Row('gretel', 10)
+        rows.extend([first, second])
+        self.assertIn(first, rows)
+        self.assertIn('gretel', rows)
+        self.assertIn(Row('hans', 10), rows)
+        self.assertNotIn('witch', rows)
+        self.assertNotIn(['unhashable'], rows)
+        self.assertRaises(ValueError, rows.append, Row('hans', 11))
+        rows.update('hans')
+        rows.remove('gretel')
+        self.assertEqual(list(rows), [first])
+        self.assertRaises(ValueError, rows.remove, 'witch')
+
+    def test_shared_model(self):
+        columns = [Column('name', str), Column('age', int)]
+        overview = ObjectList(columns)
+        detail = ObjectList(columns, shared_model=overview.model_base)
+        self.assertIs(detail.model_base, overview.model_base)
+        overview.extend([user, user2, user3])
+        self.assertIn(user2, detail)
+        detail.set_visible_func(lambda item: item.age > 10)
+        detail.sort_by('age', 'desc')
+        self.assertEqual([row[0] for row in detail.model_sort], [user3, user2])
+        self.assertEqual([row[0] for row in overview.model_sort],
+                         [user, user2, user3])
+        detail.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+        detail.select_items([user2])
+        self.assertFalse(overview.is_selected(user2))
+        detail.remove(user2)
+        self.assertEqual(list(overview), [user, user3])
+
+    def test_shared_model_owner_sort(self):
+        columns = [Column('name', str), Column('age', int)]
+        overview = ObjectList(columns)
+        detail = ObjectList(columns, shared_model=overview.model_base)
+        overview.extend([user, user2, user3])
+        overview.sort_by('age', 'desc')
+        # the owner sorts its own sort model, the shared rows keep their order
+        self.assertEqual([row[0] for row in overview.model_sort],
+                         [user3, user2, user])
+        self.assertEqual([row[0] for row in overview.model_base],
+                         [user, user2, user3])
+        self.assertEqual([row[0] for row in detail.model_sort],
+                         [user, user2, user3])
+
+    def test_visible_func_background(self):
+        items.extend([user, user2, user3])
+        done = CheckCalled(items, 'filter-done')
+        items.set_visible_func(lambda item: item.age > 10, background=True)
+        deadline = time.time() + 5
+        while not done.called and time.time() < deadline:
+            refresh_gui(delay=0.01)
+        self.assertEqual([row[0] for row in items.model_filter],
+                         [user2, user3])
+        self.assertFalse(items.item_visible(user))
+
+    def test_stream_cancel(self):
+        def slow():
+            i = 0
+            while True:
+                i += 1
+                yield User(name='user%d' % i, age=i)
+        task = items.stream_from(slow(), chunk_size=5)
+        refresh_gui(delay=0.05)
+        task.cancel()
+        count = len(items)
+        refresh_gui(delay=0.05)
+        self.assertTrue(task.done)
+        self.assertEqual(len(items), count)
+
+
+class TestSequenceSource(unittest.TestCase):
+    def setUp(self):
+        self.source = [user, user2, user3]
+        self.items = ObjectList([Column('name', str), Column('age', int)],
+                                source=self.source)
+
+    def test_source_not_copied(self):
+        self.assertIs(self.items.model.source, self.source)
+        self.assertEqual(len(self.items), 3)
+        self.assertIs(self.items[1], user2)
+        self.assertEqual(list(self.items), self.source)
+        self.assertIn(user3, self.items)
+
+    def test_source_append_remove(self):
+        user4 = User(name='Mother', age=40)
+        self.items.append(user4)
+        self.assertIs(self.source[-1], user4)
+        self.items.remove(user2)
+        self.assertEqual(self.source, [user, user3, user4])
+        self.assertNotIn(user2, self.items)
+
+    def test_source_positions(self):
+        model = self.items.model
+        user4 = User(name='Mother', age=40)
+        self.items.insert(0, user4)
+        self.items.remove(user2)
+        self.assertEqual(model.position_of_id(id(user3)), 2)
+        self.assertEqual(model.position_of_id(id(user4)), 0)
+        self.assertIsNone(model.position_of_id(id(user2)))
+        # changed behind the model's back
+        self.source.reverse()
+        self.assertEqual(model.position_of_id(id(user3)), 0)
+
+    def test_source_sort_filter_unsupported(self):
+        self.assertRaises(ValueError, self.items.sort_by, 'name')
+        self.assertRaises(ValueError, self.items.set_visible_func,
+                          lambda item: True)
+
+    def test_source_selection(self):
+        self.items.selected_item = user3
+        refresh_gui()
+        self.assertIs(self.items.selected_item, user3)
+        self.items.scroll_to(user3)
+
 
 if __name__ == '__main__':
     unittest.main()
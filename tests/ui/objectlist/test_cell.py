@@ -132,6 +132,36 @@ class TestCell(unittest.TestCase):
         renderer = cell.create_renderer(None, None)
         self.assertEqual(renderer.get_property('size'), 100)
 
+    def test_compiled_values(self):
+        cell = Cell('name', format='<%s>', mapped={'weight': 'weight'})
+        obj = Mock(weight=700)
+        obj.name = 'Hans'
+        self.assertEqual(cell.values_for(obj),
+                         [('weight', 700), ('text', '<Hans>')])
+
+    def test_custom_mapper_not_compiled(self):
+        class Mapper(object):
+            def __call__(self, cell, obj, renderer):
+                renderer.set_property('text', 'custom')
+        cell = Cell('name', mappers=[Mapper()])
+        self.assertIsNone(cell.values_for)
+
+    def test_render_cache(self):
+        format_func = Mock(side_effect=str)
+        cell = Cell('name', format_func=format_func)
+        object_list = Mock(_render_cache={})
+        model = Mock()
+        obj = Mock()
+        model.get_value.return_value = obj
+        renderer = Mock()
+        cell.cell_data_func(None, renderer, model, None, object_list)
+        cell.cell_data_func(None, renderer, model, None, object_list)
+        self.assertEqual(format_func.call_count, 1)
+        self.assertEqual(renderer.set_property.call_count, 2)
+        object_list._render_cache.clear()
+        cell.cell_data_func(None, renderer, model, None, object_list)
+        self.assertEqual(format_func.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
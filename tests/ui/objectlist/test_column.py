@@ -1,11 +1,14 @@
 import unittest
+from unittest import mock
+
 import gi
 
 gi.require_version('Gtk', '3.0')
 
 from gi.repository import Gtk
 from pyGtkHelpers.utils import refresh_gui
-from pyGtkHelpers.ui.objectlist import Column
+from pyGtkHelpers.ui.objectlist import Column, ObjectList
+from .conftest import User
 
 
 class TestColumn(unittest.TestCase):
@@ -42,6 +45,76 @@ class TestColumn(unittest.TestCase):
         tree_view_column = col.create_treecolumn(None)
         self.assertTrue(tree_view_column.props.expand)
 
+    def test_native_column_type(self):
+        self.assertRaises(ValueError, Column, 'test', type=object,
+                          native=True)
+        col = Column('age', int, native=True)
+        self.assertTrue(col.sorts_natively)
+        self.assertFalse(Column('age', int, native=True,
+                                sort_key=abs).sorts_natively)
+
+    def test_native_column_values(self):
+        age = Column('age', int, native=True)
+        items = ObjectList([Column('name', str), age])
+        hans = User('Hans', 10)
+        items.append(hans)
+        idx = items.native_column_index(age)
+        self.assertEqual(idx, 1)
+        self.assertEqual(items.model[0][idx], 10)
+        hans.age = 12
+        items.update(hans)
+        self.assertEqual(items.model[0][idx], 12)
+
+    def test_native_column_sort(self):
+        items = ObjectList([Column('name', str),
+                            Column('age', int, native=True)])
+        old, young = User('Old', 40), User('Young', 4)
+        items.extend([old, young])
+        items.model_sort.set_sort_column_id(items.native_column_index(
+            items.columns[1]), Gtk.SortType.ASCENDING)
+        self.assertEqual([r[0] for r in items.model_sort], [young, old])
+
+    def test_native_column_before_python_column(self):
+        items = ObjectList([Column('age', int, native=True),
+                            Column('name', str)])
+        old, young = User('Adam', 40), User('Zoe', 4)
+        items.extend([old, young])
+        age_col, name_col = items.get_columns()
+        self.assertNotEqual(age_col.get_sort_column_id(),
+                            name_col.get_sort_column_id())
+        self.assertEqual(age_col.get_sort_column_id(),
+                         items.native_column_index(items.columns[0]))
+        items.model_sort.set_sort_column_id(age_col.get_sort_column_id(),
+                                            Gtk.SortType.ASCENDING)
+        self.assertEqual([r[0] for r in items.model_sort], [young, old])
+
+    def test_large_list_fixed_sizing(self):
+        items = ObjectList([Column('name', str), Column('age', int, width=40)],
+                           large_list=True)
+        items.extend([User('Hans', 10), User('Gretel with a long name', 11)])
+        self.assertTrue(items.get_fixed_height_mode())
+        name_col, age_col = items.get_columns()
+        for view_col in (name_col, age_col):
+            self.assertEqual(view_col.get_sizing(),
+                             Gtk.TreeViewColumnSizing.FIXED)
+        width = name_col.get_fixed_width()
+        items.measure_column_widths()
+        self.assertGreaterEqual(name_col.get_fixed_width(), width)
+        self.assertEqual(age_col.get_fixed_width(), 40)
+
+    def test_large_list_measures_on_first_map(self):
+        items = ObjectList([Column('name', str)], large_list=True)
+        window = Gtk.Window()
+        window.add(items)
+        with mock.patch.object(items, 'measure_column_widths') as measure:
+            window.show_all()
+            refresh_gui()
+            window.hide()
+            window.show_all()
+            refresh_gui()
+        window.destroy()
+        self.assertEqual(measure.call_count, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,111 @@
+from pyGtkHelpers.ui.objectlist.columnar import ColumnStore
+
+
+def _store():
+    return ColumnStore({'count': int, 'ratio': float, 'name': str,
+                        'on': bool},
+                       {'count': 0, 'ratio': 0.5, 'on': False}, capacity=2)
+
+
+def test_column_store_defaults():
+    store = _store()
+    slots = [store.allocate() for i in range(5)]
+    assert slots == [0, 1, 2, 3, 4]
+    assert store.capacity >= 5
+    assert [store.get('count', slot) for slot in slots] == [0] * 5
+    assert store.get('ratio', 4) == 0.5
+    assert store.get('name', 3) is None
+    assert store.columns['count'].dtype.kind == 'i'
+    assert store.columns['name'].dtype.kind == 'O'
+
+
+def test_column_store_set():
+    store = _store()
+    slot = store.allocate()
+    store.set('count', slot, 3)
+    store.set('ratio', slot, 2)
+    store.set('name', slot, 'step')
+    assert store.get('count', slot) == 3
+    assert type(store.get('count', slot)) is int
+    assert store.get('ratio', slot) == 2.
+    assert store.get('name', slot) == 'step'
+
+
+def test_column_store_none_stays_typed():
+    store = ColumnStore({'count': int, 'ratio': float}, {'ratio': 0.5},
+                        capacity=2)
+    slots = [store.allocate() for i in range(3)]
+    # no default: typed, with every value missing
+    assert store.columns['count'].dtype.kind == 'i'
+    assert store.get('count', slots[2]) is None
+    store.set('count', slots[0], 4)
+    store.set('ratio', slots[1], None)
+    assert store.columns['ratio'].dtype.kind == 'f'
+    assert store.get('count', slots[0]) == 4
+    assert store.get('ratio', slots[1]) is None
+    assert list(store.get_many('count', slots)) == [4, None, None]
+    assert store.get_many('ratio', slots[::2]).dtype.kind == 'f'
+    store.set_many('count', slots, [1, None, 3])
+    assert [store.get('count', slot) for slot in slots] == [1, None, 3]
+    store.fill('count', slots[:2], None)
+    assert store.get('count', slots[0]) is None
+    store.release(slots[2])
+    assert store.get('count', store.allocate()) is None
+
+
+def test_column_store_promotes():
+    store = _store()
+    first, second = store.allocate(), store.allocate()
+    store.set('count', first, 4)
+    store.set('count', second, None)
+    store.set('count', first, 'four')
+    assert store.columns['count'].dtype.kind == 'O'
+    assert 'count' not in store.missing
+    assert store.get('count', first) == 'four'
+    assert store.get('count', second) is None
+    store.set('on', first, 1)
+    assert store.get('on', first) == 1
+    assert store.get('on', second) is False
+
+
+def test_column_store_release():
+    store = _store()
+    slot = store.allocate()
+    store.set('count', slot, 7)
+    store.set('name', slot, 'step')
+    store.release(slot)
+    assert store.allocate() == slot
+    assert store.get('count', slot) == 0
+    assert store.get('name', slot) is None
+
+
+def test_column_store_set_many():
+    store = _store()
+    slots = [store.allocate() for i in range(4)]
+    store.set_many('count', slots[1:3], [5, 6])
+    assert [store.get('count', slot) for slot in slots] == [0, 5, 6, 0]
+    store.fill('ratio', slots, 2)
+    assert store.columns['ratio'].dtype.kind == 'f'
+    assert [store.get('ratio', slot) for slot in slots] == [2.] * 4
+    store.set_many('name', slots[:2], [('a', 1), ('b', 2)])
+    assert store.get('name', slots[1]) == ('b', 2)
+    store.set_many('count', slots[:2], [1, 'many'])
+    assert store.columns['count'].dtype.kind == 'O'
+    assert store.get('count', slots[1]) == 'many'
+    assert store.get('count', slots[2]) == 6
+
+
+def test_column_store_copy_slot():
+    store = _store()
+    source, target = store.allocate(), store.allocate()
+    store.add_column('repeats', int)
+    store.set('count', source, None)
+    store.set('ratio', source, 1.5)
+    store.set('name', source, 'rinse')
+    store.set('repeats', source, 2)
+    store.copy_slot(source, target)
+    assert [store.get(name, target) for name in
+            ('count', 'ratio', 'name', 'on', 'repeats')] == \
+        [None, 1.5, 'rinse', False, 2]
+    store.set('count', target, 4)
+    assert store.get('count', source) is None
@@ -0,0 +1,228 @@
+import copy
+import io
+import pickle
+
+from flatland import Form, Integer, String
+import pandas as pd
+import pytest
+
+from pyGtkHelpers.test import CheckCalled
+from pyGtkHelpers.ui.objectlist.combined_fields import (CombinedFields,
+                                                       CombinedRow,
+                                                       ColumnarRow)
+
+
+def _forms():
+    return {'step': Form.of(String.named('name').using(default=''),
+                            Integer.named('count').using(default=0),
+                            Integer.named('repeats'))}
+
+
+def _combined_fields(**kwargs):
+    return CombinedFields(_forms(), None, **kwargs)
+
+
+def _rows(combined_fields, count):
+    return [CombinedRow(combined_fields) for i in range(count)]
+
+
+def _row_ids(combined_fields):
+    return [combined_fields.row_id_of(row) for row in combined_fields]
+
+
+def test_row_ids_append():
+    combined_fields = _combined_fields()
+    for row in _rows(combined_fields, 3):
+        combined_fields.append(row)
+    assert _row_ids(combined_fields) == [1, 2, 3]
+
+
+def test_row_ids_insert_first():
+    combined_fields = _combined_fields()
+    combined_fields.extend(_rows(combined_fields, 2))
+    first = CombinedRow(combined_fields)
+    combined_fields.insert(0, first)
+    assert combined_fields[0] is first
+    assert _row_ids(combined_fields) == [1, 2, 3]
+
+
+def test_row_ids_redrawn():
+    combined_fields = _combined_fields()
+    combined_fields.extend(_rows(combined_fields, 2))
+    changed = []
+    combined_fields.model.connect(
+        'row-changed', lambda model, path, itr: changed.append(path[0]))
+    combined_fields.insert(0, CombinedRow(combined_fields))
+    # the rows after the inserted one got new ids
+    assert {1, 2} <= set(changed)
+
+
+def test_row_ids_remove_filtered_out():
+    combined_fields = _combined_fields()
+    rows = _rows(combined_fields, 4)
+    combined_fields.extend(rows)
+    rows[1].set_row_fields_attr('step', 'count', 1)
+    combined_fields.set_visible_func(
+        lambda row: row.get_row_fields('step').count == 0)
+    combined_fields.remove(rows[1])
+    assert _row_ids(combined_fields) == [1, 2, 3]
+    assert combined_fields.row_id_of(rows[2]) == 2
+
+
+def test_row_ids_nested_deferred():
+    combined_fields = _combined_fields()
+    combined_fields.extend(_rows(combined_fields, 2))
+    first, last = _rows(combined_fields, 2)
+    with combined_fields.deferred_row_ids():
+        with combined_fields.deferred_row_ids():
+            combined_fields.insert(0, first)
+        # renumbered when the outer block exits
+        assert combined_fields.row_id_of(first) == 0
+        combined_fields.append(last)
+    assert _row_ids(combined_fields) == [1, 2, 3, 4]
+
+
+def test_row_ids_lazy():
+    combined_fields = _combined_fields(lazy_ids=True)
+    rows = _rows(combined_fields, 3)
+    combined_fields.extend(rows)
+    combined_fields.remove(rows[0])
+    combined_fields.insert(1, rows[0])
+    assert _row_ids(combined_fields) == [1, 2, 3]
+    assert getattr(rows[0], combined_fields._row_id_attr) == 2
+
+
+def test_columnar_row():
+    combined_fields = _combined_fields(columnar=True)
+    row = CombinedRow(combined_fields, {'step': {'name': 'wash'}})
+    assert isinstance(row, ColumnarRow)
+    assert isinstance(row, CombinedRow)
+    combined_fields.append(row)
+    count_attr = row._attr_name('step', 'count')
+    assert getattr(row, count_attr) == 0
+    setattr(row, count_attr, 3)
+    assert row.get_row_fields('step').count == 3
+    row.get_row_fields('step').repeats = 2
+    assert row.attributes['step'].attrs == {'name': 'wash', 'count': 3,
+                                            'repeats': 2}
+    assert combined_fields.row_id_of(row) == 1
+
+
+def test_columnar_missing_values_stay_typed():
+    combined_fields = _combined_fields(columnar=True)
+    row = CombinedRow(combined_fields)
+    repeats_attr = row._attr_name('step', 'repeats')
+    # an Integer field without a default is None, in a typed column
+    assert getattr(row, repeats_attr) is None
+    assert combined_fields.store.columns[repeats_attr].dtype.kind == 'i'
+    setattr(row, repeats_attr, 5)
+    setattr(row, repeats_attr, None)
+    assert getattr(row, repeats_attr) is None
+    assert combined_fields.store.columns[repeats_attr].dtype.kind == 'i'
+
+
+def test_columnar_row_copy():
+    combined_fields = _combined_fields(columnar=True)
+    store = combined_fields.store
+    row = CombinedRow(combined_fields, {'step': {'name': 'wash',
+                                                 'count': 3}})
+    for copy_row in (copy.copy, copy.deepcopy):
+        clone = copy_row(row)
+        assert clone.slot != row.slot
+        assert clone.get_row_fields('step').attrs == \
+            row.get_row_fields('step').attrs
+        clone.get_row_fields('step').count = 4
+        assert row.get_row_fields('step').count == 3
+        del clone
+    # each copy released its own slot, once
+    assert len(store._free) == len(set(store._free))
+    assert row.slot not in store._free
+
+
+def test_columnar_row_pickle():
+    combined_fields = _combined_fields(columnar=True)
+    row = CombinedRow(combined_fields, {'step': {'name': 'wash',
+                                                 'count': 3}})
+
+    # the rows are pickled with a reference to their (unpicklable) view
+    class Pickler(pickle.Pickler):
+        def persistent_id(self, obj):
+            return 'fields' if obj is combined_fields else None
+
+    class Unpickler(pickle.Unpickler):
+        def persistent_load(self, persistent_id):
+            return combined_fields
+
+    data = io.BytesIO()
+    Pickler(data).dump(row)
+    data.seek(0)
+    clone = Unpickler(data).load()
+    assert isinstance(clone, ColumnarRow)
+    assert clone.slot != row.slot
+    assert clone.get_row_fields('step').attrs == \
+        row.get_row_fields('step').attrs
+
+
+def test_columnar_lazy_ids():
+    combined_fields = _combined_fields(columnar=True, lazy_ids=True)
+    rows = _rows(combined_fields, 3)
+    combined_fields.extend(rows)
+    combined_fields.remove(rows[0])
+    assert _row_ids(combined_fields) == [1, 2]
+    assert getattr(rows[2], combined_fields._row_id_attr) == 2
+
+
+def _set_values(columnar):
+    combined_fields = _combined_fields(columnar=columnar)
+    rows = _rows(combined_fields, 4)
+    combined_fields.extend(rows)
+    count_attr = '%scount' % (combined_fields.field_set_prefix %
+                              combined_fields.uuid_mapping['step'])
+    changed = CheckCalled(combined_fields, 'rows-changed')
+    combined_fields.set_values([1, 3], count_attr, [5, 7])
+    assert changed.called_count == 1
+    assert changed.called[1] == (1, 3)
+    assert changed.called[3] == count_attr
+    assert [getattr(row, count_attr) for row in rows] == [0, 5, 0, 7]
+    combined_fields.set_values(range(3), count_attr, 2, broadcast=True)
+    assert changed.called_count == 2
+    assert changed.called[1] == (0, 1, 2)
+    assert [getattr(row, count_attr) for row in rows] == [2, 2, 2, 7]
+    # a sequence is one value per row unless broadcast
+    with pytest.raises(ValueError):
+        combined_fields.set_values([0, 1, 2], count_attr, (1, 2))
+    assert changed.called_count == 2
+    return combined_fields, count_attr
+
+
+def test_set_values():
+    _set_values(columnar=False)
+
+
+def test_set_values_columnar():
+    combined_fields, count_attr = _set_values(columnar=True)
+    assert combined_fields.store.columns[count_attr].dtype.kind == 'i'
+
+
+def test_frame_round_trip():
+    data_frame = pd.DataFrame({('step', 'name'): ['wash', 'dry', 'spin'],
+                               ('step', 'count'): [3, 4, 5]})
+    combined_fields = CombinedFields.from_frame(data_frame, _forms())
+    count_attr = '%scount' % (combined_fields.field_set_prefix %
+                              combined_fields.uuid_mapping['step'])
+    assert combined_fields.store.columns[count_attr].dtype.kind == 'i'
+    assert _row_ids(combined_fields) == [1, 2, 3]
+    assert combined_fields[1].get_row_fields('step').name == 'dry'
+    frame = combined_fields.to_frame()
+    assert list(frame.index) == [1, 2, 3]
+    assert frame[('step', 'count')].dtype.kind == 'i'
+    assert list(frame[('step', 'count')]) == [3, 4, 5]
+    assert list(frame[('step', 'name')]) == ['wash', 'dry', 'spin']
+    # fields without a column keep their (missing) default
+    assert list(frame[('step', 'repeats')]) == [None] * 3
+
+
+def test_from_frame_invalid_columns():
+    for column in ('count', ('step', 'unknown'), ('other', 'count')):
+        with pytest.raises(ValueError):
+            CombinedFields.from_frame(pd.DataFrame({column: [1]}), _forms())
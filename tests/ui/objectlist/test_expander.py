@@ -1,6 +1,11 @@
+import threading
+
 import py
+from gi.repository import Gtk
 from pyGtkHelpers.utils import refresh_gui
 from pyGtkHelpers.test import CheckCalled
+from pyGtkHelpers.ui.objectlist import ObjectTree, Column
+from .conftest import User
 
 @py.test.mark.tree_only
 def test_tree_expander_column(items):
@@ -62,3 +67,67 @@ def test_item_expanded(items, user, user2):
     assert not items.item_expanded(user)
 
 
+def _lazy_tree(**kwargs):
+    loaded = []
+
+    def children_loader(item):
+        loaded.append(item)
+        return [User(name='%s/%d' % (item.name, i), age=i) for i in range(3)]
+
+    tree = ObjectTree([Column('name', str), Column('age', int)],
+                      children_loader=children_loader,
+                      has_children=lambda item: item.age < 2, **kwargs)
+    roots = [User(name='root', age=0), User(name='other', age=1)]
+    tree.extend(roots)
+    return tree, roots, loaded
+
+
+def test_lazy_children():
+    tree, (root, other), loaded = _lazy_tree()
+    assert tree.item_has_child(root)
+    assert list(tree) == [root, other]
+    assert loaded == []
+    tree.expand_item(root)
+    refresh_gui()
+    assert loaded == [root]
+    children = list(tree)[1:4]
+    assert [c.name for c in children] == ['root/0', 'root/1', 'root/2']
+    # only the children declaring children get an expander, and open_all
+    # does not load them
+    assert tree.item_has_child(children[0])
+    assert not tree.item_has_child(children[2])
+    # expanding again does not reload
+    tree.collapse_item(root)
+    tree.expand_item(root)
+    assert loaded == [root]
+
+
+def test_lazy_children_cache():
+    tree, (root, other), loaded = _lazy_tree(loaded_cache_size=1)
+    for item in (root, other):
+        tree.expand_item(item, open_all=False)
+        tree.collapse_item(item)
+    refresh_gui()
+    # the children of the least recently collapsed node were dropped
+    assert len(list(tree)) == 5
+    assert tree.item_has_child(root)
+    tree.expand_item(root, open_all=False)
+    assert loaded == [root, other, root]
+
+
+def test_lazy_placeholder_not_selected():
+    release = threading.Event()
+
+    def wait(item):
+        release.wait(5)
+        return []
+
+    tree, (root, other), loaded = _lazy_tree(threaded_loading=True)
+    tree.children_loader = wait
+    tree.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+    # the placeholder row stays while the children load
+    tree.expand_item(root, open_all=False)
+    tree.select_range(0, 1)
+    assert None not in tree.selected_items
+    assert tree.get_selection().count_selected_rows() == 2
+    release.set()
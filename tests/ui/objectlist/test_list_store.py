@@ -0,0 +1,49 @@
+import gi
+
+gi.require_version('Gtk', '3.0')
+
+import pandas as pd
+
+from pyGtkHelpers.ui.objectlist import get_py_dtypes, get_list_store
+
+
+def _frame():
+    return pd.DataFrame({'name': ['wash', 'dry'], 'count': [3, 4],
+                         'ratio': [0.5, 1.5], 'on': [True, False],
+                         'mixed': ['a', 1]})
+
+
+def test_get_py_dtypes():
+    df_py_dtypes = get_py_dtypes(_frame())
+    assert list(df_py_dtypes.i) == [0, 1, 2, 3, 4]
+    assert list(df_py_dtypes.dtype) == [str, int, float, bool, object]
+
+
+def test_get_py_dtypes_missing_strings():
+    data_frame = pd.DataFrame({'name': pd.Series(['wash', None],
+                                                 dtype=object)})
+    df_py_dtypes = get_py_dtypes(data_frame)
+    assert df_py_dtypes.dtype['name'] is object
+
+
+def test_get_py_dtypes_empty():
+    data_frame = pd.DataFrame({'name': pd.Series([], dtype=object)})
+    assert list(get_py_dtypes(data_frame).dtype) == [str]
+
+
+def test_get_list_store():
+    df_py_dtypes, list_store = get_list_store(_frame())
+    assert len(list_store) == 2
+    assert list(list_store[0]) == ['wash', 3, 0.5, True, 'a']
+    assert list(list_store[1]) == ['dry', 4, 1.5, False, 1]
+
+
+def test_get_py_dtypes_mixed_past_sample():
+    # a value of another type far from the first rows still makes the
+    # column an object column
+    names = ['name %d' % i for i in range(5000)]
+    names[4321] = 7
+    data_frame = pd.DataFrame({'name': pd.Series(names, dtype=object)})
+    assert get_py_dtypes(data_frame).dtype['name'] is object
+    df_py_dtypes, list_store = get_list_store(data_frame)
+    assert list_store[4321][0] == 7
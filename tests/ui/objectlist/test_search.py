@@ -1,5 +1,8 @@
+from operator import attrgetter
+
 import gtk
 from pyGtkHelpers.utils import refresh_gui
+from pyGtkHelpers.ui.objectlist import ObjectList, ObjectTree, Column
 from .conftest import User
 
 def pytest_funcarg__searchcheck(request):
@@ -61,3 +64,47 @@ def _search_missing_func(item, key):
 def test_search_missing_func(searchcheck):
     searchcheck.ol.search_by(_search_missing_func)
     searchcheck.assert_selects('z', None)
+
+
+def test_find_indexed():
+    ol = ObjectList([Column('name', str, searchable=True, search_index=True),
+                     Column('age', int)])
+    hans, gretel = User(name='Hansel', age=10), User(name='Gretel', age=11)
+    ol.extend([hans, gretel])
+    assert ol.find('name', 'EL') == [hans, gretel]
+    assert ol.find('name', 'ansel') == [hans]
+    gretel.name = 'Grethansel'
+    ol.update(gretel)
+    assert ol.find('name', 'ansel') == [hans, gretel]
+    ol.remove(hans)
+    assert ol.find('name', 'ansel') == [gretel]
+    assert ol.find('age', '1') == [gretel]
+
+
+def test_find_after_set_items():
+    ol = ObjectList([Column('name', str, searchable=True, search_index=True),
+                     Column('age', int)])
+    hans, gretel = User(name='Hansel', age=10), User(name='Gretel', age=11)
+    ol.extend([hans, gretel])
+    assert ol.find('name', 'ansel') == [hans]
+    # a kept row changed in place, a replaced row brings a new object
+    hans.name = 'Hanselmann'
+    gretel2 = User(name='Gretel', age=12)
+    ol.set_items([hans, gretel2], key=attrgetter('name'))
+    assert ol.find('name', 'mann') == [hans]
+    assert ol.find('name', 'gret') == [gretel2]
+
+
+def test_find_indexed_tree_siblings():
+    tree = ObjectTree([Column('name', str, searchable=True,
+                              search_index=True)])
+    hans, gretel = User(name='Hansel', age=10), User(name='Gretel', age=11)
+    witch = User(name='Witch', age=409)
+    tree.append(hans)
+    # build the index before the other items are inserted
+    assert tree.find('name', 'ansel') == [hans]
+    tree.insert_before(hans, gretel)
+    tree.insert_after(hans, witch)
+    assert list(tree) == [gretel, hans, witch]
+    assert tree.find('name', 'gret') == [gretel]
+    assert tree.find('name', 'itc') == [witch]
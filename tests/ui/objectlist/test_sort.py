@@ -1,4 +1,6 @@
+import time
 import unittest
+
 import gi
 
 gi.require_version('Gtk', '3.0')
@@ -8,6 +10,7 @@ from pyGtkHelpers.ui.objectlist import ObjectList, Column
 from pyGtkHelpers.utils import refresh_gui
 from pyGtkHelpers.test import CheckCalled
 from unittest.mock import Mock
+from .conftest import User
 
 
 def _sort_key(obj):
@@ -21,6 +24,20 @@ class TestSort(unittest.TestCase):
         items.sort_by('name')
         assert items.model_sort.has_default_sort_func()
 
+    def test_sort_by_attr_resort_on_update(self, items, user, user2, user3):
+        items.extend([user, user2, user3])
+        items.sort_by('name')
+        user3.name = 'Anna'
+        items.update(user3)
+        refresh_gui()
+        it = [i[0] for i in items.model_sort]
+        assert it[0] is user3
+        user3.name = 'Witch'
+        items.update(user3)
+        refresh_gui()
+        it = [i[0] for i in items.model_sort]
+        assert it[-1] is user3
+
     def test_sort_by_attr_asc(self, items, user, user2, user3):
         items.extend([user, user2, user3])
         assert items[0] is user
@@ -71,11 +88,15 @@ class TestSort(unittest.TestCase):
         assert items[1] is user2
         assert items[2] is user3
         # simulate a click on the header
-        items.model_sort.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+        items.get_columns()[0].clicked()
         it = [i[0] for i in items.model_sort]
         assert it[0] is user2
         assert it[1] is user
         assert it[2] is user3
+        # only the view is sorted
+        assert items[0] is user
+        assert items[1] is user2
+        assert items[2] is user3
 
     def test_sort_by_col_desc(self, items, user, user2, user3):
         items.extend([user, user2, user3])
@@ -86,11 +107,71 @@ class TestSort(unittest.TestCase):
         ui = items._sort_iter_for(user)
         print(items.model_sort.iter_next(ui))
         # simulate a click on the header
-        items.model_sort.set_sort_column_id(0, Gtk.SortType.DESCENDING)
+        items.get_columns()[0].clicked()
+        items.get_columns()[0].clicked()
         it = [i[0] for i in items.model_sort]
         assert it[0] is user3
         assert it[1] is user
         assert it[2] is user2
+        assert list(items) == [user, user2, user3]
+
+    def test_sort_by_header_ranks(self, items):
+        if not isinstance(items.model, Gtk.ListStore):
+            return
+        hans, gretel, witch, ida = [User(name=name, age=age) for name, age
+                                    in (('Hans', 10), ('Gretel', 11),
+                                        ('Witch', 409), ('Ida', 3))]
+        items.extend([hans, gretel, witch])
+        name_col = items.get_columns()[0]
+        name_col.clicked()
+        # the sort model sorts the rank column, the rows keep their order
+        assert (items.model_sort.get_sort_column_id()[0] ==
+                items._rank_column)
+        assert list(items) == [hans, gretel, witch]
+        assert name_col.get_sort_indicator()
+        # added and updated rows are ranked among the others
+        items.append(ida)
+        gretel.name = 'Zora'
+        items.update(gretel)
+        it = [i[0] for i in items.model_sort]
+        assert it == [hans, ida, witch, gretel]
+        assert list(items) == [hans, gretel, witch, ida]
+        # sort_by() takes over, reordering the rows
+        items.sort_by('age')
+        assert not name_col.get_sort_indicator()
+        assert items.model_sort.get_sort_column_id()[0] is None
+        assert list(items) == [ida, hans, gretel, witch]
+
+    def test_sort_by_discards_old_keys(self, items, user, user2, user3):
+        items.extend([user, user2, user3])
+        for i in range(3):
+            items.sort_by(lambda item: item.age)
+            refresh_gui()
+        assert len(items._sort_engine._keys) <= 1
+
+    def test_sort_by_background(self, items, user, user2, user3):
+        items.extend([user, user2, user3])
+        items.sort_by('age', 'desc', background=True)
+        done = CheckCalled(items, 'sort-done')
+        items.sort_by('name', background=True)
+        deadline = time.time() + 5
+        while not done.called and time.time() < deadline:
+            refresh_gui(delay=0.01)
+        it = [i[0] for i in items.model_sort]
+        # the superseded sort by age was discarded
+        assert it == [user2, user, user3]
+        assert done.called_count == 1
+
+    def test_sort_by_background_rows_added(self, items, user, user2, user3):
+        items.extend([user, user3])
+        done = CheckCalled(items, 'sort-done')
+        items.sort_by('name', background=True)
+        # added before the sort order arrives
+        items.append(user2)
+        deadline = time.time() + 5
+        while not done.called and time.time() < deadline:
+            refresh_gui(delay=0.01)
+        assert list(items) == [user2, user, user3]
 
     def test_sort_item_activated(self, items, user, user2, user3):
         items.extend([user, user2, user3])
@@ -0,0 +1,141 @@
+from gi.repository import Gtk
+from pyGtkHelpers.ui.objectlist import ObjectTree, Column
+from pyGtkHelpers.ui.objectlist.tree_index import TreeIndex
+from .conftest import User
+
+
+def _build():
+    # a
+    #   b
+    #     c
+    #   d
+    # e
+    a, b, c, d, e = [User(name=n, age=0) for n in 'abcde']
+    tree = ObjectTree([Column('name', str)])
+    tree.append(a)
+    tree.append(b, a)
+    tree.append(c, b)
+    tree.insert_after(b, d)
+    tree.append(e)
+    return tree, (a, b, c, d, e)
+
+
+def test_tree_index():
+    index = TreeIndex()
+    a, b, c = object(), object(), object()
+    index.add(a)
+    index.add(c, a)
+    index.add(b, a, 0)
+    assert list(index) == [a, b, c]
+    assert index.depth_of(c) == 1
+    assert index.path_of(c) == (0, 1)
+    assert index.preorder_of(c) == 2
+    assert index.remove(a) == [b, c]
+    assert len(index) == 0
+
+
+def test_tree_iter():
+    tree, (a, b, c, d, e) = _build()
+    assert list(tree) == [a, b, c, d, e]
+    assert tree._get_children(a) == [a, b, c, d]
+
+
+def test_is_subtree():
+    tree, (a, b, c, d, e) = _build()
+    assert tree.is_subtree([b, c])
+    assert tree.is_subtree([b, c, d])
+    assert not tree.is_subtree([b])
+    assert not tree.is_subtree([b, d])
+    assert not tree.is_subtree([c, d])
+
+
+def test_tree_index_remove_by_identity():
+    index = TreeIndex()
+    # equal, but different items
+    first, second = User(name='a', age=0), User(name='a', age=0)
+    index.add(first)
+    index.add(second)
+    index.remove(second)
+    assert index.children_of(None)[0] is first
+    assert index.position_of(first) == 0
+    index.add(second)
+    index.remove(second)
+    assert index.children_of(None)[0] is first
+
+
+def test_tree_index_positions_updated_in_place():
+    index = TreeIndex()
+    a, b, c, d = [object() for i in range(4)]
+    index.add(a)
+    index.add(b)
+    assert index.position_of(b) == 1
+    positions = index._positions
+    index.add(c, None, 0)
+    index.remove(a)
+    index.add(d, None, 1)
+    # renumbered, not rebuilt
+    assert index._positions is positions
+    assert [index.position_of(item) for item in (c, d, b)] == [0, 1, 2]
+
+
+def test_subtree_paths():
+    tree, (a, b, c, d, e) = _build()
+    subtree = tree.get_subtree([b, c, d], relative=True)
+    assert subtree.item_paths == [(0, ), (0, 0), (1, )]
+
+
+def test_remove_items():
+    tree, (a, b, c, d, e) = _build()
+    tree.remove_items([c, a, b, d])
+    assert list(tree) == [e]
+    assert c not in tree
+
+
+def test_copy_subtree_is_copy_on_write():
+    tree, (a, b, c, d, e) = _build()
+    clones = []
+
+    def clone(item):
+        clones.append(item)
+        return User(name=item.name, age=item.age)
+
+    subtree = tree.copy_subtree([b, c, d], clone=clone)
+    assert subtree.items == [b, c, d]
+    assert subtree.items[0] is b
+    assert clones == []
+    copied = subtree.writable_item(1)
+    assert copied is not c
+    assert clones == [c]
+    # an item about to change in the tree is cloned for the copy first
+    tree.detach_copies(b)
+    b.name = 'changed'
+    assert clones == [c, b]
+    assert subtree.items[0].name == 'b'
+    tree.detach_copies(b)
+    assert clones == [c, b]
+    tree.insert_subtree_after(subtree, e)
+    # the first paste inserts the clones and the item still shared
+    assert clones == [c, b, d]
+    assert [item.name for item in tree][-3:] == ['b', 'c', 'd']
+    # pasting again inserts fresh clones
+    tree.insert_subtree_after(subtree, e)
+    assert len(clones) == 6
+    assert len(list(tree)) == 11
+
+
+def test_cut_subtree_keeps_items():
+    tree, (a, b, c, d, e) = _build()
+    subtree = tree.cut_subtree([b, c, d])
+    assert subtree.items[0] is b
+    assert list(tree) == [a, e]
+    tree.insert_subtree_after(subtree, e)
+    assert list(tree)[-3:] == [b, c, d]
+
+
+def test_sort_keeps_selected_children_in_view_order():
+    tree, (a, b, c, d, e) = _build()
+    tree.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+    tree.expand_all()
+    tree.selected_items = [b, d]
+    tree.sort_by('name', 'desc')
+    assert tree.selected_items == [d, b]